@@ -3,7 +3,33 @@
 # For more information, please refer to the LICENSE file in the root directory of this project.
 
 from mmm import db, create_app
+from mmm.tools import clear_metrics_dir
 from flask import current_app
+from flask_migrate import upgrade, stamp
+import sqlalchemy as sa
+
+# Revision that matches the schema of databases created with db.create_all() before migrations were introduced
+LEGACY_SCHEMA_REVISION = "0001"
+
+def upgrade_db() -> None:
+    """
+    Creates or updates the database schema with the migrations in migrations/.
+
+    Databases that were created with db.create_all() (before migrations were introduced) do not have an
+    alembic_version table yet. They are stamped with the initial revision first, so that only the later
+    migrations are applied.
+
+    Returns
+    -------
+        None
+    """
+    print("Updating database schema...")
+    existing_tables = sa.inspect(db.engine).get_table_names()
+    if "users" in existing_tables and "alembic_version" not in existing_tables:
+        print("Existing database without migration history found, stamping initial revision.")
+        stamp(revision=LEGACY_SCHEMA_REVISION)
+    upgrade()
+    print("Database schema is up to date.")
 
 def create_admin() -> None:
     """
@@ -45,6 +71,9 @@ def search_admin_env() -> tuple:
         return ("admin", "admin")
 
 if __name__ == "__main__":
+    # Runs before gunicorn and the job worker start (see Dockerfile), so no process uses the metric files yet
+    clear_metrics_dir()
     app = create_app()
     with app.app_context():
+        upgrade_db()
         create_admin()
\ No newline at end of file
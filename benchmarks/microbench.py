@@ -0,0 +1,297 @@
+# Copyright (c) 2024 Thomas Jurczyk
+# This software is provided under the MIT License.
+# For more information, please refer to the LICENSE file in the root directory of this project.
+
+## MICRO-BENCHMARKS
+## Benchmarks of the hot functions of mmm.maker_project.tools (file lookups and registration, output registration of
+## the Maker steps, project lists, project deletion, VerifyBibTeX report, ZIP downloads). The functions run inside an
+## app and request context (logged-in user) against a synthetic dataset: thousands of projects with tens of thousands
+## of files in a SQLite database (created with the migrations), project folders with real files, and a large
+## VerifyBibTeX report. The results (milliseconds per call) are compared with the baselines in
+## benchmarks/baselines/microbench.json; --save-baseline stores the current results as new baselines.
+##
+## Usage (from the root directory of the repository):
+##   python benchmarks/microbench.py
+##   python benchmarks/microbench.py --only file_exists,register_file_in_db --repeat 50
+##   python benchmarks/microbench.py --max-ratio 1.5      # exit code 1 if a median is 50% slower than its baseline
+##   python benchmarks/microbench.py --save-baseline
+
+import argparse, json, os, platform, random, shutil, statistics, sys, tempfile, time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(REPO_PATH, "benchmarks", "baselines", "microbench.json")
+sys.path.insert(0, REPO_PATH)
+
+CONFIG_TEMPLATE = """SECRET_KEY = 'microbench'
+SQLALCHEMY_DATABASE_URI = {database_url!r}
+LOG_FILE = {log_file!r}
+UPLOAD_PATH = {upload_path!r}
+MAIL_SUPPRESS_SEND = True
+MMM_MAIL_SUBJECT_PREFIX = '[MMM] '
+MMM_MAIL_SENDER = 'microbench@example.org'
+"""
+
+USER_COUNT = 50
+# Files of a project after a full Maker run (the rest of the files of the synthetic projects are numbered figures)
+PROJECT_FILES = ["README.md", "article.docx", "article.xml", "references.bib", "raw_markdown.md", "clean_markdown.md", "doc2md.log", "metadata.yaml", "verifybibtex-report.md", "default.pdf", "default.html", "default.jats", "default.tex", "default.PROCESS.log"]
+REPORT_SECTION = "## key{index} (line {line})\n\n- Missing required field 'year'.\n- Field 'title' is empty.\n"
+
+def write_file(path: str, content: bytes) -> None:
+    '''Function to replace a file (never written in place: the file may be a hardlink into the blob store).'''
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(content)
+    os.replace(temp_path, path)
+
+def get_file_names(count: int) -> List[str]:
+    return (PROJECT_FILES + [f"figure-{index}.png" for index in range(count)])[:count]
+
+def measure(function: Callable[[], object], repeat: int, warmup: int, setup: Optional[Callable[[], None]] = None, teardown: Optional[Callable[[], None]] = None) -> Dict[str, float]:
+    '''Function to time a function (setup and teardown run before/after every call and are not timed).
+
+        Returns
+        -------
+        Dict[str, float] : Runs and min/median/p95/mean duration in milliseconds.
+    '''
+    durations = []
+    for run in range(warmup + repeat):
+        if setup:
+            setup()
+        started_at = time.perf_counter()
+        function()
+        duration = time.perf_counter() - started_at
+        if teardown:
+            teardown()
+        if run >= warmup:
+            durations.append(duration * 1000)
+    durations.sort()
+    return {
+        "runs": repeat,
+        "min": round(durations[0], 4),
+        "median": round(statistics.median(durations), 4),
+        "p95": round(durations[min(len(durations) - 1, int(0.95 * len(durations)))], 4),
+        "mean": round(statistics.fmean(durations), 4),
+    }
+
+class Dataset:
+    '''Synthetic dataset: users, projects, user-project relations, files, and file versions (bulk inserts), plus
+    the project folders of the benchmark user that the benchmarks work on.'''
+
+    def __init__(self, args: argparse.Namespace):
+        from mmm import db
+        from mmm.auth.models import User
+        from mmm.maker_project.models import File, FileVersion, Project, UserProject
+        from werkzeug.security import generate_password_hash
+        self.args = args
+        now = datetime.now()
+        pwdhash = generate_password_hash("microbench")
+        db.session.execute(User.__table__.insert(), [{"username": f"user{index}", "email": f"user{index}@example.org", "pwdhash": pwdhash, "admin": False} for index in range(USER_COUNT)])
+        # user0 is the benchmark user: it owns every 10th project and every 20th project is shared with it
+        owners = [0 if index % 10 == 0 else 1 + index % (USER_COUNT - 1) for index in range(args.projects)]
+        db.session.execute(Project.__table__.insert(), [{"path": f"uploads/user{owner}", "project_name": f"project-{index}", "created_at": now, "changed_at": now} for index, owner in enumerate(owners)])
+        project_ids = [row[0] for row in db.session.query(Project.id).order_by(Project.id).all()]
+        # The database is empty, so user<n> has the ID n + 1
+        user_projects = [{"user_id": owner + 1, "project_id": project_id, "permission": "rwd", "creator": True} for project_id, owner in zip(project_ids, owners)]
+        user_projects += [{"user_id": 1, "project_id": project_id, "permission": "r", "creator": False} for index, project_id in enumerate(project_ids) if index % 20 == 1]
+        db.session.execute(UserProject.__table__.insert(), user_projects)
+        file_names = get_file_names(args.files_per_project)
+        for start in range(0, len(project_ids), 500):
+            rows = [{"filename": file_name, "project_id": project_id, "created_by": 1, "created_at": now, "changed_at": now, "production_file": False, "download_number": 0, "version": 1} for project_id in project_ids[start:start + 500] for file_name in file_names]
+            db.session.execute(File.__table__.insert(), rows)
+        # Every 5th file has an old version
+        file_ids = [row[0] for row in db.session.query(File.id).filter(File.id % 5 == 0).all()]
+        db.session.execute(FileVersion.__table__.insert(), [{"file_id": file_id, "version": 1, "size": 1024, "created_at": now} for file_id in file_ids])
+        db.session.commit()
+        self.user = User.query.filter_by(username="user0").one()
+        self.project = Project.query.filter_by(project_name="project-0").one()
+        self.dir_path = os.path.join(self.project.path, self.project.project_name)
+        self.file_count = len(project_ids) * len(file_names)
+        self.version_count = len(file_ids)
+
+    def create_project_folder(self) -> None:
+        '''Function to create the folder of the benchmark project with the files of a full Maker run.'''
+        os.makedirs(self.dir_path, exist_ok=True)
+        for file_name in get_file_names(self.args.files_per_project):
+            write_file(os.path.join(self.dir_path, file_name), os.urandom(16 * 1024))
+        sections = [REPORT_SECTION.format(index=index, line=index * 6 + 1) for index in range(self.args.report_entries)]
+        report = f"# VerifyBibTeX report\n\nFile: references.bib\n\nChecked {self.args.report_entries} entries.\n\n" + "\n".join(sections) + f"\nFound {2 * self.args.report_entries} errors.\n"
+        write_file(os.path.join(self.dir_path, "verifybibtex-report.md"), report.encode())
+
+    def create_zip_folder(self) -> str:
+        '''Function to create a project folder for the ZIP benchmarks (half compressible text, half PDFs).'''
+        dir_path = os.path.join(self.project.path, "zip-project")
+        os.makedirs(dir_path, exist_ok=True)
+        file_size = self.args.zip_mb * 1024 * 1024 // 40
+        for index in range(20):
+            write_file(os.path.join(dir_path, f"chapter-{index}.md"), (b"Lorem ipsum dolor sit amet. " * (file_size // 28 + 1))[:file_size])
+            write_file(os.path.join(dir_path, f"figure-{index}.pdf"), os.urandom(file_size))
+        return dir_path
+
+def run_benchmarks(app, args: argparse.Namespace) -> Dict[str, Dict[str, float]]:
+    '''Function to run the benchmarks selected with --only in a request context of the benchmark user.'''
+    from flask_login import login_user
+    from mmm import db
+    from mmm.maker_project.models import File, FileVersion, Project, UserProject
+    from mmm.maker_project.tools import file_exists, register_file_in_db, register_step_outputs, snapshot_project_folder, unshare_linked_files, get_all_projects_for_user, delete_project_from_db, create_html_verifybibtex, stream_zip_file
+    from mmm.maker_project.tools import verifybibtex_report
+    from mmm.maker_project.tools.file_creation_functions import create_zip_file
+
+    dataset = Dataset(args)
+    dataset.create_project_folder()
+    zip_path = dataset.create_zip_folder()
+    project_id = dataset.project.id
+    dir_path = dataset.dir_path
+    print(f"Dataset: {args.projects} projects, {dataset.file_count} files, {dataset.version_count} file versions, report with {args.report_entries} entries.")
+    results: Dict[str, Dict[str, float]] = {}
+    repeat, warmup = args.repeat, args.warmup
+    counter = iter(range(10 ** 9))
+
+    def run(name: str, *measure_args, **measure_kwargs) -> None:
+        if args.only and name not in args.only:
+            return
+        results[name] = measure(*measure_args, **measure_kwargs)
+        print(f"{name:<40} {results[name]['median']:>10.3f} ms (min {results[name]['min']:.3f}, p95 {results[name]['p95']:.3f})", flush=True)
+
+    with app.test_request_context():
+        login_user(dataset.user)
+
+        ## file_exists: existing file (its content is moved to the versions folder) and missing file
+        def write_head() -> None:
+            write_file(os.path.join(dir_path, "clean_markdown.md"), b"# Article\n")
+        run("file_exists", lambda: file_exists("clean_markdown.md", project_id), repeat, warmup, setup=write_head, teardown=db.session.rollback)
+        run("file_exists (missing)", lambda: file_exists("missing.md", project_id), repeat, warmup)
+
+        ## register_file_in_db: new file and already registered file (upsert, including the commit)
+        run("register_file_in_db (new)", lambda: register_file_in_db(f"upload-{next(counter)}.md", project_id, False), repeat, warmup)
+        run("register_file_in_db (existing)", lambda: register_file_in_db("clean_markdown.md", project_id, True), repeat, warmup)
+
+        ## Output registration of create_files: unshare the hardlinked files before the step, register the outputs after it
+        state = {}
+        outputs = ["raw_markdown.md", "clean_markdown.md", "doc2md.log", "default.pdf", "default.html", "default.PROCESS.log"]
+        def run_step() -> None:
+            state["unshared"] = unshare_linked_files(dir_path)
+            state["snapshot"] = snapshot_project_folder(dir_path)
+            # Different content every time, so the blob store needs to hash and link all outputs
+            for file_name in outputs:
+                write_file(os.path.join(dir_path, file_name), os.urandom(64 * 1024))
+        run("register_step_outputs", lambda: register_step_outputs(dir_path, state["snapshot"], project_id, state["unshared"]), repeat, warmup, setup=run_step)
+        register_step_outputs(dir_path, snapshot_project_folder(dir_path), project_id)
+        run("unshare_linked_files", lambda: unshare_linked_files(dir_path), repeat, warmup, teardown=lambda: register_step_outputs(dir_path, {}, project_id))
+
+        ## get_all_projects_for_user: owned and shared projects of the benchmark user
+        # Every request has a new session, so the projects must not be in the identity map yet
+        def expunge_projects() -> None:
+            for obj in list(db.session.identity_map.values()):
+                if isinstance(obj, Project):
+                    db.session.expunge(obj)
+        run("get_all_projects_for_user", get_all_projects_for_user, repeat, warmup, teardown=expunge_projects)
+
+        ## delete_project_from_db: a project with files, file versions, and collaborators
+        def create_project() -> None:
+            now = datetime.now()
+            project = Project("uploads/user0", f"deleted-{next(counter)}", now, now)
+            db.session.add(project)
+            db.session.flush()
+            db.session.execute(UserProject.__table__.insert(), [{"user_id": user_id, "project_id": project.id, "permission": "rwd", "creator": user_id == 1} for user_id in range(1, 4)])
+            db.session.execute(File.__table__.insert(), [{"filename": file_name, "project_id": project.id, "created_by": 1, "created_at": now, "changed_at": now, "production_file": False, "download_number": 0, "version": 2} for file_name in get_file_names(args.files_per_project)])
+            file_ids = [row[0] for row in db.session.query(File.id).filter(File.project_id == project.id).all()]
+            db.session.execute(FileVersion.__table__.insert(), [{"file_id": file_id, "version": 1, "size": 1024, "created_at": now} for file_id in file_ids])
+            db.session.commit()
+            state["project_id"] = project.id
+        run("delete_project_from_db", lambda: delete_project_from_db(state["project_id"]), repeat, warmup, setup=create_project)
+
+        ## create_html_verifybibtex: first request (report is parsed) and following requests (cached page offsets)
+        run("create_html_verifybibtex (cold)", lambda: create_html_verifybibtex(dir_path, 1), repeat, warmup, setup=verifybibtex_report._report_cache.clear)
+        pages = create_html_verifybibtex(dir_path, 1)[1]
+        run("create_html_verifybibtex (other page)", lambda: create_html_verifybibtex(dir_path, random.randint(1, pages)), repeat, warmup)
+        run("create_html_verifybibtex (cached page)", lambda: create_html_verifybibtex(dir_path, 1), repeat, warmup)
+
+        ## ZIP downloads: create_zip_file (written to the project folder) and stream_zip_file (streamed download)
+        zip_files = sorted(file_name for file_name in os.listdir(zip_path) if not file_name.endswith(".zip"))
+        run("create_zip_file", lambda: create_zip_file(zip_path, zip_files), repeat, warmup, teardown=lambda: os.remove(os.path.join(zip_path, "article_data_phimisci.zip")))
+        run("stream_zip_file", lambda: sum(len(chunk) for chunk in stream_zip_file(zip_path, zip_files)), repeat, warmup)
+    return results
+
+def compare_with_baselines(results: Dict[str, Dict[str, float]], baselines: Dict) -> float:
+    '''Function to print the medians next to the baselines and to return the highest ratio (current / baseline).'''
+    highest_ratio = 0.0
+    print(f"\n{'benchmark':<40} {'median ms':>10} {'baseline':>10} {'ratio':>7}")
+    for name, result in results.items():
+        baseline = baselines.get("benchmarks", {}).get(name)
+        if baseline is None:
+            print(f"{name:<40} {result['median']:>10.3f} {'-':>10} {'-':>7}")
+            continue
+        ratio = result["median"] / baseline["median"] if baseline["median"] else 0.0
+        highest_ratio = max(highest_ratio, ratio)
+        print(f"{name:<40} {result['median']:>10.3f} {baseline['median']:>10.3f} {ratio:>7.2f}")
+    return highest_ratio
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of mmm.maker_project.tools.")
+    parser.add_argument("--projects", type=int, default=5000, help="Projects of the synthetic dataset (default: 5000)")
+    parser.add_argument("--files-per-project", type=int, default=10, help="Files per project (default: 10)")
+    parser.add_argument("--report-entries", type=int, default=50000, help="Entries with errors in the VerifyBibTeX report (default: 50000)")
+    parser.add_argument("--zip-mb", type=int, default=20, help="Size of the project folder that is zipped in MB (default: 20)")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed calls per benchmark (default: 20)")
+    parser.add_argument("--warmup", type=int, default=2, help="Untimed calls before the timed calls (default: 2)")
+    parser.add_argument("--database-url", help="Database (default: SQLite file in the working directory; sqlite:// for an in-memory database)")
+    parser.add_argument("--only", type=lambda value: value.split(","), help="Comma-separated names of the benchmarks to run")
+    parser.add_argument("--save-baseline", action="store_true", help=f"Store the results as baselines in {os.path.relpath(BASELINE_PATH, REPO_PATH)}")
+    parser.add_argument("--max-ratio", type=float, help="Exit with code 1 if a median is more than this factor slower than its baseline")
+    parser.add_argument("--json", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    # The project folders (uploads/) are relative to the working directory, like in the container
+    work_path = tempfile.mkdtemp(prefix="mmm-microbench-")
+    config_path = os.path.join(work_path, "mmm.cfg")
+    with open(config_path, "w") as f:
+        f.write(CONFIG_TEMPLATE.format(database_url=args.database_url or f"sqlite:///{os.path.join(work_path, 'mmm.db')}", log_file=os.path.join(work_path, "mmm.log"), upload_path=work_path))
+    os.environ["MMM_CONFIG"] = config_path
+    initial_dir = os.getcwd()
+    os.chdir(work_path)
+    try:
+        from flask_migrate import upgrade
+        from mmm import create_app
+        app = create_app()
+        with app.app_context():
+            upgrade(directory=os.path.join(REPO_PATH, "migrations"))
+            results = run_benchmarks(app, args)
+    finally:
+        os.chdir(initial_dir)
+        shutil.rmtree(work_path, ignore_errors=True)
+
+    output = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "dataset": {"projects": args.projects, "files_per_project": args.files_per_project, "report_entries": args.report_entries, "zip_mb": args.zip_mb},
+        "benchmarks": results,
+    }
+    highest_ratio = 0.0
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baselines = json.load(f)
+        if baselines.get("dataset") != output["dataset"]:
+            print(f"\nNote: the baselines were measured with another dataset ({baselines.get('dataset')}).")
+        highest_ratio = compare_with_baselines(results, baselines)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(output, f, indent=2)
+    if args.save_baseline:
+        baselines = {"benchmarks": {}}
+        if os.path.exists(BASELINE_PATH):
+            with open(BASELINE_PATH) as f:
+                baselines = json.load(f)
+        # Benchmarks that did not run (--only) keep their baselines
+        output["benchmarks"] = dict(baselines.get("benchmarks", {}), **results)
+        os.makedirs(os.path.dirname(BASELINE_PATH), exist_ok=True)
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(output, f, indent=2)
+            f.write("\n")
+        print(f"Baselines stored in {BASELINE_PATH}.")
+    if args.max_ratio and highest_ratio > args.max_ratio:
+        sys.exit(f"At least one benchmark is {highest_ratio:.2f} times slower than its baseline (allowed: {args.max_ratio}).")
+
+if __name__ == "__main__":
+    main()
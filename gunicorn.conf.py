@@ -0,0 +1,13 @@
+# Copyright (c) 2024 Thomas Jurczyk
+# This software is provided under the MIT License.
+# For more information, please refer to the LICENSE file in the root directory of this project.
+
+# gunicorn reads this file from the working directory (see Dockerfile)
+import os
+# Imported here and not in child_exit: child_exit runs in the SIGCHLD handler, which can interrupt a running import
+from prometheus_client import multiprocess
+
+def child_exit(server, worker) -> None:
+    '''Remove the live gauges (e.g., mmm_steps_in_progress) of a stopped worker from the metrics (see mmm/tools/metrics.py).'''
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(worker.pid)
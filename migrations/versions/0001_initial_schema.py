@@ -0,0 +1,72 @@
+"""initial schema
+
+Tables of MMM-Web-App before schema migrations were introduced (users, projects, files, user_projects). Databases
+that were created with db.create_all() are stamped with this revision by app_setup.py.
+
+Revision ID: 0001
+Revises: 
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('users',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('username', sa.String(length=100), nullable=True),
+        sa.Column('email', sa.String(length=100), nullable=True),
+        sa.Column('email_change', sa.String(length=100), nullable=True),
+        sa.Column('salt', sa.String(length=32), nullable=True),
+        sa.Column('pwdhash', sa.String(), nullable=True),
+        sa.Column('admin', sa.Boolean(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('email'),
+        sa.UniqueConstraint('username')
+    )
+    op.create_table('projects',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('path', sa.String(length=255), nullable=False),
+        sa.Column('project_name', sa.String(length=255), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('changed_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('files',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('filename', sa.String(length=255), nullable=False),
+        sa.Column('project_id', sa.Integer(), nullable=False),
+        sa.Column('created_by', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('changed_at', sa.DateTime(), nullable=False),
+        sa.Column('production_file', sa.Boolean(), nullable=False),
+        sa.Column('download_number', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['created_by'], ['users.id'], ),
+        sa.ForeignKeyConstraint(['project_id'], ['projects.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('user_projects',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('project_id', sa.Integer(), nullable=False),
+        sa.Column('permission', sa.String(length=255), nullable=False),
+        sa.Column('creator', sa.Boolean(), nullable=False),
+        sa.ForeignKeyConstraint(['project_id'], ['projects.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('user_projects')
+    op.drop_table('files')
+    op.drop_table('projects')
+    op.drop_table('users')
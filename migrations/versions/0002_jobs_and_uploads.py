@@ -0,0 +1,59 @@
+"""jobs and uploads tables
+
+Tables of the job worker and of the chunked upload API. Databases created with db.create_all() may already contain
+them, so they are only created if they do not exist.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 10:01:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    existing_tables = sa.inspect(op.get_bind()).get_table_names()
+    if 'jobs' not in existing_tables:
+        op.create_table('jobs',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('project_id', sa.Integer(), nullable=False),
+            sa.Column('created_by', sa.Integer(), nullable=False),
+            sa.Column('mmm_choice', sa.String(length=255), nullable=False),
+            sa.Column('arguments', sa.Text(), nullable=False),
+            sa.Column('status', sa.String(length=32), nullable=False),
+            sa.Column('result', sa.Text(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=False),
+            sa.Column('started_at', sa.DateTime(), nullable=True),
+            sa.Column('finished_at', sa.DateTime(), nullable=True),
+            sa.Column('pipeline_id', sa.String(length=32), nullable=True),
+            sa.Column('depends_on', sa.Text(), nullable=True),
+            sa.ForeignKeyConstraint(['created_by'], ['users.id'], ),
+            sa.ForeignKeyConstraint(['project_id'], ['projects.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('id')
+        )
+    if 'uploads' not in existing_tables:
+        op.create_table('uploads',
+            sa.Column('id', sa.String(length=32), nullable=False),
+            sa.Column('project_id', sa.Integer(), nullable=False),
+            sa.Column('created_by', sa.Integer(), nullable=False),
+            sa.Column('filename', sa.String(length=255), nullable=False),
+            sa.Column('size', sa.BigInteger(), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=False),
+            sa.Column('changed_at', sa.DateTime(), nullable=False),
+            sa.ForeignKeyConstraint(['created_by'], ['users.id'], ),
+            sa.ForeignKeyConstraint(['project_id'], ['projects.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('id')
+        )
+
+
+def downgrade():
+    op.drop_table('uploads')
+    op.drop_table('jobs')
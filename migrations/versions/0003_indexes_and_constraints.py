@@ -0,0 +1,103 @@
+"""indexes and unique constraints for the hot lookups
+
+Adds unique constraints (and thus indexes) for files (project_id, filename), user_projects (user_id, project_id),
+and projects (path, project_name), an index for the collaborators of a project, indexes for the job worker, and
+ON DELETE CASCADE for files.project_id.
+
+Existing duplicates are merged first, since the unique constraints could not be created otherwise. Of every group of
+duplicates the newest row (latest changed_at, then highest ID) is kept. Files, grants, jobs, and uploads of duplicate
+projects are moved to the kept project; duplicate grants are merged into one grant with all their permissions.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 10:02:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+# Name of the foreign key of files.project_id if the database did not name it (SQLite)
+FILES_PROJECT_FK = 'fk_files_project_id_projects'
+NAMING_CONVENTION = {"fk": "fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s"}
+
+
+def get_files_project_fk_name():
+    for foreign_key in sa.inspect(op.get_bind()).get_foreign_keys('files'):
+        if foreign_key['constrained_columns'] == ['project_id']:
+            return foreign_key['name'] or FILES_PROJECT_FK
+    return None
+
+
+def get_newest_rows(table_name, key_columns, order_columns):
+    '''Group the rows of a table by key_columns and map the ID of every duplicate to the ID of the newest row.'''
+    rows = op.get_bind().execute(sa.text(f"SELECT id, {', '.join(key_columns + order_columns)} FROM {table_name}")).all()
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(row[1:len(key_columns) + 1]), []).append(row)
+    duplicates = {}
+    for group in groups.values():
+        if len(group) < 2:
+            continue
+        newest = max(group, key=lambda row: tuple(row[len(key_columns) + 1:]) + (row[0],))
+        duplicates.update({row[0]: newest[0] for row in group if row is not newest})
+    return duplicates
+
+
+def remove_duplicates():
+    bind = op.get_bind()
+    # Projects: move everything that belongs to a duplicate to the kept project
+    project_duplicates = get_newest_rows('projects', ['path', 'project_name'], ['changed_at'])
+    for duplicate_id, project_id in project_duplicates.items():
+        for table_name in ['files', 'user_projects', 'jobs', 'uploads']:
+            bind.execute(sa.text(f"UPDATE {table_name} SET project_id = :project_id WHERE project_id = :duplicate_id"), {"project_id": project_id, "duplicate_id": duplicate_id})
+        bind.execute(sa.text("DELETE FROM projects WHERE id = :id"), {"id": duplicate_id})
+    # Files (also those moved above): only the newest entry of a file name is kept
+    for duplicate_id in get_newest_rows('files', ['project_id', 'filename'], ['changed_at']):
+        bind.execute(sa.text("DELETE FROM files WHERE id = :id"), {"id": duplicate_id})
+    # Grants: the newest grant gets the permissions (and creator flag) of all grants of the user
+    grant_duplicates = get_newest_rows('user_projects', ['user_id', 'project_id'], [])
+    grants = {row.id: row for row in bind.execute(sa.text("SELECT id, permission, creator FROM user_projects")).all()}
+    for grant_id in set(grant_duplicates.values()):
+        merged = [grants[grant_id]] + [grants[duplicate_id] for duplicate_id, kept_id in grant_duplicates.items() if kept_id == grant_id]
+        permission = "".join(p for p in "rwd" if any(p in grant.permission for grant in merged))
+        bind.execute(sa.text("UPDATE user_projects SET permission = :permission, creator = :creator WHERE id = :id"), {"permission": permission, "creator": any(grant.creator for grant in merged), "id": grant_id})
+    for duplicate_id in grant_duplicates:
+        bind.execute(sa.text("DELETE FROM user_projects WHERE id = :id"), {"id": duplicate_id})
+
+
+def upgrade():
+    remove_duplicates()
+    fk_name = get_files_project_fk_name()
+    with op.batch_alter_table('files', naming_convention=NAMING_CONVENTION) as batch_op:
+        if fk_name:
+            batch_op.drop_constraint(fk_name, type_='foreignkey')
+        batch_op.create_foreign_key(FILES_PROJECT_FK, 'projects', ['project_id'], ['id'], ondelete='CASCADE')
+        batch_op.create_unique_constraint('uq_files_project_id_filename', ['project_id', 'filename'])
+    with op.batch_alter_table('user_projects') as batch_op:
+        batch_op.create_unique_constraint('uq_user_projects_user_id_project_id', ['user_id', 'project_id'])
+        batch_op.create_index('ix_user_projects_project_id', ['project_id'])
+    with op.batch_alter_table('projects') as batch_op:
+        batch_op.create_unique_constraint('uq_projects_path_project_name', ['path', 'project_name'])
+    op.create_index('ix_jobs_status', 'jobs', ['status'])
+    op.create_index('ix_jobs_pipeline_id', 'jobs', ['pipeline_id'])
+
+
+def downgrade():
+    op.drop_index('ix_jobs_pipeline_id', table_name='jobs')
+    op.drop_index('ix_jobs_status', table_name='jobs')
+    with op.batch_alter_table('projects') as batch_op:
+        batch_op.drop_constraint('uq_projects_path_project_name', type_='unique')
+    with op.batch_alter_table('user_projects') as batch_op:
+        batch_op.drop_index('ix_user_projects_project_id')
+        batch_op.drop_constraint('uq_user_projects_user_id_project_id', type_='unique')
+    with op.batch_alter_table('files', naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.drop_constraint('uq_files_project_id_filename', type_='unique')
+        batch_op.drop_constraint(FILES_PROJECT_FK, type_='foreignkey')
+        batch_op.create_foreign_key(FILES_PROJECT_FK, 'projects', ['project_id'], ['id'])
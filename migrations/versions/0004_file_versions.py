@@ -0,0 +1,40 @@
+"""file versions
+
+Adds the version number of the current content of a file and the file_versions table for the old versions (kept in
+the .versions folder of the project).
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('files') as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    op.create_table('file_versions',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('file_id', sa.Integer(), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('size', sa.BigInteger(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['file_id'], ['files.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('file_id', 'version', name='uq_file_versions_file_id_version')
+    )
+
+
+def downgrade():
+    op.drop_table('file_versions')
+    with op.batch_alter_table('files') as batch_op:
+        batch_op.drop_column('version')
@@ -0,0 +1,31 @@
+"""file digests
+
+Adds the SHA-256 of the current content of a file (name of its blob in the blob store) and an index to find files
+with the same content.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('files') as batch_op:
+        batch_op.add_column(sa.Column('digest', sa.String(length=64), nullable=True))
+        batch_op.create_index('ix_files_digest', ['digest'])
+
+
+def downgrade():
+    with op.batch_alter_table('files') as batch_op:
+        batch_op.drop_index('ix_files_digest')
+        batch_op.drop_column('digest')
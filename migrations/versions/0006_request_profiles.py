@@ -0,0 +1,39 @@
+"""request profiles
+
+Adds the request_profiles table of the request profiler (ring buffer of the last PROFILER_MAX_ENTRIES profiles).
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('request_profiles',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('endpoint', sa.String(length=255), nullable=True),
+        sa.Column('method', sa.String(length=10), nullable=False),
+        sa.Column('path', sa.String(length=2048), nullable=False),
+        sa.Column('status', sa.Integer(), nullable=True),
+        sa.Column('duration', sa.Float(), nullable=False),
+        sa.Column('query_count', sa.Integer(), nullable=False),
+        sa.Column('query_duration', sa.Float(), nullable=False),
+        sa.Column('profile', sa.Text(), nullable=True),
+        sa.Column('queries', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('request_profiles')
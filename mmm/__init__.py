@@ -9,16 +9,14 @@ from flask_login import LoginManager
 from flask_admin import Admin
 from flask_wtf.csrf import CSRFProtect
 from flask_mail import Mail
+from flask_migrate import Migrate
 
 db = SQLAlchemy()
 login_manager = LoginManager()
 flask_admin = Admin()
 csrf = CSRFProtect()
 mail = Mail()
-
-def init_db(app):
-    with app.app_context():
-        db.create_all()
+migrate = Migrate()
 
 def create_app() -> Flask:
     '''Main function to create the Flask app. This function initializes the app, sets the configuration, and registers the blueprints, extensions, and login manager. It also sets up logging. This function is used in the wsgi.py file.
@@ -34,11 +32,12 @@ def create_app() -> Flask:
 
     # Set config
     # Note: If you prefer to use environment variables for critical values, you can do so; environment variables will override the config file. 
-    # Assuming that this runs in a container with /app working folder
+    # Assuming that this runs in a container with /app working folder; MMM_CONFIG can point to another config file (e.g., benchmarks)
+    config_path = os.environ.get('MMM_CONFIG', '/app/mmm.cfg')
     try:
-        app.config.from_pyfile('/app/mmm.cfg')
+        app.config.from_pyfile(config_path)
     except FileNotFoundError:
-        print('Config file not found. You need to provide a config file "mmm.cfg" in the root directory. Shutting down.')
+        print(f'Config file {config_path} not found. You need to provide a config file "mmm.cfg" in the root directory (or set MMM_CONFIG). Shutting down.')
         exit(1)
     
     # Check if environment variables are set
@@ -69,6 +68,14 @@ def create_app() -> Flask:
         app.config['TYPESETTING_IMAGE'] = os.environ['TYPESETTING_IMAGE']
     if 'TEX2PDF_IMAGE' in os.environ:
         app.config['TEX2PDF_IMAGE'] = os.environ['TEX2PDF_IMAGE']
+    if 'CONTAINER_EXECUTION_MODE' in os.environ:
+        app.config['CONTAINER_EXECUTION_MODE'] = os.environ['CONTAINER_EXECUTION_MODE']
+    if 'MAKER_WORKER_THREADS' in os.environ:
+        app.config['MAKER_WORKER_THREADS'] = int(os.environ['MAKER_WORKER_THREADS'])
+    if 'METRICS_TOKEN' in os.environ:
+        app.config['METRICS_TOKEN'] = os.environ['METRICS_TOKEN']
+    if 'DOWNLOAD_OFFLOAD' in os.environ:
+        app.config['DOWNLOAD_OFFLOAD'] = os.environ['DOWNLOAD_OFFLOAD']
 
     # Register csrf
     csrf.init_app(app)
@@ -76,8 +83,9 @@ def create_app() -> Flask:
     # Register mail
     mail.init_app(app)
 
-    # Register database
+    # Register database and migrations (the schema is created/updated by app_setup.py, see migrations/)
     db.init_app(app)
+    migrate.init_app(app, db, render_as_batch=True)
 
     # Add logging
     import logging
@@ -93,6 +101,12 @@ def create_app() -> Flask:
     from mmm.routes import main
     app.register_blueprint(main)
 
+    # Register request metrics and /metrics
+    from mmm.tools import init_metrics, init_profiler
+    init_metrics(app)
+    # Register the request profiler (only if PROFILER_ENABLED)
+    init_profiler(app)
+
     from mmm.auth import auth
     app.register_blueprint(auth)
     
@@ -108,8 +122,7 @@ def create_app() -> Flask:
     flask_admin.init_app(app) 
 
     flask_admin.add_view(UserAdminView(User, db.session))
-
-    # Initialize the database schema
-    init_db(app)
+    from mmm.tools import RequestProfile, RequestProfileAdminView
+    flask_admin.add_view(RequestProfileAdminView(RequestProfile, db.session, name='Request profiles'))
 
     return app
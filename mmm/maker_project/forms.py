@@ -30,6 +30,7 @@ class MMMDynamicForm(FlaskForm):
         ('xml2yaml', '3. Create a <b>YAML metadata file</b> from OJS-XML (<b>XML2YAML</b>).'),
         ('dw', '4. Create <b>production files</b> from YAML, BibTeX, and Markdown files (<b>Maker</b>).'),
         ('tex2pdf', '5. Optional step: Create a <b>PDF</b> from a TeX file (<b>TEX2PDF</b>).'),
+        ('pipeline', '6. Run the <b>full pipeline</b> (steps 1 to 4) with a DOC(X)/ODT file, an OJS-XML file, and optionally a BibTeX file (<b>DOC2MD</b> &rarr; <b>VerifyBibTeX</b>, <b>XML2YAML</b> &rarr; <b>Maker</b>).'),
     ], validators=[DataRequired()])
     # Additional information for XML2YAML:
     # volume_number: str, orcids: str, year: str, doi: str
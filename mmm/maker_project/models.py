@@ -6,14 +6,27 @@ from mmm import db
 
 class File(db.Model):
     __tablename__ = "files"
+    # Files are looked up by project and file name; a file name can only exist once per project
+    # Files with the same content are found by their digest
+    __table_args__ = (
+        db.UniqueConstraint('project_id', 'filename', name='uq_files_project_id_filename'),
+        db.Index('ix_files_digest', 'digest'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(255), nullable=False)
-    project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), nullable=False)
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id', ondelete="CASCADE"), nullable=False)
     created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     created_at = db.Column(db.DateTime, nullable=False)
     changed_at = db.Column(db.DateTime, nullable=False)
     production_file = db.Column(db.Boolean, nullable=False)
     download_number = db.Column(db.Integer, nullable=False)
+    # Version number of the current content; older versions are kept in file_versions
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    # SHA-256 of the current content (name of the blob in the blob store)
+    digest = db.Column(db.String(64))
+
+    # Delete all old versions if this file is removed
+    versions = db.relationship('FileVersion', backref='file', cascade="all, delete-orphan", order_by="FileVersion.version.desc()")
     
     def __init__(self, filename, project_id, created_by, created_at, changed_at, production_file, download_number):
         self.filename = filename
@@ -27,8 +40,30 @@ class File(db.Model):
     def __repr__(self):
         return f"File('{self.filename}', '{self.project_id}', '{self.created_at}', '{self.changed_at}', '{self.download_number}')"
 
+class FileVersion(db.Model):
+    __tablename__ = "file_versions"
+    # Version numbers are unique per file
+    __table_args__ = (db.UniqueConstraint('file_id', 'version', name='uq_file_versions_file_id_version'),)
+    id = db.Column(db.Integer, primary_key=True)
+    file_id = db.Column(db.Integer, db.ForeignKey('files.id', ondelete="CASCADE"), nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+    # Size in bytes and date of the content of this version
+    size = db.Column(db.BigInteger, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+
+    def __init__(self, file_id, version, size, created_at):
+        self.file_id = file_id
+        self.version = version
+        self.size = size
+        self.created_at = created_at
+
+    def __repr__(self):
+        return f"FileVersion('{self.file_id}', '{self.version}', '{self.size}', '{self.created_at}')"
+
 class Project(db.Model):
     __tablename__ = "projects"
+    # Project names are unique per user folder
+    __table_args__ = (db.UniqueConstraint('path', 'project_name', name='uq_projects_path_project_name'),)
     id = db.Column(db.Integer, primary_key=True)
     path = db.Column(db.String(255), nullable=False)
     project_name = db.Column(db.String(255), nullable=False)
@@ -49,6 +84,11 @@ class Project(db.Model):
 
 class UserProject(db.Model):
     __tablename__ = "user_projects"
+    # One grant per user and project; the project index is used to list the collaborators of a project
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'project_id', name='uq_user_projects_user_id_project_id'),
+        db.Index('ix_user_projects_project_id', 'project_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     project_id = db.Column(db.Integer, db.ForeignKey('projects.id', ondelete="CASCADE"), nullable=False)
@@ -63,3 +103,67 @@ class UserProject(db.Model):
 
     def __repr__(self):
         return f"UserProject('{self.user_id}', '{self.project_id}', '{self.permission}', '{self.creator}')"
+
+class Job(db.Model):
+    __tablename__ = "jobs"
+    # The worker looks for queued jobs, the status page for the jobs of a pipeline
+    __table_args__ = (
+        db.Index('ix_jobs_status', 'status'),
+        db.Index('ix_jobs_pipeline_id', 'pipeline_id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id', ondelete="CASCADE"), nullable=False)
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    # Maker step to be run by the worker (doc2md, verifybibtex, xml2yaml, dw, tex2pdf)
+    mmm_choice = db.Column(db.String(255), nullable=False)
+    # JSON encoded arguments passed to create_files (selected files, XML2YAML data, etc.)
+    arguments = db.Column(db.Text, nullable=False)
+    # Job status: queued, running, finished, failed
+    status = db.Column(db.String(32), nullable=False)
+    # Return value of create_files ("true" or the error message)
+    result = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    # Jobs of a full pipeline share the same pipeline ID
+    pipeline_id = db.Column(db.String(32))
+    # JSON encoded list of job IDs that need to be finished before this job can start
+    depends_on = db.Column(db.Text)
+
+    def __init__(self, project_id, created_by, mmm_choice, arguments, status, created_at, pipeline_id=None, depends_on=None):
+        self.project_id = project_id
+        self.created_by = created_by
+        self.mmm_choice = mmm_choice
+        self.arguments = arguments
+        self.status = status
+        self.created_at = created_at
+        self.pipeline_id = pipeline_id
+        self.depends_on = depends_on
+
+    def __repr__(self):
+        return f"Job('{self.id}', '{self.project_id}', '{self.mmm_choice}', '{self.status}', '{self.created_at}')"
+
+class Upload(db.Model):
+    __tablename__ = "uploads"
+    # Random upload ID (used in the URLs of the chunked upload API)
+    id = db.Column(db.String(32), primary_key=True)
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id', ondelete="CASCADE"), nullable=False)
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    # Final (secure) file name
+    filename = db.Column(db.String(255), nullable=False)
+    # Announced size of the file in bytes
+    size = db.Column(db.BigInteger, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+    changed_at = db.Column(db.DateTime, nullable=False)
+
+    def __init__(self, id, project_id, created_by, filename, size, created_at, changed_at):
+        self.id = id
+        self.project_id = project_id
+        self.created_by = created_by
+        self.filename = filename
+        self.size = size
+        self.created_at = created_at
+        self.changed_at = changed_at
+
+    def __repr__(self):
+        return f"Upload('{self.id}', '{self.project_id}', '{self.filename}', '{self.size}')"
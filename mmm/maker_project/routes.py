@@ -2,17 +2,16 @@
 # This software is provided under the MIT License.
 # For more information, please refer to the LICENSE file in the root directory of this project.
 
-from flask import request, render_template, redirect, flash, url_for, current_app, send_from_directory
+from flask import request, render_template, redirect, flash, url_for, current_app, Response, jsonify
 from . import maker_project
-from .tools import create_user_folder, create_new_project_func, get_all_projects_for_user, delete_project_from_db, allowed_file, file_exists, create_files, get_xml2yaml_data, create_html_verifybibtex, create_share_project_choices, send_email, critical_error_logger
+from .tools import create_user_folder, create_new_project_func, get_all_projects_for_user, delete_project_from_db, allowed_file, file_exists, create_files, get_xml2yaml_data, create_html_verifybibtex, get_share_project_choices, send_email, critical_error_logger, enqueue_maker_job, enqueue_maker_pipeline, stream_zip_file, list_project_folder, send_project_file, ingest_uploaded_files, load_project_view, get_duplicate_files, require_project_permission, get_project_access, resolve_project_access, invalidate_project_permission, ChunkedUploadError, init_chunked_upload, get_upload_offset, write_upload_chunk, finalize_chunked_upload, discard_chunked_upload, delete_files, move_to_trash
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
 from mmm.auth.models import User
-from mmm.maker_project.models import Project, File, UserProject
+from mmm.maker_project.models import Project, File, FileVersion, UserProject, Job, Upload
 import shutil
 from mmm import db
-import os, re, stat
-import tempfile
+import os, re, stat, json
 from mmm.maker_project.forms import UploadForm, CreateProjectForm, MMMDynamicForm, RenameObject, ShareProjectWithUser
 from datetime import datetime
 from typing import Literal
@@ -59,35 +58,32 @@ def create_new_project():
 
 @maker_project.route('/delete-project/<int:project_id>', methods=['GET'])
 @login_required
+@require_project_permission(creator_only=True, message='Only the creator has permission to delete this project.')
 def delete_project(project_id):
     if request.method == 'GET':
-        # Check user permission to delete project. Only creator can delete project.
-        permission = UserProject.query.filter_by(user_id=current_user.id, project_id=project_id).first().creator
+        # Only creator can delete project (checked by require_project_permission)
         username = current_user.username
-        project_name = Project.query.get(project_id).project_name
-        if permission:
-            # Delete project from db
-            delete_project_from_db(project_id)
-            # Delete project folder
-            project_folder = f"uploads/{username}/{project_name}"
-            try:
-                shutil.rmtree(project_folder)
-                flash(f'Project {project_name} deleted successfully.', 'success')
-                current_app.logger.info(f"Project folder {project_name} deleted for {username}.")
-                return redirect(url_for("maker_project.show_user_projects"))
-            except OSError as e:
-                flash(f'An error occurred while deleting project {project_name}.', 'danger')
-                critical_error_logger(f"Error deleting project folder {project_name} for {username}.")
-                return redirect(url_for("maker_project.show_user_projects"))
-        else:
-            flash('Only the creator has permission to delete this project.', 'danger')
-            critical_error_logger(f"Deleting folder {project_name} was not allowed for {username}.")
+        project_name = get_project_access().project.project_name
+        project_folder = os.path.join(get_project_access().project.path, project_name)
+        # Delete project from db
+        delete_project_from_db(project_id)
+        invalidate_project_permission(project_id)
+        # Move project folder to the trash; the job worker deletes it in the background
+        try:
+            move_to_trash(project_folder)
+            flash(f'Project {project_name} deleted successfully.', 'success')
+            current_app.logger.info(f"Project folder {project_name} deleted for {username}.")
+            return redirect(url_for("maker_project.show_user_projects"))
+        except OSError as e:
+            flash(f'An error occurred while deleting project {project_name}.', 'danger')
+            critical_error_logger(f"Error deleting project folder {project_name} for {username}.")
             return redirect(url_for("maker_project.show_user_projects"))
 
 ### Download project route
 
 @maker_project.route('/download-folder/<int:project_id>/<string:download_instruction>/', methods=['GET'])
 @login_required
+@require_project_permission("r", message='You do not have permission to download this project.')
 def download_folder(project_id, download_instruction: Literal["all", "user", "production"]):
     '''This route is used to download a folder or certain files (user/production) from a project folder.
 
@@ -99,55 +95,42 @@ def download_folder(project_id, download_instruction: Literal["all", "user", "pr
             The instruction to download all files or either the user or production folder.
     
     '''
-    user_project = UserProject.query.filter_by(user_id=current_user.id, project_id=project_id).first()
-    if not user_project:
-        flash('Project not found or access denied.', 'danger')
-        return redirect(url_for("maker_project.show_user_projects"))
-    
-    permission = user_project.permission
-    if "r" in permission:
-        project = Project.query.get(project_id)
-        if project is None:
-            flash('Project not found.', 'danger')
-            return redirect(url_for("maker_project.show_user_projects"))
-
-        project_name = project.project_name
-        username = current_user.username
-        project_path = project.path
-        project_folder = os.path.join(os.getcwd(), project_path, project_name)
-        # Using a temporary file to avoid conflicts and ensure cleanup
-        if download_instruction == "all":
-            with tempfile.TemporaryDirectory() as tmpdirname:
-                zip_path = os.path.join(tmpdirname, f"{project_name}.zip")
-                shutil.make_archive(zip_path.replace('.zip', ''), 'zip', project_folder)
-                current_app.logger.info(f"Project folder {project_name} downloaded by {username}.")
-                return send_from_directory(tmpdirname, f"{project_name}.zip", as_attachment=True)
-        elif download_instruction == "user" or download_instruction == "production":
-            with tempfile.TemporaryDirectory() as tmpdirname:
-                # Get all user or production files
-                is_production = True if download_instruction == "production" else False
-                user_files = File.query.filter_by(project_id=project_id, production_file=is_production).all()
-                # Copy all user/production files in a temporary folder
-                for file in user_files:
-                    file_path = os.path.join(project_folder, file.filename)
-                    shutil.copy(file_path, tmpdirname)
-                # Create zip file in yet another temporary folder
-                with tempfile.TemporaryDirectory() as tmpdirname_zip:
-                    zip_path = os.path.join(tmpdirname_zip, f"{project_name}_{download_instruction}_files.zip")
-                    shutil.make_archive(zip_path.replace('.zip', ''), 'zip', tmpdirname)
-                    current_app.logger.info(f"{download_instruction} files of folder {project_name} downloaded by {username}.")
-                    return send_from_directory(tmpdirname_zip, f"{project_name}_{download_instruction}_files.zip", as_attachment=True)
+    project = get_project_access().project
+    project_name = project.project_name
+    username = current_user.username
+    project_path = project.path
+    project_folder = os.path.join(os.getcwd(), project_path, project_name)
+    # The zip file is streamed while it is created; nothing is copied or written to disk
+    if download_instruction == "all":
+        file_list = list_project_folder(project_folder)
+        zip_name = f"{project_name}.zip"
+        current_app.logger.info(f"Project folder {project_name} downloaded by {username}.")
+    elif download_instruction == "user" or download_instruction == "production":
+        # Get all user or production files
+        is_production = True if download_instruction == "production" else False
+        file_list = [file.filename for file in File.query.filter_by(project_id=project_id, production_file=is_production).all()]
+        # Files missing on disk would break the zip file after the response has started; leave them out
+        missing_files = [filename for filename in file_list if not os.path.isfile(os.path.join(project_folder, filename))]
+        if missing_files:
+            current_app.logger.warning(f"Files missing in project folder {project_name} left out of the download: {', '.join(missing_files)}")
+            file_list = [filename for filename in file_list if filename not in missing_files]
+        zip_name = f"{project_name}_{download_instruction}_files.zip"
+        current_app.logger.info(f"{download_instruction} files of folder {project_name} downloaded by {username}.")
     else:
-        flash('You do not have permission to download this project.', 'danger')
+        flash('Unknown download option.', 'danger')
         return redirect(url_for("maker_project.show_user_projects"))
+    response = Response(stream_zip_file(project_folder, file_list), mimetype="application/zip")
+    response.headers["Content-Disposition"] = f'attachment; filename="{zip_name}"'
+    return response
 
 ### Rename project route
 
 @maker_project.route('/rename-project/<int:project_id>', methods=['GET', 'POST'])
 @login_required
+@require_project_permission("d", message='You do not have permission to rename this project.')
 def rename_project(project_id):
     form = RenameObject()
-    project = Project.query.get(project_id)
+    project = get_project_access().project
     if form.validate_on_submit():
         # Get new name
         new_name = form.new_name.data
@@ -160,58 +143,47 @@ def rename_project(project_id):
             return render_template("maker_project/rename-project.html", form=form, project_id=project_id, project_name=project.project_name)
         # Get project details
         old_name = project.project_name
-        # Check user permissions
-        permission = UserProject.query.filter_by(user_id=current_user.id, project_id=project_id).first().permission
-        # Get project details
-        if "d" in permission:
-            # Rename project folder
-            username = current_user.username
-            old_path = os.path.join(os.getcwd(), "uploads", username, old_name)
-            new_path = os.path.join(os.getcwd(), "uploads", username, new_name)
-            try:
-                os.rename(old_path, new_path)
-                # Set permissions to new folder; otherwise, download will not work (10.05.2024)
-                permissions = stat.S_IWUSR | stat.S_IRUSR | stat.S_IXUSR | stat.S_IRGRP | stat.S_IROTH
-                os.chmod(new_path, permissions)
-                # Update project name in db
-                project.project_name = new_name
-                db.session.commit()
-                flash(f'Project {old_name} renamed to {new_name} successfully.', 'success')
-                current_app.logger.info(f"Project folder {old_name} renamed to {new_name} by {username}.")
-                return redirect(url_for("maker_project.show_user_projects"))
-            except OSError as e:
-                flash(f'An error occurred while renaming project {old_name}.', 'danger')
-                critical_error_logger(f"Error renaming project folder {old_name} for {username}.")
-                return redirect(url_for("maker_project.show_user_projects"))
-        else:
-            flash('You do not have permission to rename this project.', 'danger')
-            critical_error_logger(f"Renaming folder {old_name} was not allowed for {username}.")
+        # Rename project folder
+        username = current_user.username
+        old_path = os.path.join(os.getcwd(), "uploads", username, old_name)
+        new_path = os.path.join(os.getcwd(), "uploads", username, new_name)
+        try:
+            os.rename(old_path, new_path)
+            # Set permissions to new folder; otherwise, download will not work (10.05.2024)
+            permissions = stat.S_IWUSR | stat.S_IRUSR | stat.S_IXUSR | stat.S_IRGRP | stat.S_IROTH
+            os.chmod(new_path, permissions)
+            # Update project name in db
+            project.project_name = new_name
+            db.session.commit()
+            flash(f'Project {old_name} renamed to {new_name} successfully.', 'success')
+            current_app.logger.info(f"Project folder {old_name} renamed to {new_name} by {username}.")
             return redirect(url_for("maker_project.show_user_projects"))
-    else:
-        project_name = project.project_name
-        # Check user permissions
-        permission = UserProject.query.filter_by(user_id=current_user.id, project_id=project_id).first().permission
-        if "d" in permission:
-            return render_template("maker_project/rename-project.html", form=form, project_id=project_id, project_name=project_name )
-        else:
-            flash('You do not have permission to rename this project.', 'danger')
-            critical_error_logger(f"Renaming folder {project_name} was not allowed for {username}.")
+        except OSError as e:
+            flash(f'An error occurred while renaming project {old_name}.', 'danger')
+            critical_error_logger(f"Error renaming project folder {old_name} for {username}.")
             return redirect(url_for("maker_project.show_user_projects"))
+    else:
+        return render_template("maker_project/rename-project.html", form=form, project_id=project_id, project_name=project.project_name)
         
 ### Share project route
 
 @maker_project.route('/share-project/<int:project_id>', methods=['GET', 'POST'])
 @login_required
+@require_project_permission("r")
 def share_project(project_id):
     form = ShareProjectWithUser()
-    # Populate user choices with all existing users in DB
-    form.user.choices = [(-1, 'Select a user')] + [create_share_project_choices(user.id, project_id, user.username) for user in User.query.all() if user.id != current_user.id]
+    # Only users with whom the project is already shared are listed; other users are found via the user search (share_project_users)
+    if request.method == 'POST':
+        selected_user_id = request.form.get('user', -1, type=int)
+        choices, _ = get_share_project_choices(project_id, current_user.id, user_id=selected_user_id)
+    else:
+        choices, _ = get_share_project_choices(project_id, current_user.id, shared_only=True, per_page=1000)
+    form.user.choices = [(-1, 'Select a user')] + choices
     # Get project details
-    project = Project.query.get(project_id)
+    project = get_project_access().project
     if form.validate_on_submit():
         # Check if current user is creator of this project
-        creator = UserProject.query.filter_by(user_id=current_user.id, project_id=project_id).first().creator
-        if not creator:
+        if not get_project_access().creator:
             flash('You are not the owner of this project. You do not have permission to share this project with other users.', 'danger')
             critical_error_logger(f"Sharing project {project.project_name} was not allowed for {current_user.username}.")
             return redirect(url_for("maker_project.show_user_projects"))
@@ -236,6 +208,7 @@ def share_project(project_id):
             if form.revoke_permission.data:
                 db.session.delete(user_project)
                 db.session.commit()
+                invalidate_project_permission(project_id, user_id)
                 flash(f'Access to project {project.project_name} revoked for user {user_tag}.', 'success')
                 current_app.logger.info(f'Access to project {project.project_name} revoked for user {user_tag}.')
                 return redirect(url_for("maker_project.show_user_projects"))
@@ -244,12 +217,11 @@ def share_project(project_id):
         delete_permission = "d" if form.delete_permission.data else ""
         permission = "r" + write_permission + delete_permission
         # Share project with user
-        # Get project (needed for email)
-        project = Project.query.get(project_id)
         # If UserProject already exists, just update permissions
         if user_project:
             user_project.permission = permission
             db.session.commit()
+            invalidate_project_permission(project_id, user_id)
             flash(f'Project {project.project_name} shared with user {user_tag} with {permission} rights.', 'success')
             current_app.logger.info(f'Project {project.project_name} shared with user {user_tag} with {permission} rights.')
             # Send email to user
@@ -259,6 +231,7 @@ def share_project(project_id):
             user_project = UserProject(user_id, project_id, permission, False)
             db.session.add(user_project)
             db.session.commit()
+            invalidate_project_permission(project_id, user_id)
             flash(f'Project {project.project_name} shared with user {user_tag} with {permission} rights.', 'success')
             current_app.logger.info(f'Project {project.project_name} shared with user {user_tag} with {permission} rights.')
             # Send email to user
@@ -267,6 +240,16 @@ def share_project(project_id):
     else:
         return render_template("maker_project/share-project.html", form=form, project=project)
 
+### User search for sharing projects
+
+@maker_project.route('/share-project/<int:project_id>/users', methods=['GET'])
+@login_required
+@require_project_permission("r", json_response=True)
+def share_project_users(project_id):
+    # Paginated user search used by the share page (?q=<part of the user name>&page=<page>)
+    choices, has_more = get_share_project_choices(project_id, current_user.id, search=request.args.get('q', '').strip(), page=request.args.get('page', 1, type=int))
+    return jsonify({"users": [{"id": user_id, "label": label} for user_id, label in choices], "has_more": has_more})
+
 ### Show single project files route
 
 @maker_project.route('/show-project-files/<int:project_id>', methods=['GET', 'POST'])
@@ -274,47 +257,106 @@ def share_project(project_id):
 def show_project_files(project_id):
     form = UploadForm()
     error_msg = ""
-    # Create list of users with access to this project
-    user_list = UserProject.query.filter_by(project_id=project_id).all()
-    # Get user names
-    user_names = [User.query.get(user.user_id).username for user in user_list]
+    # Project, files, collaborators, and permission of the current user
+    project_view = load_project_view(project_id, current_user.id)
+    if project_view is None:
+        flash('You do not have permission to view this project.', 'danger')
+        return redirect(url_for("maker_project.show_user_projects"))
     if form.validate_on_submit():
         # Check if user has permission to upload files
-        permission = UserProject.query.filter_by(user_id=current_user.id, project_id=project_id).first().permission
-        if "w" not in permission:
+        if "w" not in project_view.permission:
             flash('You do not have permission to upload files.', 'danger')
             critical_error_logger(f"Uploading files was not allowed for {current_user.username}.")
             return redirect(url_for('maker_project.show_project_files', project_id=project_id))
-        # Save files in project folder
+        uploaded_files = []
         for f in form.files.data:
             if f and allowed_file(f.filename):
-                filename = secure_filename(f.filename)
-                # Check if file exists and rename old file
-                file_exists(filename, project_id)
-                # Get project data for file upload
-                project = Project.query.get(project_id)
-                project_name = project.project_name
-                project_path = project.path
-                f.save(os.path.join(project_path, project_name, filename))
-                # Register file in database
-                file_4db = File(filename, project_id, current_user.id, datetime.now(), datetime.now(), False, 0)
-                db.session.add(file_4db)
-                db.session.commit()
+                uploaded_files.append(f)
             else:
                 error_msg += f"File type not allowed {f.filename}."
+        # Save all files in project folder and register them in one transaction (the current content of files with the same name is kept as a version in .versions/<file_id>/<version>)
+        try:
+            saved_files = ingest_uploaded_files(project_view.project, uploaded_files, current_user.id)
+        except Exception as e:
+            flash('An error occurred while uploading the files. No file has been saved.', 'danger')
+            critical_error_logger(f"Uploading files failed for {current_user.username}: {e}")
+            return redirect(url_for('maker_project.show_project_files', project_id=project_id))
+        # Point out files that have the same content as other files of the project
+        duplicates = get_duplicate_files(project_id, saved_files)
+        if duplicates:
+            flash('The following files have the same content as other files of this project: ' + ', '.join(f'{filename} ({", ".join(other_files)})' for filename, other_files in duplicates.items()), 'info')
         if error_msg:
             flash(error_msg, 'danger')
         else:
             flash('File(s) have successfully been uploaded!', 'success')
         return redirect(url_for('maker_project.show_project_files', project_id=project_id))
     else:
-        # Get project details
-        project = Project.query.get(project_id)
-        # Get all files for project
-        files = File.query.filter_by(project_id=project_id).all()
-        # Get permissions for current user
-        permission = UserProject.query.filter_by(user_id=current_user.id, project_id=project_id).first().permission
-        return render_template("maker_project/show-project-files.html", project=project, files=files, form=form, user_names=user_names, permission=permission)
+        return render_template("maker_project/show-project-files.html", view=project_view, form=form)
+
+### Chunked upload routes
+# JSON API used by the uploader in script.js for files that are too large for a single request.
+
+def get_upload_for_current_user(upload_id: str):
+    '''Get an upload and its project if the current user has started it and may still write to the project.'''
+    upload = Upload.query.get(upload_id)
+    if not upload or upload.created_by != current_user.id:
+        return None, None
+    access = resolve_project_access(current_user.id, upload.project_id)
+    if not access or "w" not in access.permission:
+        return None, None
+    return upload, access.project
+
+@maker_project.route('/upload/<int:project_id>/init', methods=['POST'])
+@login_required
+@require_project_permission("w", message="You do not have permission to upload files.", json_response=True)
+def init_upload(project_id):
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(str(data.get("filename", "")))
+    if not filename or not allowed_file(filename):
+        return jsonify({"error": f"File type not allowed {data.get('filename')}."}), 400
+    try:
+        upload = init_chunked_upload(get_project_access().project, filename, int(data.get("size", -1)), current_user.id)
+    except (ChunkedUploadError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({
+        "upload_id": upload.id,
+        "offset": 0,
+        "chunk_size": int(current_app.config.get("CHUNKED_UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024)),
+        "upload_url": url_for("maker_project.upload_chunk", upload_id=upload.id),
+        "finalize_url": url_for("maker_project.finalize_upload", upload_id=upload.id),
+    }), 201
+
+@maker_project.route('/upload/<string:upload_id>', methods=['GET', 'PUT', 'DELETE'])
+@login_required
+def upload_chunk(upload_id):
+    upload, project = get_upload_for_current_user(upload_id)
+    if not upload:
+        return jsonify({"error": "Upload not found."}), 404
+    try:
+        if request.method == 'GET':
+            # Resume: the client continues at this offset
+            return jsonify({"offset": get_upload_offset(project, upload), "size": upload.size})
+        if request.method == 'DELETE':
+            discard_chunked_upload(project, upload)
+            return jsonify({"offset": 0, "size": 0})
+        offset = write_upload_chunk(project, upload, request.args.get("offset", -1, type=int), request.stream)
+    except ChunkedUploadError as e:
+        return jsonify({"error": str(e), "offset": e.offset}), 409
+    return jsonify({"offset": offset, "size": upload.size})
+
+@maker_project.route('/upload/<string:upload_id>/finalize', methods=['POST'])
+@login_required
+def finalize_upload(upload_id):
+    upload, project = get_upload_for_current_user(upload_id)
+    if not upload:
+        return jsonify({"error": "Upload not found."}), 404
+    data = request.get_json(silent=True) or {}
+    try:
+        file, digest = finalize_chunked_upload(project, upload, current_user.id, data.get("sha256"))
+    except ChunkedUploadError as e:
+        return jsonify({"error": str(e), "offset": e.offset}), 409
+    current_app.logger.info(f"File {file.filename} uploaded to {project.project_name} by {current_user.username} (chunked, sha256 {digest}).")
+    return jsonify({"file_id": file.id, "filename": file.filename, "sha256": digest, "duplicates": get_duplicate_files(project.id, [file.filename]).get(file.filename, [])})
 
 ### Show all projects route
     
@@ -332,39 +374,24 @@ def show_user_projects():
 
 @maker_project.route('/delete-file/<int:file_id>', methods=['GET'])
 @login_required
+@require_project_permission("d", allow_file_creator=True, message='You do not have permission to delete this file.')
 def delete_file(file_id):
     if request.method == 'GET':
-        # Get file and folder info
-        file = File.query.get(file_id)
-        filename = file.filename
-        project_name = Project.query.get(file.project_id).project_name
-        project_id = Project.query.get(file.project_id).id
-        project_path = Project.query.get(file.project_id).path
-        # Check user permissions
-        permission = UserProject.query.filter_by(user_id=current_user.id, project_id=file.project_id).first().permission
-        # Get file path
-        file_in_dir = f"{project_path}/{project_name}/{filename}"
+        # Get file and folder info (file is deleted if d permission or if this user has created the file)
+        access = get_project_access()
+        filename = access.file.filename
+        project_id = access.project.id
         # Get username 
         username = current_user.username
-        # Delete file if d permission or if this user has created the file
-        if "d" in permission or file.created_by == current_user.id: 
-            # Delete file from db
-            db.session.delete(file)
-            db.session.commit()
-            # Delete file in directory
-            try:
-                os.remove(file_in_dir)
-                flash(f'File {filename} deleted successfully.', 'success')
-                current_app.logger.info(f"File {file_in_dir} deleted by {username}.")
-                return redirect(url_for("maker_project.show_project_files", project_id=project_id))
-            except OSError as e:
-                flash(f'An error occurred while deleting file {filename}.', 'danger')
-                critical_error_logger(f"Error deleting file {filename} by {username}.")
-                return redirect(url_for("maker_project.show_project_files", project_id=project_id))
+        # Delete file from db and from project folder
+        deleted, failed = delete_files(access.project, [access.file])
+        if deleted:
+            flash(f'File {filename} deleted successfully.', 'success')
+            current_app.logger.info(f"File {filename} in project {project_id} deleted by {username}.")
         else:
-            flash('You do not have permission to delete this file.', 'danger')
-            critical_error_logger(f"Deleting file {file_in_dir} was not allowed for {username}.")
-            return redirect(url_for("maker_project.show_project_files", project_id=project_id))
+            flash(f'An error occurred while deleting file {filename}.', 'danger')
+            critical_error_logger(f"Error deleting file {filename} by {username}.")
+        return redirect(url_for("maker_project.show_project_files", project_id=project_id))
 
 ### Delete multiple files route
 
@@ -379,74 +406,68 @@ def delete_multiple_files():
     if file_ids == []:
         flash('No files selected.', 'danger')
         return redirect(url_for("maker_project.show_user_projects"))
-    project_id = File.query.get(file_ids[0]).project_id
+    # All selected files need to belong to the same project
+    files = File.query.filter(File.id.in_(file_ids)).all()
+    project_id = files[0].project_id if files else None
     # Check user permissions
-    permission = UserProject.query.filter_by(user_id=current_user.id, project_id=project_id).first().permission
-    # Get project details
-    project_name = Project.query.get(project_id).project_name
-    project_path = Project.query.get(project_id).path
+    access = resolve_project_access(current_user.id, project_id) if files and all(file.project_id == project_id for file in files) else None
     username = current_user.username
-    if "d" in permission:
-        # Collect info for single flash message
-        flash_success_msg = f'Files deleted successfully: '
-        flash_error_msg = f'An error occurred while deleting files: '
-        # Delete files from db
-        for file_id in file_ids:
-            file = File.query.get(file_id)
-            filename = file.filename
-            # Get file path
-            file_in_dir = f"{project_path}/{project_name}/{filename}"
-            # Delete file from db
-            db.session.delete(file)
-            db.session.commit()
-            # Delete file in project folder
-            try:
-                os.remove(file_in_dir)
-                flash_success_msg += f'{filename}, '
-                current_app.logger.info(f"File {file_in_dir} deleted by {username}.")
-            except OSError as e:
-                flash_error_msg += f'{filename}, '
-                critical_error_logger(f"Error deleting file {filename} by {username}.")
+    if access and "d" in access.permission:
+        # Delete all files from db in one transaction, then from the project folder
+        deleted, failed = delete_files(access.project, files)
         # Create flash messages
-        if flash_success_msg != 'Files deleted successfully: ':
-            flash(flash_success_msg[:-2], 'success')
-        if flash_error_msg != 'An error occurred while deleting files: ':
-            flash(flash_error_msg[:-2], 'danger')
+        if deleted:
+            flash(f'Files deleted successfully: {", ".join(deleted)}', 'success')
+            current_app.logger.info(f"Files {', '.join(deleted)} in project {project_id} deleted by {username}.")
+        if failed:
+            flash(f'An error occurred while deleting files: {", ".join(failed)}', 'danger')
+            critical_error_logger(f"Error deleting files {', '.join(failed)} by {username}.")
         return redirect(url_for("maker_project.show_project_files", project_id=project_id))
     else:
         flash('You do not have permission to delete these files.', 'danger')
         critical_error_logger(f"Deleting files was not allowed for {username}.")
-        return redirect(url_for("maker_project.show_project_files", project_id=project_id))
+        return redirect(url_for("maker_project.show_user_projects"))
 
 ### Download file route
 
 @maker_project.route('/download-file/<int:file_id>')
 @login_required
+@require_project_permission("r", message='You do not have permission to download this file.')
 def download_file(file_id):
-    # check if user is allowed to download this file
-    user_project = UserProject.query.filter_by(user_id=current_user.id, project_id=File.query.get(file_id).project_id).first()
-    permission = user_project.permission if user_project else "-"
-    if "r" in permission:
-        # Get file from db
-        file = File.query.get(file_id)
-        # Get path to project folder
-        project_path = Project.query.get(file.project_id).path
-        project_name = Project.query.get(file.project_id).project_name
-        path_folder = os.path.join(os.getcwd(), project_path, project_name)    
-        return send_from_directory(path_folder, file.filename, as_attachment=True, max_age=0)
-    else:
-        flash('You do not have permission to download this file.', 'danger')
-        return redirect(url_for("maker_project.show_user_projects"))
+    access = get_project_access()
+    # ETag/Last-Modified and Range requests are handled by send_project_file
+    return send_project_file(access.project, access.file)
+
+### File versions routes
+
+@maker_project.route('/file-versions/<int:file_id>', methods=['GET'])
+@login_required
+@require_project_permission("r", message='You do not have permission to view this file.')
+def file_versions(file_id):
+    access = get_project_access()
+    return render_template("maker_project/file-versions.html", file=access.file, versions=access.file.versions, project_id=access.project.id)
+
+@maker_project.route('/download-file/<int:file_id>/version/<int:version>')
+@login_required
+@require_project_permission("r", message='You do not have permission to download this file.')
+def download_file_version(file_id, version):
+    access = get_project_access()
+    file_version = FileVersion.query.filter_by(file_id=file_id, version=version).first()
+    if not file_version:
+        flash(f'Version {version} of file {access.file.filename} does not exist.', 'danger')
+        return redirect(url_for("maker_project.file_versions", file_id=file_id))
+    return send_project_file(access.project, access.file, file_version)
 
 ### Rename file route
 
 @maker_project.route('/rename-file/<int:file_id>', methods=['GET', 'POST'])
 @login_required
+@require_project_permission("w", message='You do not have permission to rename this file.')
 def rename_file(file_id):
     form = RenameObject()
-    file = File.query.get(file_id)
+    file = get_project_access().file
     project_id = file.project_id
-    project = Project.query.get(project_id)
+    project = get_project_access().project
     file_name = file.filename
     username = current_user.username
     if form.validate_on_submit():
@@ -457,38 +478,23 @@ def rename_file(file_id):
             flash(f'File {new_name} already exists. Please choose a different file name.', 'info')
             critical_error_logger(f'File {new_name} already exists.')
             return render_template("maker_project/rename-file.html", form=form, file_id=file_id, file_name=file.filename, project_id=project_id)
-        # Check user permissions
-        permission = UserProject.query.filter_by(user_id=current_user.id, project_id=project_id).first().permission
-        # Get project details
-        if "w" in permission:
-            # Rename file
-            old_path = os.path.join(os.getcwd(), project.path, project.project_name, file_name)
-            new_path = os.path.join(os.getcwd(), project.path, project.project_name, new_name)
-            try:
-                os.rename(old_path, new_path)
-                # Update file name in db
-                file.filename = new_name
-                db.session.commit()
-                flash(f'File {file_name} renamed to {new_name} successfully.', 'success')
-                current_app.logger.info(f"File {file_name} renamed to {new_name} by {username}.")
-                return redirect(url_for("maker_project.show_project_files", project_id=project_id))
-            except OSError as e:
-                flash(f'An error occurred while renaming file {file_name}.', 'danger')
-                critical_error_logger(f"Error renaming file {file_name} for {username}.")
-                return redirect(url_for("maker_project.show_project_files", project_id=project_id))
-        else:
-            flash('You do not have permission to rename this file.', 'danger')
-            critical_error_logger(f"Renaming file {file.filename} was not allowed for {username}.")
+        # Rename file
+        old_path = os.path.join(os.getcwd(), project.path, project.project_name, file_name)
+        new_path = os.path.join(os.getcwd(), project.path, project.project_name, new_name)
+        try:
+            os.rename(old_path, new_path)
+            # Update file name in db
+            file.filename = new_name
+            db.session.commit()
+            flash(f'File {file_name} renamed to {new_name} successfully.', 'success')
+            current_app.logger.info(f"File {file_name} renamed to {new_name} by {username}.")
             return redirect(url_for("maker_project.show_project_files", project_id=project_id))
-    else:
-        # Check user permissions
-        permission = UserProject.query.filter_by(user_id=current_user.id, project_id=project_id).first().permission
-        if "w" in permission:
-            return render_template("maker_project/rename-file.html", form=form, file_id=file_id, file_name=file_name, project_id=project_id)
-        else:
-            flash('You do not have permission to rename this file.', 'danger')
-            critical_error_logger(f"Renaming file {file_name} was not allowed for {username}.")
+        except OSError as e:
+            flash(f'An error occurred while renaming file {file_name}.', 'danger')
+            critical_error_logger(f"Error renaming file {file_name} for {username}.")
             return redirect(url_for("maker_project.show_project_files", project_id=project_id))
+    else:
+        return render_template("maker_project/rename-file.html", form=form, file_id=file_id, file_name=file_name, project_id=project_id)
         
 #### MMM ROUTES
 
@@ -496,27 +502,23 @@ def rename_file(file_id):
 
 @maker_project.route('/mmm-selection/<int:project_id>', methods=['GET', 'POST'])
 @login_required
+@require_project_permission("w", message='You do not have permission to run Maker steps in this project.')
 def mmm_selection(project_id):
     form = MMMDynamicForm()
-    # Empty HTML output for VerifyBibTeX step
-    verifybibtex_html = ""
     if form.validate_on_submit():
         # Get selected files
         selected_files = [choice.file_name.data for choice in form.file_choices if choice.selected.data]
         # Get selected MMM step
         selected_mmm = form.mmm_choices.data
         # If XML2YAML is selected, get additional information
-        xml2yaml_data: dict = get_xml2yaml_data(form) if selected_mmm == "xml2yaml" else dict()
+        xml2yaml_data: dict = get_xml2yaml_data(form) if selected_mmm in ["xml2yaml", "pipeline"] else dict()
         # Check if Zotero was used
         zotero_used = form.zotero_used.data
-        # Create files
-        project = Project.query.get(project_id)
-        dir_path = os.path.join(project.path, project.project_name)
         # Check if an optional file name was passed for Maker/DW step
         custom_file_name = form.custom_file_name.data
         # Get selected output formats for Maker/DW step
         output_formats = []
-        if selected_mmm == "dw":
+        if selected_mmm in ["dw", "pipeline"]:
             if form.pdf_output.data:
                 output_formats.append("pdf")
             if form.html_output.data:
@@ -525,19 +527,18 @@ def mmm_selection(project_id):
                 output_formats.append("jats")
             if form.tex_output.data:
                 output_formats.append("tex")
-            res_str = create_files(dir_path, selected_files, selected_mmm, project_id, xml2yaml_data, zotero_used, custom_file_name, output_formats=output_formats)
-        else:
-            res_str = create_files(dir_path, selected_files, selected_mmm, project_id, xml2yaml_data, zotero_used, custom_file_name)
-        # Create flash message depending on result
-        if res_str == "true":
-            # Create HTML output for VerifyBibTeX step
-            if selected_mmm == "verifybibtex":
-                verifybibtex_html = create_html_verifybibtex(dir_path)
-            flash('Files created successfully!', 'success')
-        else:
-            flash(f'An error occurred while creating files: {res_str}', 'danger')
-        # Debug rendering
-        return render_template("maker_project/mmm-output.html", project_id=project_id, selected_files=selected_files, selected_mmm=selected_mmm, verifybibtex_html=verifybibtex_html)
+        # Full pipeline: queue all steps as a dependency graph of jobs
+        if selected_mmm == "pipeline":
+            jobs = enqueue_maker_pipeline(project_id, current_user.id, selected_files, xml2yaml_data, zotero_used, custom_file_name, output_formats=output_formats)
+            if isinstance(jobs, str):
+                flash(f'An error occurred while creating files: {jobs}', 'danger')
+                return redirect(url_for('maker_project.mmm_selection', project_id=project_id))
+            current_app.logger.info(f"Pipeline {jobs[0].pipeline_id} queued by {current_user.username}.")
+            return redirect(url_for('maker_project.show_job', job_id=jobs[0].id))
+        # Hand the Maker step over to the job worker and show the job status page
+        job = enqueue_maker_job(project_id, current_user.id, selected_mmm, selected_files, xml2yaml_data, zotero_used, custom_file_name, output_formats=output_formats)
+        current_app.logger.info(f"Job {job.id} ({selected_mmm}) queued by {current_user.username}.")
+        return redirect(url_for('maker_project.show_job', job_id=job.id))
     else:
         # Get all files and filenames from project folder
         files = File.query.filter_by(project_id=project_id).all()
@@ -549,3 +550,32 @@ def mmm_selection(project_id):
             file_form.file_name.data = file  # Store filename or identifier if needed
         return render_template("maker_project/mmm-selection.html", project_id=project_id, form=form)
 
+### Job status route
+
+@maker_project.route('/job/<int:job_id>', methods=['GET'])
+@login_required
+def show_job(job_id):
+    job = Job.query.get(job_id)
+    if job is None:
+        flash('Job not found.', 'danger')
+        return redirect(url_for("maker_project.show_user_projects"))
+    # Check user permissions
+    access = resolve_project_access(current_user.id, job.project_id)
+    if not access or "r" not in access.permission:
+        flash('You do not have permission to see this job.', 'danger')
+        return redirect(url_for("maker_project.show_user_projects"))
+    # All steps of a full pipeline are shown on one page
+    pipeline_jobs = Job.query.filter_by(pipeline_id=job.pipeline_id).order_by(Job.id).all() if job.pipeline_id else []
+    pipeline_steps = [(pipeline_job, json.loads(pipeline_job.arguments)["selected_files"]) for pipeline_job in pipeline_jobs]
+    selected_files = json.loads(job.arguments)["selected_files"]
+    # Empty HTML output for VerifyBibTeX step
+    verifybibtex_html = ""
+    verifybibtex_pages = 0
+    verifybibtex_page = request.args.get("page", 1, type=int)
+    verifybibtex_job = next((j for j in pipeline_jobs or [job] if j.mmm_choice == "verifybibtex"), None)
+    if verifybibtex_job and verifybibtex_job.status == "finished":
+        project = access.project
+        # Large reports are shown page by page (parsed once and cached until the report changes)
+        verifybibtex_html, verifybibtex_pages = create_html_verifybibtex(os.path.join(project.path, project.project_name), verifybibtex_page)
+        verifybibtex_page = min(max(verifybibtex_page, 1), verifybibtex_pages)
+    return render_template("maker_project/mmm-output.html", job=job, pipeline_steps=pipeline_steps, project_id=job.project_id, selected_files=selected_files, selected_mmm=job.mmm_choice, verifybibtex_html=verifybibtex_html, verifybibtex_page=verifybibtex_page, verifybibtex_pages=verifybibtex_pages)
@@ -3,4 +3,12 @@
 # For more information, please refer to the LICENSE file in the root directory of this project.
 
 from .functions import *
-from .file_creation_functions import critical_error_logger
\ No newline at end of file
+from .file_creation_functions import critical_error_logger, stream_zip_file, list_project_folder
+from .jobs import enqueue_maker_job, enqueue_maker_pipeline, claim_next_job, run_job, reset_interrupted_jobs, job_worker_loop
+from .chunked_upload import ChunkedUploadError, init_chunked_upload, get_upload_offset, write_upload_chunk, finalize_chunked_upload, discard_chunked_upload, remove_stale_uploads
+from .permissions import ProjectAccess, require_project_permission, get_project_access, resolve_project_access, resolve_file_access, invalidate_project_permission
+from .container_pool import warm_up_container_pools, shutdown_container_pools
+from .file_versions import archive_head_version, get_version_path, remove_file_versions
+from .blob_store import store_blob, unshare_linked_files, remove_unused_blobs
+from .trash import move_to_trash, empty_trash
+from .verifybibtex_report import create_html_verifybibtex
\ No newline at end of file
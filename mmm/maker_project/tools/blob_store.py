@@ -0,0 +1,143 @@
+# Copyright (c) 2024 Thomas Jurczyk
+# This software is provided under the MIT License.
+# For more information, please refer to the LICENSE file in the root directory of this project.
+
+import os, shutil, subprocess, uuid
+from stat import S_ISREG
+from typing import List, Optional
+from flask import current_app
+from .result_cache import hash_file
+
+## BLOB STORE
+## Uploads and Maker outputs are stored once per content in BLOB_STORE_PATH (default: uploads/.blobs) under their
+## SHA-256 (<first two characters>/<digest>). The files in the project folders are hardlinks to these blobs, so the
+## module containers still see normal files in their volume mounts and the same DOCX uploaded into several projects
+## only uses disk space once. A blob is removed when no project folder links to it anymore (link count 1, see
+## remove_unused_blobs). If hardlinks are not possible (e.g., BLOB_STORE_PATH on another file system), the files are
+## kept as they are and only their digest is recorded.
+## The module containers write into the project folder and may overwrite existing files in place. Before a Maker step,
+## all linked files of the project folder are therefore replaced by copies (reflinks on file systems that support
+## them) and linked again after the step if they did not change (see run_maker_step).
+
+def get_blob_store_path() -> Optional[str]:
+    '''Function to get the folder of the blob store or None if the blob store is disabled (BLOB_STORE_ENABLED).'''
+    if not current_app.config.get("BLOB_STORE_ENABLED", True):
+        return None
+    return current_app.config.get("BLOB_STORE_PATH", "uploads/.blobs")
+
+def get_blob_path(digest: str) -> Optional[str]:
+    '''Function to get the path of a blob or None if the blob store is disabled.'''
+    blob_store_path = get_blob_store_path()
+    if blob_store_path is None:
+        return None
+    return os.path.join(blob_store_path, digest[:2], digest)
+
+def store_blob(file_path: str, digest: Optional[str] = None) -> str:
+    '''Function to store a file in the blob store.
+
+        If a blob with the same content exists, the file is replaced by a hardlink to it; otherwise the file becomes
+        the blob (a hardlink is added to the blob store).
+
+        Arguments
+        ---------
+        file_path : str
+            Path to the file (in a project folder).
+
+        digest : Optional[str]
+            SHA-256 of the file if it is already known.
+
+        Returns
+        -------
+        str : The SHA-256 of the file.
+    '''
+    digest = digest or hash_file(file_path)
+    blob_path = get_blob_path(digest)
+    if blob_path is None:
+        return digest
+    try:
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        # Two attempts: the blob can be created or removed by another process in between
+        for _ in range(2):
+            try:
+                if os.path.samefile(blob_path, file_path):
+                    return digest
+                temp_path = os.path.join(os.path.dirname(file_path), f".blob-{uuid.uuid4().hex}")
+                os.link(blob_path, temp_path)
+                os.replace(temp_path, file_path)
+                return digest
+            except FileNotFoundError:
+                pass
+            try:
+                os.link(file_path, blob_path)
+                return digest
+            except FileExistsError:
+                pass
+    except OSError as e:
+        # No hardlinks possible; keep the file as it is
+        current_app.logger.warning(f"File {file_path} could not be linked to the blob store: {e}")
+    return digest
+
+def unshare_linked_files(dir_path: str, filenames: Optional[List[str]] = None) -> List[str]:
+    '''Function to replace hardlinked files of a project folder by copies (before a Maker step writes into them).
+
+        Arguments
+        ---------
+        dir_path : str
+            Path to the project folder.
+
+        filenames : Optional[List[str]]
+            Names of the files to be unshared (files that do not exist are ignored); all files of the folder if None.
+
+        Returns
+        -------
+        List[str] : Names of the files that were replaced by copies.
+    '''
+    if filenames is None:
+        with os.scandir(dir_path) as it:
+            filenames = [entry.name for entry in it if not entry.name.startswith(".")]
+    unshared = []
+    for filename in dict.fromkeys(filenames):
+        file_path = os.path.join(dir_path, filename)
+        try:
+            stat = os.stat(file_path, follow_symlinks=False)
+        except FileNotFoundError:
+            continue
+        if not S_ISREG(stat.st_mode) or stat.st_nlink < 2:
+            continue
+        temp_path = os.path.join(dir_path, f".unshare-{uuid.uuid4().hex}")
+        copy_file(file_path, temp_path)
+        os.replace(temp_path, file_path)
+        unshared.append(filename)
+    return unshared
+
+def copy_file(source: str, destination: str) -> None:
+    '''Function to copy a file with its modification time (as reflink if the file system supports it).'''
+    try:
+        result = subprocess.run(["cp", "--reflink=auto", "--preserve=mode,timestamps", source, destination], capture_output=True)
+        if result.returncode == 0:
+            return
+    except OSError:
+        pass
+    shutil.copy2(source, destination)
+
+def remove_unused_blobs() -> int:
+    '''Function to remove blobs that are not linked from any project folder anymore.
+
+        Returns
+        -------
+        int : Number of removed blobs.
+    '''
+    blob_store_path = get_blob_store_path()
+    if blob_store_path is None or not os.path.isdir(blob_store_path):
+        return 0
+    removed = 0
+    with os.scandir(blob_store_path) as prefixes:
+        for prefix in prefixes:
+            if not prefix.is_dir(follow_symlinks=False):
+                continue
+            with os.scandir(prefix.path) as blobs:
+                for blob in blobs:
+                    if blob.is_file(follow_symlinks=False) and blob.stat(follow_symlinks=False).st_nlink == 1:
+                        os.remove(blob.path)
+                        removed += 1
+    return removed
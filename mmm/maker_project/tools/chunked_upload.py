@@ -0,0 +1,206 @@
+# Copyright (c) 2024 Thomas Jurczyk
+# This software is provided under the MIT License.
+# For more information, please refer to the LICENSE file in the root directory of this project.
+
+import fcntl, os, uuid
+from datetime import datetime, timedelta
+from typing import IO, Optional, Tuple
+from flask import current_app
+from werkzeug.exceptions import ClientDisconnected
+from mmm import db
+from mmm.maker_project.models import Project, File, Upload
+from .functions import file_exists
+from .result_cache import hash_file
+from .file_versions import get_version_path
+from .blob_store import store_blob
+
+## CHUNKED UPLOADS
+## Large files are uploaded in chunks (each chunk is a separate request, so MAX_CONTENT_LENGTH only limits the chunk
+## size). Every chunk is streamed from the request body straight into a hidden part file in the project folder, so
+## memory usage does not depend on the file size. The offset of an upload is the size of its part file: after a
+## broken connection, the client asks for the offset and continues from there. When all bytes have arrived, the part
+## file is renamed to its final name (atomic) and registered in the files table. The SHA-256 of the file is computed
+## from the part file when the upload is finalized, since the chunks of an upload can be handled by different
+## processes (gunicorn workers).
+
+CHUNK_READ_SIZE = 64 * 1024
+
+class ChunkedUploadError(Exception):
+    '''Error of the chunked upload API; offset is the number of bytes the server has received so far.'''
+
+    def __init__(self, message: str, offset: Optional[int] = None):
+        super().__init__(message)
+        self.offset = offset
+
+def get_part_path(project: Project, upload: Upload) -> str:
+    '''Function to get the path of the part file of an upload (hidden file in the project folder).'''
+    return os.path.join(project.path, project.project_name, f".upload-{upload.id}.part")
+
+def init_chunked_upload(project: Project, filename: str, size: int, user_id: int) -> Upload:
+    '''Function to start a chunked upload.
+
+        Arguments
+        ---------
+        project : Project
+            The project the file is uploaded to.
+
+        filename : str
+            The (secure) name of the file.
+
+        size : int
+            The size of the file in bytes.
+
+        user_id : int
+            ID of the user who uploads the file.
+
+        Returns
+        -------
+        Upload : The new upload.
+    '''
+    max_size = int(current_app.config.get("MAX_UPLOAD_SIZE", 2 * 1024 * 1024 * 1024))
+    if size < 0 or size > max_size:
+        raise ChunkedUploadError(f"Files must not be larger than {max_size // (1024 * 1024)} MB.")
+    upload = Upload(uuid.uuid4().hex, project.id, user_id, filename, size, datetime.now(), datetime.now())
+    open(get_part_path(project, upload), "wb").close()
+    db.session.add(upload)
+    db.session.commit()
+    return upload
+
+def get_upload_offset(project: Project, upload: Upload) -> int:
+    '''Function to get the number of bytes received so far (the offset the next chunk has to start at).'''
+    try:
+        return os.path.getsize(get_part_path(project, upload))
+    except OSError:
+        raise ChunkedUploadError("The upload does not exist anymore.")
+
+def write_upload_chunk(project: Project, upload: Upload, offset: int, stream: IO[bytes]) -> int:
+    '''Function to append a chunk to the part file of an upload.
+
+        The chunk is read from stream in small blocks and written directly to disk. If the connection breaks, the
+        bytes received so far are kept and a ChunkedUploadError with the offset the client can continue at is raised.
+
+        Arguments
+        ---------
+        project : Project
+            The project of the upload.
+
+        upload : Upload
+            The upload.
+
+        offset : int
+            Position of the chunk in the file; needs to be the current offset of the upload.
+
+        stream : IO[bytes]
+            The request body.
+
+        Returns
+        -------
+        int : The new offset.
+    '''
+    try:
+        part_file = open(get_part_path(project, upload), "r+b")
+    except OSError:
+        raise ChunkedUploadError("The upload does not exist anymore.")
+    with part_file:
+        # Two requests for the same chunk (e.g., a retry while the first request is still running) must not interleave
+        fcntl.flock(part_file, fcntl.LOCK_EX)
+        current_offset = os.fstat(part_file.fileno()).st_size
+        if offset != current_offset:
+            raise ChunkedUploadError(f"Chunk starts at {offset}, but {current_offset} bytes have been received.", current_offset)
+        part_file.seek(offset)
+        written = 0
+        try:
+            while True:
+                block = stream.read(CHUNK_READ_SIZE)
+                if not block:
+                    break
+                if offset + written + len(block) > upload.size:
+                    raise ChunkedUploadError("The chunk exceeds the announced file size.", offset + written)
+                part_file.write(block)
+                written += len(block)
+        except ClientDisconnected:
+            raise ChunkedUploadError("The connection was interrupted.", offset + written)
+        finally:
+            part_file.flush()
+    upload.changed_at = datetime.now()
+    db.session.commit()
+    return offset + written
+
+def finalize_chunked_upload(project: Project, upload: Upload, user_id: int, expected_sha256: Optional[str] = None) -> Tuple[File, str]:
+    '''Function to finish a chunked upload: the part file is renamed to the file name and registered in the database.
+
+        If a file with the same name already exists, the upload becomes its new version (see file_exists). The file
+        is stored in the blob store.
+
+        Arguments
+        ---------
+        project : Project
+            The project of the upload.
+
+        upload : Upload
+            The upload.
+
+        user_id : int
+            ID of the user who uploaded the file.
+
+        expected_sha256 : Optional[str]
+            SHA-256 computed by the client; if given and different, the upload is discarded.
+
+        Returns
+        -------
+        Tuple[File, str] : The new file and the SHA-256 of its content.
+    '''
+    part_path = get_part_path(project, upload)
+    size = get_upload_offset(project, upload)
+    if size != upload.size:
+        raise ChunkedUploadError(f"Only {size} of {upload.size} bytes have been received.", size)
+    digest = hash_file(part_path)
+    if expected_sha256 and expected_sha256.lower() != digest:
+        discard_chunked_upload(project, upload)
+        raise ChunkedUploadError("The checksum of the uploaded file does not match. Please upload the file again.")
+    head_path = os.path.join(project.path, project.project_name, upload.filename)
+    # Check if file exists and keep its current content as old version
+    had_content = os.path.isfile(head_path)
+    file = file_exists(upload.filename, project.id)
+    version_path = get_version_path(project, file.id, file.version - 1) if file and had_content else None
+    try:
+        os.replace(part_path, head_path)
+    except OSError:
+        db.session.rollback()
+        if version_path:
+            os.rename(version_path, head_path)
+        raise
+    store_blob(head_path, digest)
+    if file:
+        file.changed_at = datetime.now()
+        file.production_file = False
+    else:
+        file = File(upload.filename, project.id, user_id, datetime.now(), datetime.now(), False, 0)
+        db.session.add(file)
+    file.digest = digest
+    db.session.delete(upload)
+    db.session.commit()
+    return file, digest
+
+def discard_chunked_upload(project: Project, upload: Upload) -> None:
+    '''Function to cancel an upload and to remove its part file.'''
+    try:
+        os.remove(get_part_path(project, upload))
+    except FileNotFoundError:
+        pass
+    db.session.delete(upload)
+    db.session.commit()
+
+def remove_stale_uploads() -> int:
+    '''Function to remove uploads that have not received data for UPLOAD_EXPIRY_HOURS hours (default: 24).
+
+        Returns
+        -------
+        int : Number of removed uploads.
+    '''
+    expiry = datetime.now() - timedelta(hours=float(current_app.config.get("UPLOAD_EXPIRY_HOURS", 24)))
+    stale_uploads = Upload.query.filter(Upload.changed_at < expiry).all()
+    for upload in stale_uploads:
+        project = Project.query.get(upload.project_id)
+        discard_chunked_upload(project, upload)
+    return len(stale_uploads)
@@ -0,0 +1,222 @@
+# Copyright (c) 2024 Thomas Jurczyk
+# This software is provided under the MIT License.
+# For more information, please refer to the LICENSE file in the root directory of this project.
+
+import json, os, queue, re, shlex, subprocess, threading, time, uuid
+from typing import Dict, List, Optional, Tuple
+from flask import current_app
+from mmm.tools import observe_container_phase, observe_container_exit
+
+## CONTAINER POOL
+## Instead of paying container creation/startup/teardown for every Maker step (docker run --rm), the pool keeps
+## CONTAINER_POOL_SIZE long-lived containers per module image and runs the module inside them with docker exec.
+## Each pooled container mounts UPLOAD_PATH (the HOST path!) at POOL_MOUNT_POINT; the bind mounts that the oneshot
+## mode would pass to docker run are recreated as symlinks into that mount before the module is started.
+## A container runs only one step at a time and is recycled after CONTAINER_POOL_MAX_JOBS steps.
+
+POOL_MOUNT_POINT = "/mmm"
+
+class PooledContainer:
+    '''A long-lived container of a ContainerPool.'''
+
+    def __init__(self, container_id: str):
+        self.container_id = container_id
+        self.jobs_done = 0
+
+    def __repr__(self):
+        return f"PooledContainer('{self.container_id}', '{self.jobs_done}')"
+
+class ContainerPool:
+    '''Pool of long-lived containers for one module image.
+
+        Arguments
+        ---------
+        image : str
+            The module image (e.g., the value of TYPESETTING_IMAGE).
+
+        upload_path : str
+            The UPLOAD_PATH on the HOST system; it is mounted into every pooled container.
+
+        size : int
+            Maximum number of containers (and thus of parallel steps) for this image.
+
+        max_jobs : int
+            Number of steps after which a container is replaced by a fresh one.
+    '''
+
+    def __init__(self, image: str, upload_path: str, size: int, max_jobs: int):
+        self.image = image
+        self.upload_path = upload_path
+        self.size = size
+        self.max_jobs = max_jobs
+        self._idle: "queue.Queue[PooledContainer]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = 0
+        self._entrypoint: Optional[List[str]] = None
+        self._cmd: List[str] = []
+        self._workdir = "/"
+
+    def run(self, mounts: List[Tuple[str, str]], container_arguments: List[str], environment: Dict[str, str] = {}) -> int:
+        '''Run the module in one of the pooled containers (see run_module_container for the arguments).
+
+            Returns
+            -------
+                int: The exit code of the module.
+        '''
+        link_script = self._link_script(mounts)
+        # Start phase: waiting for an idle container (or starting a new one)
+        started_at = time.monotonic()
+        container = self._checkout()
+        observe_container_phase(self.image, "start", time.monotonic() - started_at)
+        exec_command = ["docker", "exec", "-w", self._workdir]
+        for key, value in environment.items():
+            exec_command.extend(["-e", f"{key}={value}"])
+        exec_command.extend([container.container_id, "sh", "-c", link_script, "sh"])
+        # Without arguments, docker run would fall back to the CMD of the image
+        exec_command.extend(self._entrypoint + (container_arguments if container_arguments else self._cmd))
+        returncode = 127
+        started_at = time.monotonic()
+        try:
+            returncode = subprocess.run(exec_command).returncode
+        finally:
+            observe_container_phase(self.image, "run", time.monotonic() - started_at)
+            observe_container_exit(self.image, returncode)
+            container.jobs_done += 1
+            # 126/127: the command could not be run inside the container; do not reuse this container
+            if container.jobs_done >= self.max_jobs or returncode in (126, 127):
+                self._remove(container)
+            else:
+                self._idle.put(container)
+        return returncode
+
+    def warm_up(self) -> None:
+        '''Start containers until the pool is full, so that the first steps do not pay the container startup.'''
+        while True:
+            with self._lock:
+                if self._started >= self.size:
+                    return
+                self._started += 1
+            try:
+                self._idle.put(self._start())
+            except Exception:
+                with self._lock:
+                    self._started -= 1
+                raise
+
+    def shutdown(self) -> None:
+        '''Remove all idle containers of this pool.'''
+        while True:
+            try:
+                container = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._remove(container)
+
+    def _checkout(self) -> PooledContainer:
+        '''Get a healthy idle container; start a new one if the pool is not full yet, else wait for one.'''
+        while True:
+            try:
+                container = self._idle.get_nowait()
+            except queue.Empty:
+                container = None
+                with self._lock:
+                    if self._started < self.size:
+                        self._started += 1
+                        start_new = True
+                    else:
+                        start_new = False
+                if start_new:
+                    try:
+                        return self._start()
+                    except Exception:
+                        with self._lock:
+                            self._started -= 1
+                        raise
+                container = self._idle.get()
+            if self._is_healthy(container):
+                return container
+            self._remove(container)
+
+    def _start(self) -> PooledContainer:
+        '''Start a new long-lived container that idles until work is passed via docker exec.'''
+        if self._entrypoint is None:
+            self._inspect_image()
+        name = f"mmm-pool-{re.sub(r'[^a-zA-Z0-9]+', '-', self.image).strip('-')}-{uuid.uuid4().hex[:8]}"
+        docker_command = ["docker", "run", "-d", "--rm", "--name", name, "--volume", f"{self.upload_path}:{POOL_MOUNT_POINT}", "--entrypoint", "tail", self.image, "-f", "/dev/null"]
+        result = subprocess.run(docker_command, capture_output=True, text=True, check=True)
+        current_app.logger.info(f"Container pool: started {name} for {self.image}.")
+        return PooledContainer(result.stdout.strip())
+
+    def _inspect_image(self) -> None:
+        '''Read entrypoint and working directory of the image; docker exec does not use them by itself.'''
+        result = subprocess.run(["docker", "image", "inspect", "--format", "{{json .Config}}", self.image], capture_output=True, text=True, check=True)
+        config = json.loads(result.stdout)
+        self._entrypoint = config.get("Entrypoint") or []
+        self._cmd = config.get("Cmd") or []
+        self._workdir = config.get("WorkingDir") or "/"
+
+    def _is_healthy(self, container: PooledContainer) -> bool:
+        '''Check that the container is still running and able to execute commands.'''
+        result = subprocess.run(["docker", "exec", container.container_id, "sh", "-c", ":"], capture_output=True)
+        return result.returncode == 0
+
+    def _remove(self, container: PooledContainer) -> None:
+        '''Remove a container from the pool (e.g., after CONTAINER_POOL_MAX_JOBS steps or a failed health check).'''
+        subprocess.run(["docker", "rm", "-f", container.container_id], capture_output=True)
+        with self._lock:
+            self._started -= 1
+
+    def _link_script(self, mounts: List[Tuple[str, str]]) -> str:
+        '''Create the shell script that replaces the bind mounts of the oneshot mode by symlinks and starts the module.'''
+        lines = ["set -e"]
+        for host_path, container_path in mounts:
+            relative_path = os.path.relpath(host_path, self.upload_path)
+            if relative_path.startswith(".."):
+                raise ValueError(f"{host_path} is not located in UPLOAD_PATH and cannot be used in pool mode.")
+            source = os.path.normpath(os.path.join(POOL_MOUNT_POINT, relative_path))
+            target = shlex.quote(container_path)
+            lines.append(f"mkdir -p {shlex.quote(os.path.dirname(container_path))}")
+            lines.append(f"rm -rf {target}")
+            lines.append(f"ln -s {shlex.quote(source)} {target}")
+        lines.append('exec "$@"')
+        return "\n".join(lines)
+
+_pools: Dict[str, ContainerPool] = {}
+_pools_lock = threading.Lock()
+
+def get_container_pool(image: str) -> ContainerPool:
+    '''Function to get (or create) the container pool for a module image.
+
+        Arguments
+        ---------
+        image : str
+            The module image.
+
+        Returns
+        -------
+        ContainerPool : The pool for this image (one pool per image and process).
+    '''
+    with _pools_lock:
+        if image not in _pools:
+            _pools[image] = ContainerPool(image, current_app.config.get('UPLOAD_PATH'), int(current_app.config.get('CONTAINER_POOL_SIZE', 2)), int(current_app.config.get('CONTAINER_POOL_MAX_JOBS', 20)))
+        return _pools[image]
+
+def warm_up_container_pools() -> None:
+    '''Function to start the containers of all module images if CONTAINER_EXECUTION_MODE is pool.'''
+    if current_app.config.get('CONTAINER_EXECUTION_MODE', 'oneshot') != 'pool':
+        return
+    for image_key in ['DOC2MD_IMAGE', 'VERIFYBIBTEX_IMAGE', 'XML2YAML_IMAGE', 'TYPESETTING_IMAGE', 'TEX2PDF_IMAGE']:
+        image = current_app.config.get(image_key)
+        if not image:
+            continue
+        try:
+            get_container_pool(image).warm_up()
+        except Exception as e:
+            current_app.logger.error(f"Container pool: could not start containers for {image}: {e}")
+
+def shutdown_container_pools() -> None:
+    '''Function to remove the idle containers of all pools (called when the job worker stops).'''
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.shutdown()
+        _pools.clear()
@@ -2,13 +2,16 @@
 # This software is provided under the MIT License.
 # For more information, please refer to the LICENSE file in the root directory of this project.
 
-import string, os, random, subprocess, zipfile
+import string, os, random, subprocess, time, zipfile
 from datetime import datetime
-from typing import List, Optional
+from typing import List, Optional, Tuple, Dict, Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from flask import current_app
 from flask_login import current_user
 import shutil
 from flask import current_app
+from mmm.tools import observe_container_phase, observe_container_exit
+from .container_pool import get_container_pool
 
 def create_files_doc2md(dir_path: str, doc_file_name: str, zotero_used: bool) -> bool:
     '''Function to call Docker container to create MD files from uploaded document file.
@@ -34,14 +37,12 @@ def create_files_doc2md(dir_path: str, doc_file_name: str, zotero_used: bool) ->
 
     # Run docker container
     if not zotero_used:
-        docker_command = ["docker", "run","--rm", "--volume", f"{HOST_UPLOAD_DIR}:/app/files", current_app.config.get('DOC2MD_IMAGE'), doc_file_name]
+        returncode = run_module_container(current_app.config.get('DOC2MD_IMAGE'), [(HOST_UPLOAD_DIR, "/app/files")], [doc_file_name])
     else:
-        docker_command = ["docker", "run","--rm", "--volume", f"{HOST_UPLOAD_DIR}:/app/files", current_app.config.get('DOC2MD_IMAGE'), "--zotero", doc_file_name]
-
-    result = subprocess.run(docker_command)
+        returncode = run_module_container(current_app.config.get('DOC2MD_IMAGE'), [(HOST_UPLOAD_DIR, "/app/files")], ["--zotero", doc_file_name])
     
     # check if the command was successful
-    if result.returncode == 0:
+    if returncode == 0:
         docker_logger_success("DOC2MD", dir_path)
         print("Container started successfully")
         return True
@@ -50,7 +51,7 @@ def create_files_doc2md(dir_path: str, doc_file_name: str, zotero_used: bool) ->
         print("Error in running container")
         return False
 
-def create_files_dw(dir_path: str, md_file_name: str, yml_file_name: str, bibtex_file_name: Optional[str] = None, filename: str = "default", output_formats: List[Optional[str]] = []) -> bool:
+def create_files_dw(dir_path: str, md_file_name: str, yml_file_name: str, bibtex_file_name: Optional[str] = None, filename: str = "default", output_formats: List[Optional[str]] = [], on_format_done: Optional[Callable[[str], None]] = None) -> bool:
     '''Function to call Docker container to create output files from uploaded files.
 
         Parameters
@@ -72,6 +73,9 @@ def create_files_dw(dir_path: str, md_file_name: str, yml_file_name: str, bibtex
 
             output_formats: List[Optional[str]]
                 The output formats to be created (default: ["pdf", "html", "jats", "tex"]).
+
+            on_format_done: Optional[Callable[[str], None]]
+                Called with the name of each output file as soon as it is available.
         Returns
         -------
             bool: True if the file has successfully been created, else False.
@@ -79,37 +83,159 @@ def create_files_dw(dir_path: str, md_file_name: str, yml_file_name: str, bibtex
         
     ## DIFFICULT PART!
     ## This program uses docker in docker. When calling the tpyesetting-container-os container
-    ## we need to make sure to mount the correct volume from the HOST system; to make sure this is the case, you NEED to pass this path explicitly in an environment variable when creating the container (UPLOAD_PATH in this example)
+    ## we need to make sure to mount the correct volume from the HOST system; to make sure this is the case, you NEED to pass this path explicitly in an environment variable when creating the container (UPLOAD_PATH in this example; see run_typesetting_containers)
 
-    HOST_UPLOAD_DIR = os.path.join(current_app.config.get('UPLOAD_PATH'), dir_path)
+    # Fan the output formats out into one container per format
+    formats = [format.strip() for format in output_formats] if output_formats != [] else ["pdf", "html", "jats", "tex"]
+    if current_app.config.get('MAKER_PARALLEL_FORMATS', False) and len(formats) > 1:
+        return create_files_dw_parallel(dir_path, md_file_name, yml_file_name, bibtex_file_name, filename, formats, on_format_done)
 
     # Run docker typesetting-container-os
-    docker_command = ["docker", "run","--rm", "--volume", f"{HOST_UPLOAD_DIR}:/app/article", current_app.config.get('TYPESETTING_IMAGE'), "--metadata_file", yml_file_name, "--markdown_file", md_file_name, "--filename", filename]
+    container_arguments = ["--metadata_file", yml_file_name, "--markdown_file", md_file_name, "--filename", filename]
 
     # Add bibtex file if it exists
     if bibtex_file_name != None:
-        docker_command.extend(["--bibtex_file", bibtex_file_name])
+        container_arguments.extend(["--bibtex_file", bibtex_file_name])
 
     # Select output files
     if output_formats == []:
         # In this case, we create all output files
-        docker_command.extend(["--pdf", "--html", "--jats", "--tex"])
+        container_arguments.extend(["--pdf", "--html", "--jats", "--tex"])
     else: # In this case, we create only the specified output files
         for format in output_formats:
-            docker_command.append(f"--{format.strip()}")
-    
-    # Running docker container
-    result = subprocess.run(docker_command)
+            container_arguments.append(f"--{format.strip()}")
     
-    # Check if the command was successful
-    if result.returncode == 0:
-        docker_logger_success("MAKER", dir_path)
-        print("Container started successfully")
-        return True
-    else:
-        docker_logger_error("MAKER", dir_path)
-        print("Error in running container")
-        return False
+    # Running docker container (in a staging folder, see run_typesetting_containers)
+    input_files = [md_file_name, yml_file_name] + ([bibtex_file_name] if bibtex_file_name != None else [])
+    return run_typesetting_containers(dir_path, input_files, filename, {tuple(formats): container_arguments}, 1, on_format_done)
+
+def create_files_dw_parallel(dir_path: str, md_file_name: str, yml_file_name: str, bibtex_file_name: Optional[str], filename: str, output_formats: List[str], on_format_done: Optional[Callable[[str], None]] = None) -> bool:
+    '''Function to run the typesetting container once per output format, with at most MAKER_FORMAT_CONCURRENCY containers at the same time.
+
+        As soon as a format is done, its output file is moved into the project folder and on_format_done is called for
+        it; HTML and JATS are thus available while the PDF is still being typeset (see run_typesetting_containers).
+
+        Parameters
+        ----------
+            dir_path, md_file_name, yml_file_name, bibtex_file_name, filename, on_format_done
+                See create_files_dw.
+
+            output_formats: List[str]
+                The output formats to be created.
+
+        Returns
+        -------
+            bool: True if all output files have successfully been created, else False.
+    '''
+    containers = {}
+    for format in output_formats:
+        container_arguments = ["--metadata_file", yml_file_name, "--markdown_file", md_file_name, "--filename", filename]
+        if bibtex_file_name != None:
+            container_arguments.extend(["--bibtex_file", bibtex_file_name])
+        container_arguments.append(f"--{format}")
+        containers[(format,)] = container_arguments
+    input_files = [md_file_name, yml_file_name] + ([bibtex_file_name] if bibtex_file_name != None else [])
+    return run_typesetting_containers(dir_path, input_files, filename, containers, int(current_app.config.get('MAKER_FORMAT_CONCURRENCY', 2)), on_format_done)
+
+def run_typesetting_containers(dir_path: str, input_files: List[str], filename: str, containers: Dict[Tuple[str, ...], List[str]], concurrency: int, on_format_done: Optional[Callable[[str], None]] = None) -> bool:
+    '''Function to run typesetting containers in staging folders inside the project folder.
+
+        Every container runs in its own staging folder (the inputs and the images of the project folder are hardlinked
+        into it), so that neither the containers of one Maker step nor several Maker steps of the project running at
+        the same time overwrite each other's PROCESS.log and intermediate files. As soon as a container is done, all
+        files it created or changed in its staging folder (the output files and, e.g., generated figures) are moved into
+        the project folder and on_format_done is called for its output files. The PROCESS.log of the containers is
+        written to <filename>.PROCESS.log (merged if there are several containers).
+
+        Parameters
+        ----------
+            dir_path, filename, on_format_done
+                See create_files_dw.
+
+            input_files: List[str]
+                The Markdown, YAML, and BibTeX file.
+
+            containers: Dict[Tuple[str, ...], List[str]]
+                The arguments of every container, by the output formats the container creates.
+
+            concurrency: int
+                Maximum number of containers running at the same time.
+
+        Returns
+        -------
+            bool: True if all output files have successfully been created, else False.
+    '''
+    app = current_app._get_current_object()
+    image = current_app.config.get('TYPESETTING_IMAGE')
+    # Inputs needed by the typesetting container: Markdown, YAML, BibTeX, and images
+    input_files = input_files + [entry.name for entry in os.scandir(dir_path) if entry.is_file() and entry.name.rsplit(".", 1)[-1].lower() in ["png", "jpg", "jpeg"] and entry.name not in input_files]
+
+    def run_container(container_arguments: List[str], staging_path: str) -> int:
+        with app.app_context():
+            return run_module_container(image, [(os.path.join(app.config.get('UPLOAD_PATH'), staging_path), "/app/article")], container_arguments)
+
+    # Imported here, since functions.py imports this module
+    from .functions import snapshot_project_folder, get_changed_files
+    staging_paths = {}
+    staging_snapshots = {}
+    for formats in containers:
+        staging_paths[formats] = os.path.join(dir_path, f".maker-{'-'.join(formats)}-{generate_random_dir_name(6)}")
+        os.makedirs(staging_paths[formats])
+        for input_file in input_files:
+            link_or_copy(os.path.join(dir_path, input_file), os.path.join(staging_paths[formats], input_file))
+        staging_snapshots[formats] = snapshot_project_folder(staging_paths[formats])
+
+    success = True
+    process_logs = {}
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = {executor.submit(run_container, container_arguments, staging_paths[formats]): formats for formats, container_arguments in containers.items()}
+            for future in as_completed(futures):
+                formats = futures[future]
+                container_name = f"MAKER ({', '.join(formats)})"
+                staging_path = staging_paths[formats]
+                log_path = os.path.join(staging_path, "PROCESS.log")
+                if os.path.exists(log_path):
+                    with open(log_path, "r", errors="replace") as f:
+                        process_logs[formats] = f.read()
+                output_files = [f"{filename}.{format}" for format in formats]
+                try:
+                    returncode = future.result()
+                except Exception as e:
+                    returncode = -1
+                    current_app.logger.error(f"{container_name} could not be started: {e}")
+                if returncode == 0 and all(os.path.exists(os.path.join(staging_path, output_file)) for output_file in output_files):
+                    # PROCESS.log is written below
+                    for changed_file in get_changed_files(staging_snapshots[formats], snapshot_project_folder(staging_path)):
+                        if changed_file != "PROCESS.log":
+                            os.replace(os.path.join(staging_path, changed_file), os.path.join(dir_path, changed_file))
+                    docker_logger_success(container_name, dir_path)
+                    if on_format_done is not None:
+                        for output_file in output_files:
+                            on_format_done(output_file)
+                else:
+                    success = False
+                    docker_logger_error(container_name, dir_path)
+    finally:
+        for staging_path in staging_paths.values():
+            shutil.rmtree(staging_path, ignore_errors=True)
+        # One log per Maker step (several steps of a project can run at the same time)
+        if process_logs:
+            with open(os.path.join(dir_path, f"{filename}.PROCESS.log"), "w") as f:
+                if len(containers) == 1:
+                    f.write(next(iter(process_logs.values())))
+                else:
+                    for formats in containers:
+                        if formats in process_logs:
+                            f.write(f"===== {', '.join(formats).upper()} =====\n{process_logs[formats]}\n")
+    return success
+
+def link_or_copy(source: str, destination: str) -> None:
+    '''Function to hardlink a file (or to copy it if hardlinks are not possible, e.g., across file systems).'''
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
 
 def create_files_xml2yaml(dir_path: str, xml_file_name: str, volume_number: str, orcids: str, year: str, doi: str) -> bool:
     '''Function to call Docker container to create metadata.yaml file from uploaded OJS-XML.
@@ -137,28 +263,29 @@ def create_files_xml2yaml(dir_path: str, xml_file_name: str, volume_number: str,
 
     # Docker command for XML2YAML-OS
     # See https://github.com/phimisci/xml2yaml-os
-    docker_command = ["docker", "run","--rm", "--volume", f"{ABS_FILE_PATH}:/app/xml_input/{xml_file_name}" ,"--volume", f"{HOST_UPLOAD_DIR}:/app/yaml_output", current_app.config.get('XML2YAML_IMAGE'), xml_file_name]
+    mounts = [(ABS_FILE_PATH, f"/app/xml_input/{xml_file_name}"), (HOST_UPLOAD_DIR, "/app/yaml_output")]
+    container_arguments = [xml_file_name]
 
     ## Adding additional optional arguments
     ## These arguments are depend on the configuration of XML2YAML-OS
     ### Year
     if year != "":
-        docker_command.extend(["--year", year])
+        container_arguments.extend(["--year", year])
     ### Volume
     if volume_number != "":
-        docker_command.extend(["--volume", volume_number])
+        container_arguments.extend(["--volume", volume_number])
     ### ORCIDs
     if orcids != None:
-        docker_command.extend(["--orcid", orcids])
+        container_arguments.extend(["--orcid", orcids])
     ### DOI
     if doi != None:
-        docker_command.extend(["--doi", f'{doi}'])
+        container_arguments.extend(["--doi", f'{doi}'])
 
     # running docker container
-    result = subprocess.run(docker_command)
+    returncode = run_module_container(current_app.config.get('XML2YAML_IMAGE'), mounts, container_arguments)
 
     # check if the command was successful
-    if result.returncode == 0:
+    if returncode == 0:
         docker_logger_success("XML2YAML", dir_path)
         print("Container started successfully")
         return True
@@ -167,7 +294,7 @@ def create_files_xml2yaml(dir_path: str, xml_file_name: str, volume_number: str,
         print("Error in running container")
         return False
     
-def create_files_tex2pdf(dir_path: str, tex_file_name: str) -> bool:
+def create_files_tex2pdf(dir_path: str, tex_file_name: str, image_folder: str = "article") -> bool:
     '''Function to call Docker container to create PDF file from uploaded TeX file.
 
         Parameters
@@ -177,6 +304,9 @@ def create_files_tex2pdf(dir_path: str, tex_file_name: str) -> bool:
                 
             tex_file_name: str
                 The name of the TeX file (needs to be in dir_path).
+
+            image_folder: str
+                The subfolder of dir_path with the images (mounted as article/).
         
         Returns
         -------
@@ -190,12 +320,12 @@ def create_files_tex2pdf(dir_path: str, tex_file_name: str) -> bool:
     HOST_UPLOAD_DIR = os.path.join(current_app.config.get('UPLOAD_PATH'), dir_path)
 
     # Create docker command
-    docker_command = ["docker", "run","--rm", "-v", f"{HOST_UPLOAD_DIR}:/app/output", "-v", f"{HOST_UPLOAD_DIR}/{tex_file_name}:/app/{tex_file_name}", "-v", f"{HOST_UPLOAD_DIR}/article:/app/article" , current_app.config.get('TEX2PDF_IMAGE'), tex_file_name]
+    mounts = [(HOST_UPLOAD_DIR, "/app/output"), (f"{HOST_UPLOAD_DIR}/{tex_file_name}", f"/app/{tex_file_name}"), (f"{HOST_UPLOAD_DIR}/{image_folder}", "/app/article")]
     
-    result = subprocess.run(docker_command)
+    returncode = run_module_container(current_app.config.get('TEX2PDF_IMAGE'), mounts, [tex_file_name])
     
     # Check if the command was successful
-    if result.returncode == 0:
+    if returncode == 0:
         docker_logger_success("TEX2PDF", dir_path)
         print("Container started successfully")
         return True
@@ -228,14 +358,11 @@ def create_verifybibtex_report(dir_path: str, bibtex_file: str = "bib.bib") -> b
 
     HOST_UPLOAD_DIR = os.path.join(current_app.config.get('UPLOAD_PATH'), dir_path) # TODO: use pathlib
 
-    # Run docker container
-    docker_command = ["docker", "run","--rm", "-e", f"BIBTEX_FILE={bibtex_file}", "--volume", f"{HOST_UPLOAD_DIR}:/app/report", current_app.config.get('VERIFYBIBTEX_IMAGE')]
-
     # Running docker container
-    result = subprocess.run(docker_command)
+    returncode = run_module_container(current_app.config.get('VERIFYBIBTEX_IMAGE'), [(HOST_UPLOAD_DIR, "/app/report")], [], environment={"BIBTEX_FILE": bibtex_file})
 
     # Check if the command was successful
-    if result.returncode == 0:
+    if returncode == 0:
         docker_logger_success("VERIFYBIBTEX", dir_path)
         print("Container started successfully")
         return True
@@ -244,6 +371,71 @@ def create_verifybibtex_report(dir_path: str, bibtex_file: str = "bib.bib") -> b
         print("Error in running container")
         return False
 
+def run_module_container(image: str, mounts: List[Tuple[str, str]], container_arguments: List[str], environment: Dict[str, str] = {}) -> int:
+    '''Function to run a module image with the given bind mounts and arguments.
+
+        Depending on CONTAINER_EXECUTION_MODE, the module runs in a new container (oneshot, default; docker create,
+        docker start, docker wait) or in one of the long-lived containers of the container pool (pool; docker exec).
+        Start and run time and the exit code are recorded as metrics (see mmm/tools/metrics.py): the start phase ends
+        when the container is running (oneshot: create and start; pool: waiting for an idle container), the run phase
+        ends when the module has exited.
+
+        Parameters
+        ----------
+            image: str
+                The module image (e.g., the value of DOC2MD_IMAGE).
+
+            mounts: List[Tuple[str, str]]
+                Bind mounts as (path on the HOST, path in the container) pairs.
+
+            container_arguments: List[str]
+                The arguments passed to the module.
+
+            environment: Dict[str, str]
+                Environment variables passed to the module.
+
+        Returns
+        -------
+            int: The exit code of the module.
+    '''
+    if current_app.config.get('CONTAINER_EXECUTION_MODE', 'oneshot') == 'pool':
+        return get_container_pool(image).run(mounts, container_arguments, environment)
+    # The container is created and started without attaching (instead of docker run), so that the start phase ends
+    # when the container is running and the run phase only measures the module
+    docker_command = ["docker", "create"]
+    for key, value in environment.items():
+        docker_command.extend(["-e", f"{key}={value}"])
+    for host_path, container_path in mounts:
+        docker_command.extend(["--volume", f"{host_path}:{container_path}"])
+    docker_command.append(image)
+    docker_command.extend(container_arguments)
+    started_at = time.monotonic()
+    result = subprocess.run(docker_command, capture_output=True, text=True)
+    if result.returncode != 0:
+        observe_container_phase(image, "start", time.monotonic() - started_at)
+        current_app.logger.error(f"Container for {image} could not be created: {result.stderr.strip()}")
+        observe_container_exit(image, result.returncode)
+        return result.returncode
+    container_id = result.stdout.strip()
+    try:
+        result = subprocess.run(["docker", "start", container_id], capture_output=True, text=True)
+        observe_container_phase(image, "start", time.monotonic() - started_at)
+        if result.returncode != 0:
+            current_app.logger.error(f"Container for {image} could not be started: {result.stderr.strip()}")
+            observe_container_exit(image, result.returncode)
+            return result.returncode
+        started_at = time.monotonic()
+        result = subprocess.run(["docker", "wait", container_id], capture_output=True, text=True)
+        observe_container_phase(image, "run", time.monotonic() - started_at)
+        returncode = int(result.stdout.strip()) if result.returncode == 0 and result.stdout.strip().isdigit() else 125
+        # Output of the module (as with docker run)
+        subprocess.run(["docker", "logs", container_id])
+    finally:
+        # Not created with --rm: docker wait and docker logs need the container after the module has exited
+        subprocess.run(["docker", "rm", "-f", container_id], capture_output=True)
+    observe_container_exit(image, returncode)
+    return returncode
+
 def create_upload_directory():
     '''Function to create a upload directory in uploads/.
 
@@ -273,6 +465,91 @@ def create_zip_file(dir_path: str, file_list: List[str]) -> None:
             zip_file.write(file)
     os.chdir(initial_dir)
 
+# File types that are already compressed; deflating them again only costs CPU time
+STORED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg', 'docx', 'odt', 'zip', 'gz'}
+
+class ZipStreamBuffer:
+    '''Write-only, non-seekable buffer for zipfile.ZipFile; the written bytes are collected and handed out with pop().'''
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def pop(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+def stream_zip_file(dir_path: str, file_list: List[str], chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    '''Generator to stream a zip file with the given files of dir_path, chunk by chunk.
+
+        The files are read straight from dir_path and the zip file is never written to disk; memory usage does
+        not depend on the size of the project. Already compressed file types are stored without compression.
+
+        Parameters
+        ----------
+            dir_path: str
+                The folder containing the files.
+
+            file_list: List[str]
+                The files to be zipped (paths relative to dir_path; used as names in the zip file).
+
+            chunk_size: int
+                Number of bytes read from the files at once.
+
+        Returns
+        -------
+            Iterator[bytes]: The chunks of the zip file.
+    '''
+    buffer = ZipStreamBuffer()
+    # Since the buffer cannot seek, zipfile writes data descriptors after each file instead of patching the headers
+    with zipfile.ZipFile(buffer, "w") as zip_file:
+        for file_name in file_list:
+            file_path = os.path.join(dir_path, file_name)
+            zip_info = zipfile.ZipInfo.from_file(file_path, arcname=file_name)
+            zip_info.compress_type = zipfile.ZIP_STORED if file_name.rsplit(".", 1)[-1].lower() in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+            with open(file_path, "rb") as source, zip_file.open(zip_info, "w") as target:
+                for chunk in iter(lambda: source.read(chunk_size), b""):
+                    target.write(chunk)
+                    data = buffer.pop()
+                    if data:
+                        yield data
+            yield buffer.pop()
+    # Central directory
+    yield buffer.pop()
+
+def list_project_folder(dir_path: str) -> List[str]:
+    '''Function to list all files in a project folder recursively (relative paths), skipping hidden files and folders.
+
+        Parameters
+        ----------
+            dir_path: str
+                The project folder.
+
+        Returns
+        -------
+            List[str]: The relative paths of all files.
+    '''
+    file_list = []
+    for root, dirs, files in os.walk(dir_path):
+        # Hidden folders are used internally (e.g., staging folders of running Maker steps)
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for file_name in sorted(files):
+            if not file_name.startswith("."):
+                file_list.append(os.path.relpath(os.path.join(root, file_name), dir_path))
+    return file_list
+
 def generate_random_dir_name(length=10):
     '''Function to generate unique directory name for uploads (random string).
     '''
@@ -0,0 +1,73 @@
+# Copyright (c) 2024 Thomas Jurczyk
+# This software is provided under the MIT License.
+# For more information, please refer to the LICENSE file in the root directory of this project.
+
+import os
+from typing import Optional, Tuple
+from mmm import db
+from mmm.maker_project.models import Project, File, FileVersion
+from .trash import move_to_trash
+
+## FILE VERSIONS
+## A row in files is the head (current version) of a file. If a file with the same name is uploaded again, the content
+## of the head is moved to .versions/<file_id>/<version> in the project folder and registered in file_versions; the
+## row in files is kept for the new content and its version number is incremented. The .versions folder is hidden,
+## so old versions are not part of the project page, the zip downloads, and the Maker steps.
+
+VERSIONS_FOLDER = ".versions"
+
+def get_version_path(project: Project, file_id: int, version: int) -> str:
+    '''Function to get the path of an old version of a file.
+
+        Arguments
+        ---------
+        project : Project
+            The project the file belongs to.
+
+        file_id : int
+            ID of the file.
+
+        version : int
+            Version number.
+
+        Returns
+        -------
+        str : Path to the content of the version.
+    '''
+    return os.path.join(project.path, project.project_name, VERSIONS_FOLDER, str(file_id), str(version))
+
+def archive_head_version(project: Project, file: File) -> Optional[Tuple[str, str]]:
+    '''Function to keep the current content of a file as old version before it is replaced.
+
+        The content is moved (renamed) to the versions folder and a row is added to file_versions; the version number
+        of the file is incremented. The caller writes the new content to the returned head path and commits.
+
+        Arguments
+        ---------
+        project : Project
+            The project the file belongs to.
+
+        file : File
+            The file (needs an ID, i.e., flush new files first).
+
+        Returns
+        -------
+        Optional[Tuple[str, str]] : Path of the head and path of the archived version (to undo the move if the upload
+            fails) or None if the content of the file is missing in the project folder (nothing to keep).
+    '''
+    head_path = os.path.join(project.path, project.project_name, file.filename)
+    if not os.path.isfile(head_path):
+        return None
+    version_path = get_version_path(project, file.id, file.version)
+    os.makedirs(os.path.dirname(version_path), exist_ok=True)
+    size = os.path.getsize(head_path)
+    os.rename(head_path, version_path)
+    db.session.add(FileVersion(file.id, file.version, size, file.changed_at))
+    file.version += 1
+    return head_path, version_path
+
+def remove_file_versions(project: Project, file_id: int) -> None:
+    '''Function to move the old versions of a deleted file to the trash (rows are deleted together with the file).'''
+    versions_path = os.path.join(project.path, project.project_name, VERSIONS_FOLDER, str(file_id))
+    if os.path.isdir(versions_path):
+        move_to_trash(versions_path)
@@ -2,22 +2,44 @@
 # This software is provided under the MIT License.
 # For more information, please refer to the LICENSE file in the root directory of this project.
 
-import os, re
-from typing import Union, Literal, List, Tuple, Optional
-from mmm.maker_project.models import Project, File, UserProject
+import json, os, re
+from typing import Union, Literal, List, Tuple, Optional, NamedTuple, Dict, Callable
+from sqlalchemy import and_
+from sqlalchemy.orm import aliased
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from mmm.maker_project.models import Project, File, FileVersion, UserProject, Upload, Job
+from mmm.auth.models import User
 from mmm.maker_project.forms import MMMDynamicForm
 from datetime import datetime
 from mmm import db, mail
 from flask_login import current_user
-from flask import render_template, current_app
+from flask import render_template, current_app, request
+from werkzeug.utils import send_file
 from datetime import datetime
-import random, markdown2
-from .file_creation_functions import create_files_doc2md, create_verifybibtex_report, create_files_xml2yaml, create_files_dw, create_files_tex2pdf
+import hashlib, mimetypes
+from urllib.parse import quote
+from .file_creation_functions import generate_random_dir_name, create_files_doc2md, create_verifybibtex_report, create_files_xml2yaml, create_files_dw, create_files_tex2pdf
+from .result_cache import run_cached_step
+from .file_versions import archive_head_version, get_version_path, remove_file_versions
+from .blob_store import get_blob_path, store_blob, unshare_linked_files
 from flask_mail import Message
+from werkzeug.datastructures import FileStorage
+from werkzeug.utils import secure_filename
+from concurrent.futures import ThreadPoolExecutor
 import shutil
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'doc', 'docx', 'yml', 'yaml', 'md', 'markdown', 'txt', 'tex', 'pdf', 'bib', 'bibtex', 'xml', 'odt'}
 
+class ProjectView(NamedTuple):
+    '''Everything the project page needs (see load_project_view).'''
+    project: Project
+    user_files: List[File]
+    production_files: List[File]
+    user_names: List[str]
+    permission: str
+
 def allowed_file(filename: str) -> bool:
     '''Function to check if file extension is allowed.
 
@@ -67,6 +89,8 @@ def create_files(dir_path: str, selected_files: List[str], mmm_choice: str, proj
     # Check if a file was selected
     if len(selected_files) == 0:
         return "Please select a file to proceed."
+    # Files the step writes; they are stored in the result cache
+    output_files = get_step_files(mmm_choice, selected_files, file_name)[1]
     # If file was selected, continue with Maker step selection
     if mmm_choice == "doc2md":
         doc = selected_files[0]
@@ -74,20 +98,8 @@ def create_files(dir_path: str, selected_files: List[str], mmm_choice: str, proj
         if not doc.split(".")[-1].lower() in ["doc", "docx", "odt"]:
             return "Please pass a doc(x) or odt file to DOC2MD!"
         else:
-            res = create_files_doc2md(dir_path, doc, zotero_used)
+            res = run_maker_step(dir_path, project_id, [doc] + output_files, lambda: run_cached_step("doc2md", dir_path, [doc], {"zotero_used": zotero_used}, current_app.config.get('DOC2MD_IMAGE'), output_files, lambda: create_files_doc2md(dir_path, doc, zotero_used)))
             if res:
-                # Register files in DB
-                # Currently produced files by DOC2MD: raw_markdown.md, clean_markdown.md, doc2md.log
-                if os.path.exists(f"{os.getcwd()}/{dir_path}/raw_markdown.md"):
-                    register_file_in_db("raw_markdown.md", project_id, True)
-                if os.path.exists(f"{os.getcwd()}/{dir_path}/clean_markdown.md"):
-                    register_file_in_db("clean_markdown.md", project_id, True)
-                if os.path.exists(f"{os.getcwd()}/{dir_path}/doc2md.log"):
-                    register_file_in_db("doc2md.log", project_id, True)
-                if zotero_used:
-                    # Check if bibliography.bib exists
-                    if os.path.exists(f"{os.getcwd()}/{dir_path}/bibliography.bib"):
-                        register_file_in_db("bibliography.bib", project_id, True)
                 return "true"
             else:
                 return "Error creating files using DOC2MD." 
@@ -98,11 +110,8 @@ def create_files(dir_path: str, selected_files: List[str], mmm_choice: str, proj
             return "Please pass a bib or bibtex file to VERIFYBIBTEX!"
         else:
             # Create files
-            res = create_verifybibtex_report(dir_path, bib)
+            res = run_maker_step(dir_path, project_id, [bib] + output_files, lambda: run_cached_step("verifybibtex", dir_path, [bib], {}, current_app.config.get('VERIFYBIBTEX_IMAGE'), output_files, lambda: create_verifybibtex_report(dir_path, bib)))
             if res:
-                # Currently produced files by VERIFYBIBTEX: bibtex-analysis-status-report.txt
-                if os.path.exists(f"{os.getcwd()}/{dir_path}/verifybibtex-report.md"):
-                    register_file_in_db("verifybibtex-report.md", project_id, True)
                 return "true"
             else:
                 return "Error creating files using VERIFYBIBTEX."
@@ -111,11 +120,8 @@ def create_files(dir_path: str, selected_files: List[str], mmm_choice: str, proj
         # Check if file is xml
         if not xml_file.split(".")[-1].lower() in ["xml"]:
             return "Please pass an xml file to XML2YAML!"
-        res = create_files_xml2yaml(dir_path, xml_file, xml2yaml_data["volume_number"], xml2yaml_data["orcids"], xml2yaml_data["year"], xml2yaml_data["doi"])
+        res = run_maker_step(dir_path, project_id, [xml_file] + output_files, lambda: run_cached_step("xml2yaml", dir_path, [xml_file], xml2yaml_data, current_app.config.get('XML2YAML_IMAGE'), output_files, lambda: create_files_xml2yaml(dir_path, xml_file, xml2yaml_data["volume_number"], xml2yaml_data["orcids"], xml2yaml_data["year"], xml2yaml_data["doi"])))
         if res:
-            # Currently produced files by XML2YAML: yaml-metadata.yaml
-            if os.path.exists(f"{os.getcwd()}/{dir_path}/metadata.yaml"):
-                register_file_in_db("metadata.yaml", project_id, True)
             return "true"
         else:
             return "Error creating files using XML2YAML."
@@ -142,22 +148,13 @@ def create_files(dir_path: str, selected_files: List[str], mmm_choice: str, proj
         if file_name == "":
             file_name = os.path.splitext(md_file)[0]
         # Proceed with creating files
-        res = create_files_dw(dir_path, md_file, yaml_file, bibtex_file_name=bib_file, filename=file_name, output_formats=output_formats) if bib_file != None else create_files_dw(dir_path, md_file, yaml_file, filename=file_name, output_formats=output_formats)
-        # Rename files back to original names if necessary
+        # Images referenced in the Markdown file are part of the cache key as well
+        dw_input_files = [yaml_file, md_file] + ([bib_file] if bib_file != None else []) + get_image_files(dir_path)
+        dw_arguments = {"yaml_file": yaml_file, "md_file": md_file, "bib_file": bib_file, "file_name": file_name, "output_formats": output_formats}
+        # If the output formats are typeset in parallel, register each output file as soon as it is available
+        register_output = lambda output_file: register_files_in_db([output_file], project_id, True)
+        res = run_maker_step(dir_path, project_id, dw_input_files + output_files, lambda: run_cached_step("dw", dir_path, dw_input_files, dw_arguments, current_app.config.get('TYPESETTING_IMAGE'), output_files, lambda: create_files_dw(dir_path, md_file, yaml_file, bibtex_file_name=bib_file, filename=file_name, output_formats=output_formats, on_format_done=register_output) if bib_file != None else create_files_dw(dir_path, md_file, yaml_file, filename=file_name, output_formats=output_formats, on_format_done=register_output)))
         if res:
-            # Get file name from Markdown file if no file name was passed
-            file_name = os.path.splitext(md_file)[0] if not file_name else file_name
-            # Currently produced files by DW:
-            if os.path.exists(f"{os.getcwd()}/{dir_path}/PROCESS.log"): 
-                register_file_in_db("PROCESS.log", project_id, True)
-            if os.path.exists(f"{os.getcwd()}/{dir_path}/{file_name}.pdf"):
-                register_file_in_db(f"{file_name}.pdf", project_id, True)
-            if os.path.exists(f"{os.getcwd()}/{dir_path}/{file_name}.html"):
-                register_file_in_db(f"{file_name}.html", project_id, True)
-            if os.path.exists(f"{os.getcwd()}/{dir_path}/{file_name}.jats"):
-                register_file_in_db(f"{file_name}.jats", project_id, True)
-            if os.path.exists(f"{os.getcwd()}/{dir_path}/{file_name}.tex"):
-                register_file_in_db(f"{file_name}.tex", project_id, True)
             return "true"
         else:
             return "Error creating files using Maker."
@@ -174,63 +171,28 @@ def create_files(dir_path: str, selected_files: List[str], mmm_choice: str, proj
         if tex_file_name == "":
             return "Please pass a tex file to TEX2PDF!"
         else:
-            # Create subfolder for images
-            os.makedirs(f"{dir_path}/article", exist_ok=True)
-            # If images have been passed, copy them to article/ folder
-            for img_filename in image_filename_list:
-                shutil.copy(f"{dir_path}/{img_filename}", f"{dir_path}/article/{img_filename}")
-            # Create files
-            res = create_files_tex2pdf(dir_path, tex_file_name)
-            # Delete article/ folder
-            # This causes problems when running MAKER step, since it expects only files in dir_path
-            shutil.rmtree(f"{dir_path}/article")
+            # Hidden subfolder for images (one per step, since several steps of the project can run at the same time)
+            image_folder = f".article-{generate_random_dir_name(6)}"
+            def run_tex2pdf() -> bool:
+                # Create subfolder for images
+                os.makedirs(f"{dir_path}/{image_folder}", exist_ok=True)
+                try:
+                    # If images have been passed, copy them to the image folder
+                    for img_filename in image_filename_list:
+                        shutil.copy(f"{dir_path}/{img_filename}", f"{dir_path}/{image_folder}/{img_filename}")
+                    # Create files
+                    return run_cached_step("tex2pdf", dir_path, [tex_file_name] + image_filename_list, {}, current_app.config.get('TEX2PDF_IMAGE'), output_files, lambda: create_files_tex2pdf(dir_path, tex_file_name, image_folder))
+                finally:
+                    # Delete the image folder
+                    # This causes problems when running MAKER step, since it expects only files in dir_path
+                    shutil.rmtree(f"{dir_path}/{image_folder}")
+            res = run_maker_step(dir_path, project_id, [tex_file_name] + output_files, run_tex2pdf)
             if res:
-                # Currently produced files by TEX2PDF: pdf
-                tex_file_name_no_ext = os.path.splitext(tex_file_name)[0]
-                if os.path.exists(f"{os.getcwd()}/{dir_path}/{tex_file_name_no_ext}.pdf"):
-                    register_file_in_db(f"{tex_file_name_no_ext}.pdf", project_id, True)
-                if os.path.exists(f"{os.getcwd()}/{dir_path}/{tex_file_name_no_ext}.log"):
-                    register_file_in_db(f"{tex_file_name_no_ext}.log", project_id, True)
                 return "true"
             else:
                 return "Error creating files using TEX2PDF."
 
 
-def create_html_verifybibtex(dir_path: str) -> str:
-    '''Function to create HTML file for VerifyBibTeX output.
-
-        Parameters
-        ---------
-        dir_path : str
-            Path to the project folder.
-
-        Returns
-        -------
-        str : The HTML output for the corresponding bibtex-analysis-status-report.txt file in dir_path.
-    '''
-    # Check if bibtex-analysis-status-report.txt exists
-    file_path = os.path.join(os.getcwd(), dir_path, "verifybibtex-report.md")
-    if not os.path.exists(file_path):
-        return ""
-    # Read file
-    with open(file_path, "r") as f:
-        lines = f.readlines()
-        # Clean data
-        lines = [line.strip() for line in lines]
-        lines = [line.lower() for line in lines if line != ""]
-        # Create HTML output
-        # First case: No errors
-        if "found 0 errors." in lines:
-            return "<p style='color: green;'>No errors found in the BibTeX file.</p>"
-        # Second case: Manageable amount of errors found
-        elif len(lines) < 100:
-            f.seek(0)
-            content = f.read()
-            return markdown2.markdown(content)
-        # Third case: Too many errors found
-        else:
-            return "<p style='color: red;'>Too many errors found in the BibTeX file. Please check the bibtex-analysis-status-report.txt file for details.</p>"
-
 def create_new_project_func(project_name: str, username: str) -> Union[Literal[0],Literal[1]]:
     '''Function to create a new project folder in uploads/ if it doesn't exist.
     
@@ -264,33 +226,6 @@ def create_new_project_func(project_name: str, username: str) -> Union[Literal[0
     else:
         return 1
     
-def create_share_project_choices(user_id: int, project_id: int, user_name: str) -> Tuple[int, str]:
-    '''Function to create user choices for sharing projects in project folder.
-
-        Arguments
-        ---------
-        user_id : int
-            User ID of the user for which projects should be shared.
-
-        project_id : int
-            ID of the project to be shared.
-        
-        user_name : str
-            Username of the user with whom projects should be shared.
-
-        Returns
-        -------
-        tuple : Tuple containing the user ID and the user name.
-    '''
-    # Check if this project is already shared with user
-    # If this is the case, mark user with asterisk
-    user_project = UserProject.query.filter_by(user_id=user_id, project_id=project_id).first()
-    permissions = user_project.permission if user_project else None
-    if user_project:
-        return (user_id, user_name+f"*({permissions})")
-    else:
-        return (user_id, user_name)
-
 def create_user_folder(username: str):
     '''Function to create user folder in upload if it doesn't exist.
 
@@ -308,9 +243,45 @@ def create_user_folder(username: str):
     if not os.path.exists(f"uploads/{username}"):
         os.makedirs(f"uploads/{username}", exist_ok=True)
     
+def delete_files(project: Project, files: List[File]) -> Tuple[List[str], List[str]]:
+    '''Function to delete files of a project.
+
+        The files and their old versions are deleted from the database with set-based statements in one transaction.
+        Afterwards, the files are removed from the project folder and their old versions are moved to the trash.
+
+        Arguments
+        ---------
+        project : Project
+            The project the files belong to.
+
+        files : List[File]
+            The files to be deleted.
+
+        Returns
+        -------
+        Tuple[List[str], List[str]] : Names of the deleted files and names of the files that could not be removed
+            from the project folder.
+    '''
+    file_ids = [file.id for file in files]
+    filenames = [file.filename for file in files]
+    FileVersion.query.filter(FileVersion.file_id.in_(file_ids)).delete(synchronize_session=False)
+    File.query.filter(File.id.in_(file_ids)).delete(synchronize_session=False)
+    db.session.commit()
+    deleted, failed = [], []
+    for file_id, filename in zip(file_ids, filenames):
+        try:
+            os.remove(os.path.join(project.path, project.project_name, filename))
+            remove_file_versions(project, file_id)
+            deleted.append(filename)
+        except OSError:
+            failed.append(filename)
+    return deleted, failed
+
 def delete_project_from_db(project_id: int):
     '''Function to delete project and all related files and user-project relations from database.
 
+        All rows are deleted with set-based statements (DELETE ... WHERE project_id = ...) in one transaction.
+
         Arguments
         ---------
         project_id : int
@@ -320,23 +291,22 @@ def delete_project_from_db(project_id: int):
         -------
         None
     '''
-    project = Project.query.get(project_id)
-    # Get files from project
-    files_from_project = File.query.filter_by(project_id=project_id).all()
-    # Get user-project relations from project
-    user_project_relations = UserProject.query.filter_by(project_id=project_id).all()
+    file_ids = db.session.query(File.id).filter(File.project_id == project_id)
+    FileVersion.query.filter(FileVersion.file_id.in_(file_ids)).delete(synchronize_session=False)
+    File.query.filter(File.project_id == project_id).delete(synchronize_session=False)
+    # Delete user-project relations, unfinished uploads, and jobs from database (SQLite does not enforce ON DELETE CASCADE)
+    UserProject.query.filter(UserProject.project_id == project_id).delete(synchronize_session=False)
+    Upload.query.filter(Upload.project_id == project_id).delete(synchronize_session=False)
+    Job.query.filter(Job.project_id == project_id).delete(synchronize_session=False)
     # Delete project from database
-    db.session.delete(project)
-    # Delete files from database
-    for file in files_from_project:
-        db.session.delete(file)
-    # Delete user-project relations from database
-    for user_project in user_project_relations:
-        db.session.delete(user_project)
+    Project.query.filter(Project.id == project_id).delete(synchronize_session=False)
     db.session.commit()
 
-def file_exists(filename: str, project_id: int) -> str:
-    '''Function to change filename of old file if file exists in database. 
+def file_exists(filename: str, project_id: int) -> Optional[File]:
+    '''Function to keep the current content of a file as old version if the file exists in database.
+
+        The content is moved to the versions folder (see archive_head_version) and the version number is incremented.
+        The caller writes the new content, updates the returned file, and commits.
 
         Arguments
         ---------
@@ -348,32 +318,13 @@ def file_exists(filename: str, project_id: int) -> str:
 
         Returns
         -------
-        None
+        Optional[File] : The existing file (now waiting for its new content) or None if there is no such file.
     '''
     file = File.query.filter_by(filename=filename, project_id=project_id).first()
     if file:
-        old_filename = filename
-        found = False
-        while not found:
-            filename_list = filename.split(".")
-            # Get date of old file and add it to new filename
-            created_at = file.created_at
-            created_at = created_at.strftime("%Y-%m-%d_%H-%M-%S")
-            filename_list[0] = f"{filename_list[0]}_{created_at}_{str(random.randint(1, 10000))}"
-            filename = ".".join(filename_list)
-            # Check if file with the changed filename already exists in DB
-            exists = File.query.filter_by(filename=filename, project_id=project_id).first()
-            # If it does not exist, change filename of old file
-            if not exists:
-                # Change filename of old file in db
-                file.filename = filename
-                db.session.commit()
-                # Change filename of old file in folder
-                current_project = Project.query.get(project_id)
-                # Get project path, which is particularly important if user who uploaded file is not the owner of the project
-                project_path = current_project.path
-                os.rename(f"{project_path}/{current_project.project_name}/{old_filename}", f"{project_path}//{current_project.project_name}/{filename}")
-                found = True
+        # Get project path, which is particularly important if user who uploaded file is not the owner of the project
+        archive_head_version(Project.query.get(project_id), file)
+    return file
 
 def get_all_projects_for_user() -> Tuple[List[Project],List[Project]]:
     '''Function to get all projects for current user.
@@ -388,6 +339,150 @@ def get_all_projects_for_user() -> Tuple[List[Project],List[Project]]:
     shared_projects = Project.query.join(UserProject).filter(UserProject.user_id == current_user.id, UserProject.creator==False).all()
     return (owned_projects, shared_projects)
 
+def get_changed_files(before: Dict[str, Tuple[int, int]], after: Dict[str, Tuple[int, int]]) -> List[str]:
+    '''Function to get the files that were created or changed between two snapshots of a project folder.'''
+    return sorted(name for name, stat in after.items() if before.get(name) != stat)
+
+def get_duplicate_files(project_id: int, filenames: List[str]) -> Dict[str, List[str]]:
+    '''Function to find other files of a project with the same content (digest) as the given files, using one query.
+
+        Arguments
+        ---------
+        project_id : int
+            ID of the project.
+
+        filenames : List[str]
+            Names of the files to be checked (e.g., just uploaded files).
+
+        Returns
+        -------
+        Dict[str, List[str]] : File name -> names of the other files with the same content (only files with duplicates).
+    '''
+    other = aliased(File)
+    rows = db.session.query(File.filename, other.filename).join(other, and_(other.project_id == File.project_id, other.digest == File.digest, other.id != File.id)).filter(File.project_id == project_id, File.filename.in_(filenames), File.digest != None).order_by(other.filename).all()
+    duplicates: Dict[str, List[str]] = {}
+    for filename, other_filename in rows:
+        duplicates.setdefault(filename, []).append(other_filename)
+    return duplicates
+
+def get_image_files(dir_path: str) -> List[str]:
+    '''Function to get the names of all image files in a project folder.
+
+        Arguments
+        ---------
+        dir_path : str
+            Path to the project folder.
+
+        Returns
+        -------
+        List[str] : Names of the image files (png, jpg, jpeg).
+    '''
+    return sorted(entry.name for entry in os.scandir(dir_path) if entry.is_file() and entry.name.rsplit(".", 1)[-1].lower() in ["png", "jpg", "jpeg"])
+
+def get_share_project_choices(project_id: int, exclude_user_id: int, search: Optional[str] = None, user_id: Optional[int] = None, shared_only: bool = False, page: int = 1, per_page: Optional[int] = None) -> Tuple[List[Tuple[int, str]], bool]:
+    '''Function to create user choices for sharing a project with one query.
+
+        Users are joined with their grant for the project (LEFT JOIN); users with whom the project is already shared
+        are marked with an asterisk followed by their permissions, e.g. "alice*(rw)".
+
+        Arguments
+        ---------
+        project_id : int
+            ID of the project to be shared.
+
+        exclude_user_id : int
+            ID of the current user (not listed).
+
+        search : Optional[str]
+            Only list users whose name contains this string.
+
+        user_id : Optional[int]
+            Only list this user (used to validate the submitted choice).
+
+        shared_only : bool
+            Only list users with whom the project is already shared.
+
+        page : int
+            Page of the results (starting at 1).
+
+        per_page : Optional[int]
+            Users per page (default: USER_SEARCH_PAGE_SIZE).
+
+        Returns
+        -------
+        Tuple[List[Tuple[int, str]], bool] : The choices (user ID and label) and whether there are more pages.
+    '''
+    per_page = per_page or int(current_app.config.get("USER_SEARCH_PAGE_SIZE", 20))
+    query = db.session.query(User.id, User.username, UserProject.permission).outerjoin(UserProject, and_(UserProject.user_id == User.id, UserProject.project_id == project_id)).filter(User.id != exclude_user_id)
+    if search:
+        escaped_search = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        query = query.filter(User.username.ilike(f"%{escaped_search}%", escape="\\"))
+    if user_id is not None:
+        query = query.filter(User.id == user_id)
+    if shared_only:
+        query = query.filter(UserProject.id.isnot(None))
+    # Fetch one more row to know if there is another page
+    rows = query.order_by(User.username).offset((max(page, 1) - 1) * per_page).limit(per_page + 1).all()
+    choices = [(row.id, row.username + f"*({row.permission})" if row.permission else row.username) for row in rows[:per_page]]
+    return choices, len(rows) > per_page
+
+def get_step_files(mmm_choice: str, selected_files: List[str], file_name: str) -> Tuple[List[str], List[str]]:
+    '''Function to get the files a Maker step reads and the files it writes in the project folder.
+
+        Steps of the same project can run at the same time if none of them writes a file that the other one reads or
+        writes (see claim_next_job).
+
+        Arguments
+        ---------
+        mmm_choice : str
+            The selected MMM step. Can be doc2md, tex2pdf, verifybibtex, dw, xml2yaml.
+
+        selected_files : List[str]
+            The files that have been selected for the MMM processing.
+
+        file_name : str
+            Name of the file(s) to be created (for DW/Maker step; the name of the Markdown file if empty).
+
+        Returns
+        -------
+        Tuple[List[str], List[str]] : Names of the input files and names of the output files.
+    '''
+    if mmm_choice == "doc2md":
+        return selected_files[:1], ["raw_markdown.md", "clean_markdown.md", "doc2md.log", "bibliography.bib"]
+    elif mmm_choice == "verifybibtex":
+        return selected_files[:1], ["verifybibtex-report.md"]
+    elif mmm_choice == "xml2yaml":
+        return selected_files[:1], ["metadata.yaml"]
+    elif mmm_choice == "dw":
+        if file_name == "":
+            md_files = [f for f in selected_files if f.split(".")[-1].lower() in ["md", "markdown"]]
+            file_name = os.path.splitext(md_files[-1])[0] if md_files else ""
+        # The typesetting step writes its log to <file_name>.PROCESS.log (see run_typesetting_containers)
+        return selected_files, [f"{file_name}.{extension}" for extension in ["pdf", "html", "jats", "tex"]] + [f"{file_name}.PROCESS.log"]
+    elif mmm_choice == "tex2pdf":
+        tex_files = [f for f in selected_files if f.split(".")[-1].lower() in ["tex"]]
+        tex_file_name_no_ext = os.path.splitext(tex_files[-1])[0] if tex_files else ""
+        return selected_files, [f"{tex_file_name_no_ext}.pdf", f"{tex_file_name_no_ext}.log"]
+    return selected_files, []
+
+def get_running_step_files(project_id: int) -> List[Tuple[List[str], List[str]]]:
+    '''Function to get the input and output files (see get_step_files) of the running Maker steps of a project.
+
+        Arguments
+        ---------
+        project_id : int
+            ID of the project.
+
+        Returns
+        -------
+        List[Tuple[List[str], List[str]]] : Input and output files of every running job of the project.
+    '''
+    step_files = []
+    for mmm_choice, arguments in db.session.query(Job.mmm_choice, Job.arguments).filter(Job.project_id == project_id, Job.status == "running").all():
+        arguments = json.loads(arguments)
+        step_files.append(get_step_files(mmm_choice, arguments["selected_files"], arguments["file_name"]))
+    return step_files
+
 def get_xml2yaml_data(form: MMMDynamicForm) -> dict:
     '''Function to get XML2YAML data from form.
 
@@ -408,6 +503,121 @@ def get_xml2yaml_data(form: MMMDynamicForm) -> dict:
     data["doi"] = form.doi.data if form.doi.data != "" else None 
     return data
 
+def ingest_uploaded_files(project: Project, uploaded_files: List[FileStorage], user_id: int) -> List[str]:
+    '''Function to save uploaded files in a project folder and to register them in the database in one transaction.
+
+        Name collisions with existing files are checked for all files at once; an upload with the name of an existing
+        file becomes its new version (see file_exists). The files are written concurrently (UPLOAD_INGEST_CONCURRENCY)
+        to temporary names and only moved to their final names when all of them were written. If anything fails, the
+        database transaction is rolled back, the new files are removed, and the old versions are moved back.
+
+        Arguments
+        ---------
+        project : Project
+            The project the files are uploaded to.
+
+        uploaded_files : List[FileStorage]
+            The uploaded files (file types need to be checked before).
+
+        user_id : int
+            ID of the user who uploaded the files.
+
+        Returns
+        -------
+        List[str] : Names of the saved files.
+    '''
+    project_folder = os.path.join(project.path, project.project_name)
+    filenames = [secure_filename(f.filename) for f in uploaded_files]
+    if not filenames:
+        return []
+    # Existing files (and files uploaded twice) get a new version instead of a new row
+    heads = {file.filename: file for file in File.query.filter(File.project_id == project.id, File.filename.in_(set(filenames))).all()}
+    # Write all files to temporary names first and store them in the blob store
+    temp_paths = [os.path.join(project_folder, f".ingest-{generate_random_dir_name()}-{filename}") for filename in filenames]
+
+    app = current_app._get_current_object()
+
+    def save_file(uploaded_file: FileStorage, temp_path: str) -> str:
+        uploaded_file.save(temp_path)
+        with app.app_context():
+            return store_blob(temp_path)
+
+    try:
+        with ThreadPoolExecutor(max_workers=int(current_app.config.get("UPLOAD_INGEST_CONCURRENCY", 4))) as executor:
+            digests = list(executor.map(save_file, uploaded_files, temp_paths))
+    except Exception:
+        for temp_path in temp_paths:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        raise
+    # Moves to undo if anything fails: (path of a new file, None) or (head path, path of the archived version)
+    done: List[Tuple[str, Optional[str]]] = []
+    try:
+        for temp_path, filename, digest in zip(temp_paths, filenames, digests):
+            file = heads.get(filename)
+            if file is None:
+                os.replace(temp_path, os.path.join(project_folder, filename))
+                done.append((os.path.join(project_folder, filename), None))
+                heads[filename] = File(filename, project.id, user_id, datetime.now(), datetime.now(), False, 0)
+                heads[filename].digest = digest
+                db.session.add(heads[filename])
+                continue
+            if file.id is None:
+                # Same file name twice in one upload; the new row needs an ID for the versions folder
+                db.session.flush()
+            archived = archive_head_version(project, file)
+            if archived:
+                done.append(archived)
+            os.replace(temp_path, os.path.join(project_folder, filename))
+            done.append((os.path.join(project_folder, filename), None))
+            file.changed_at = datetime.now()
+            file.production_file = False
+            file.digest = digest
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        for path, version_path in reversed(done):
+            if version_path is None:
+                os.remove(path)
+            else:
+                os.rename(version_path, path)
+        for temp_path in temp_paths:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        raise
+    return filenames
+
+def load_project_view(project_id: int, user_id: int) -> Optional[ProjectView]:
+    '''Function to load the data of the project page with two queries.
+
+        The first query joins the project with all its collaborators (user names and permissions), the second one
+        gets all files of the project.
+
+        Arguments
+        ---------
+        project_id : int
+            ID of the project.
+
+        user_id : int
+            ID of the user who opens the project page.
+
+        Returns
+        -------
+        Optional[ProjectView] : The data of the project page or None if the user has no access to the project.
+    '''
+    rows = db.session.query(Project, UserProject.user_id, UserProject.permission, User.username).join(UserProject, UserProject.project_id == Project.id).join(User, User.id == UserProject.user_id).filter(Project.id == project_id).order_by(UserProject.id).all()
+    permission = next((row.permission for row in rows if row.user_id == user_id), None)
+    if permission is None:
+        return None
+    files = sorted(File.query.filter_by(project_id=project_id).all(), key=lambda file: file.filename)
+    return ProjectView(
+        project=rows[0].Project,
+        user_files=[file for file in files if not file.production_file],
+        production_files=[file for file in files if file.production_file],
+        user_names=[row.username for row in rows],
+        permission=permission,
+    )
+
 def register_file_in_db(filename: str, project_id: int, production_file: bool):
     '''Function to register a new file in project in database. If file already exists, do nothing.
 
@@ -426,23 +636,162 @@ def register_file_in_db(filename: str, project_id: int, production_file: bool):
         -------
         None
     '''
-    file_exists = True if File.query.filter_by(filename=filename, project_id=project_id).all() != list() else False
-    if not file_exists:
-        # Check if file was produced by Maker steps and is thus a production file
+    register_files_in_db([filename], project_id, production_file)
+
+def register_files_in_db(filenames: List[str], project_id: int, production_file: bool, digests: Dict[str, str] = {}):
+    '''Function to register several files of a project in database with one statement (upsert).
+
+        New files are inserted; for files that are already registered, the last modified date is updated (and they
+        become production files if production_file is True). Uses the unique constraint on (project_id, filename).
+        Supported databases: SQLite, PostgreSQL, MySQL, and MariaDB.
+
+        Arguments
+        ---------
+        filenames : List[str]
+            Names of the files.
+
+        project_id : int
+            ID of the project.
+
+        production_file : bool
+            Boolean to indicate if the files are production files.
+
+        digests : Dict[str, str]
+            SHA-256 of the files (file name -> digest); the digest of files without an entry is unknown.
+
+        Returns
+        -------
+        None
+    '''
+    if not filenames:
+        return
+    now = datetime.now()
+    rows = [{"filename": filename, "project_id": project_id, "created_by": current_user.id, "created_at": now, "changed_at": now, "production_file": production_file, "download_number": 0, "digest": digests.get(filename)} for filename in sorted(set(filenames))]
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ["mysql", "mariadb"]:
+        statement = mysql_insert(File).values(rows)
+        changes = {"changed_at": statement.inserted.changed_at, "digest": statement.inserted.digest}
         if production_file:
-            new_file = File(filename, project_id, current_user.id, datetime.now(), datetime.now(), True, 0)
-        else:
-            new_file = File(filename, project_id, current_user.id, datetime.now(), datetime.now(), False, 0)
-        db.session.add(new_file)
-        db.session.commit()
-    else:
-        file = File.query.filter_by(filename=filename, project_id=project_id).first()
-        # Switch to production file if necessary
+            changes["production_file"] = True
+        statement = statement.on_duplicate_key_update(changes)
+    elif dialect in ["postgresql", "sqlite"]:
+        statement = (postgresql_insert if dialect == "postgresql" else sqlite_insert)(File).values(rows)
+        changes = {"changed_at": statement.excluded.changed_at, "digest": statement.excluded.digest}
         if production_file:
-            file.production_file = True
-        # Change last modified date
-        file.changed_at = datetime.now()
-        db.session.commit()
+            changes["production_file"] = True
+        statement = statement.on_conflict_do_update(index_elements=["project_id", "filename"], set_=changes)
+    else:
+        raise NotImplementedError(f"Registering files is not supported for the database {dialect}.")
+    db.session.execute(statement)
+    db.session.commit()
+
+def run_maker_step(dir_path: str, project_id: int, step_files: List[str], step_function: Callable[[], bool]) -> bool:
+    '''Function to run a Maker step in a project folder and to register the files it created or changed.
+
+        All files of the project folder that are linked to the blob store are replaced by copies, since the module
+        containers see the whole folder and may overwrite any file in place, not only the declared step_files (a blob
+        can be linked from the folders of other projects). Afterwards, the unchanged copies are linked again, also if
+        the step failed. Other steps of the project may run at the same time, but never write the files of this step
+        (see claim_next_job): the files they write are left to them, and the copies are only linked again if no other
+        step is running (another step could still write into them).
+
+        Arguments
+        ---------
+        dir_path : str
+            Path to the project folder.
+
+        project_id : int
+            ID of the project.
+
+        step_files : List[str]
+            Names of the input and output files of the step (see get_step_files).
+
+        step_function : Callable[[], bool]
+            Runs the step; returns True if the step was successful.
+
+        Returns
+        -------
+        bool : The result of step_function.
+    '''
+    other_output_files = sorted({filename for _, output_files in get_running_step_files(project_id) for filename in output_files} - set(step_files))
+    unshared_files = unshare_linked_files(dir_path, [filename for filename in snapshot_project_folder(dir_path) if filename not in other_output_files])
+    # Snapshot of the project folder; all files created or changed by the step are registered afterwards
+    snapshot = snapshot_project_folder(dir_path)
+    res = False
+    try:
+        res = step_function()
+    finally:
+        running_step_files = get_running_step_files(project_id)
+        other_output_files = sorted({filename for _, output_files in running_step_files for filename in output_files} - set(step_files))
+        # The job of this step is one of the running jobs (if the step is run by the job worker)
+        if len(running_step_files) > 1:
+            unshared_files = []
+        if res:
+            register_step_outputs(dir_path, snapshot, project_id, unshared_files, other_output_files)
+        else:
+            changed_files = get_changed_files(snapshot, snapshot_project_folder(dir_path))
+            relink_unshared_files(dir_path, project_id, [filename for filename in unshared_files if filename not in changed_files])
+    return res
+
+def register_step_outputs(dir_path: str, snapshot: Dict[str, Tuple[int, int]], project_id: int, unshared_files: List[str] = [], other_output_files: List[str] = []) -> List[str]:
+    '''Function to register all files a Maker step created or changed in the project folder as production files.
+
+        The created and changed files are stored in the blob store; files that were unshared before the step and did
+        not change are linked to their blobs again.
+
+        Arguments
+        ---------
+        dir_path : str
+            Path to the project folder.
+
+        snapshot : Dict[str, Tuple[int, int]]
+            Snapshot of the project folder taken before the step (see snapshot_project_folder).
+
+        project_id : int
+            ID of the project.
+
+        unshared_files : List[str]
+            Files that were replaced by copies before the step (see unshare_linked_files).
+
+        other_output_files : List[str]
+            Files written by other steps of the project running at the same time (they are registered by these steps).
+
+        Returns
+        -------
+        List[str] : Names of the registered files.
+    '''
+    changed_files = [filename for filename in get_changed_files(snapshot, snapshot_project_folder(dir_path)) if filename not in other_output_files]
+    digests = {filename: store_blob(os.path.join(dir_path, filename)) for filename in changed_files}
+    register_files_in_db(changed_files, project_id, True, digests)
+    relink_unshared_files(dir_path, project_id, [filename for filename in unshared_files if filename not in digests])
+    return changed_files
+
+def relink_unshared_files(dir_path: str, project_id: int, filenames: List[str]) -> None:
+    '''Function to link files that were unshared before a Maker step and did not change to their blobs again.
+
+        Arguments
+        ---------
+        dir_path : str
+            Path to the project folder.
+
+        project_id : int
+            ID of the project.
+
+        filenames : List[str]
+            Names of the unchanged files.
+
+        Returns
+        -------
+        None
+    '''
+    if not filenames:
+        return
+    for filename, digest in db.session.query(File.filename, File.digest).filter(File.project_id == project_id, File.filename.in_(filenames), File.digest != None).all():
+        file_path = os.path.join(dir_path, filename)
+        blob_path = get_blob_path(digest)
+        # The digest is only trusted if the blob still exists and has the same size
+        if blob_path and os.path.isfile(blob_path) and os.path.getsize(blob_path) == os.path.getsize(file_path):
+            store_blob(file_path, digest)
 
 def register_project_in_db(path: str, project_name: str):
     '''Function to register a new project in database.
@@ -495,4 +844,77 @@ def send_email(to: str, subject: str, template: str, **kwargs):
                   sender=current_app.config['MMM_MAIL_SENDER'], recipients=[to])
     msg.body = render_template(f"maker_project/email/{template}.txt", **kwargs)
     #msg.html = render_template(f"email/{template}.txt", **kwargs)
-    mail.send(msg)
\ No newline at end of file
+    mail.send(msg)
+
+def send_project_file(project: Project, file: File, version: Optional[FileVersion] = None):
+    '''Function to send a project file (or an old version of it) as download.
+
+        The response supports conditional requests (ETag and Last-Modified are derived from the database entry and
+        the file size) and Range requests. If DOWNLOAD_OFFLOAD is set, the permission check stays in Flask but the
+        bytes are sent by the web server: 'x-accel-redirect' (nginx) redirects internally to
+        X_ACCEL_REDIRECT_PREFIX + path of the file (relative to the working directory), 'x-sendfile' (Apache, lighttpd)
+        sets the X-Sendfile header.
+
+        Arguments
+        ---------
+        project : Project
+            The project the file belongs to.
+
+        file : File
+            The file to be sent.
+
+        version : Optional[FileVersion]
+            Old version of the file to be sent instead of the current content.
+
+        Returns
+        -------
+        Response : The download response.
+    '''
+    if version is None:
+        relative_path = os.path.join(project.path, project.project_name, file.filename)
+        download_name, changed_at = file.filename, file.changed_at
+    else:
+        relative_path = get_version_path(project, file.id, version.version)
+        name, extension = os.path.splitext(file.filename)
+        download_name, changed_at = f"{name}_v{version.version}{extension}", version.created_at
+    file_path = os.path.join(os.getcwd(), relative_path)
+    size = os.path.getsize(file_path)
+    etag = hashlib.sha1(f"{file.id}-{download_name}-{changed_at.isoformat()}-{size}".encode()).hexdigest()
+    offload = current_app.config.get("DOWNLOAD_OFFLOAD", "none")
+    if offload == "x-accel-redirect":
+        # Flask only answers conditional requests itself; nginx sends the file (including Range requests)
+        response = current_app.response_class(mimetype=mimetypes.guess_type(download_name)[0] or "application/octet-stream")
+        response.headers.set("Content-Disposition", "attachment", filename=download_name)
+        response.set_etag(etag)
+        response.last_modified = changed_at
+        response.cache_control.no_cache = True
+        response = response.make_conditional(request)
+        if response.status_code == 200:
+            prefix = current_app.config.get("X_ACCEL_REDIRECT_PREFIX", "/protected-files").rstrip("/")
+            response.headers["X-Accel-Redirect"] = quote(f"{prefix}/{relative_path}")
+        return response
+    # With use_x_sendfile, send_file only sets the X-Sendfile header instead of reading the file
+    return send_file(file_path, request.environ, as_attachment=True, download_name=download_name, conditional=True, etag=etag, last_modified=changed_at, max_age=0, use_x_sendfile=offload == "x-sendfile", response_class=current_app.response_class)
+
+def snapshot_project_folder(dir_path: str) -> Dict[str, Tuple[int, int]]:
+    '''Function to take a snapshot (size and modification time of every file) of a project folder.
+
+        Hidden files (part files of uploads, staging files) and subfolders are not part of the snapshot.
+
+        Arguments
+        ---------
+        dir_path : str
+            Path to the project folder.
+
+        Returns
+        -------
+        Dict[str, Tuple[int, int]] : File name -> (size, modification time in ns).
+    '''
+    snapshot = {}
+    with os.scandir(dir_path) as it:
+        for entry in it:
+            if entry.name.startswith(".") or not entry.is_file(follow_symlinks=False):
+                continue
+            stat = entry.stat(follow_symlinks=False)
+            snapshot[entry.name] = (stat.st_size, stat.st_mtime_ns)
+    return snapshot
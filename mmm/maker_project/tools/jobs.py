@@ -0,0 +1,241 @@
+# Copyright (c) 2024 Thomas Jurczyk
+# This software is provided under the MIT License.
+# For more information, please refer to the LICENSE file in the root directory of this project.
+
+import json, os, threading, traceback, uuid
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple, Union
+from flask import Flask, current_app
+from flask_login import login_user
+from mmm import db
+from mmm.auth.models import User
+from mmm.maker_project.models import Project, Job
+from mmm.tools import StepTimer, get_file_sizes
+from .functions import create_files, get_step_files, snapshot_project_folder, get_changed_files
+
+def enqueue_maker_job(project_id: int, user_id: int, mmm_choice: str, selected_files: List[str], xml2yaml_data: dict, zotero_used: bool, file_name: str, output_formats: List[str] = []) -> Job:
+    '''Function to store a Maker step in the jobs table so that it can be picked up by the worker.
+
+        Arguments
+        ---------
+        project_id : int
+            ID of the project the Maker step is run for.
+
+        user_id : int
+            ID of the user who started the Maker step.
+
+        mmm_choice : str
+            The selected MMM step. Can be doc2md, tex2pdf, verifybibtex, dw, xml2yaml.
+
+        selected_files, xml2yaml_data, zotero_used, file_name, output_formats
+            Arguments passed on to create_files (see create_files for details).
+
+        Returns
+        -------
+        Job : The newly created job.
+    '''
+    arguments = {
+        "selected_files": selected_files,
+        "xml2yaml_data": xml2yaml_data,
+        "zotero_used": zotero_used,
+        "file_name": file_name,
+        "output_formats": output_formats,
+    }
+    job = Job(project_id, user_id, mmm_choice, json.dumps(arguments), "queued", datetime.now())
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+def enqueue_maker_pipeline(project_id: int, user_id: int, selected_files: List[str], xml2yaml_data: dict, zotero_used: bool, file_name: str, output_formats: List[str] = []) -> Union[str, List[Job]]:
+    '''Function to queue the full pipeline (DOC2MD, VerifyBibTeX, XML2YAML, Maker) as a dependency graph of jobs.
+
+        DOC2MD and XML2YAML do not depend on each other. VerifyBibTeX only waits for DOC2MD if it checks the
+        bibliography.bib created by DOC2MD (Zotero), and Maker waits for DOC2MD and XML2YAML. Steps that do not depend
+        on each other run at the same time (see claim_next_job), without a new submission for every step.
+
+        Arguments
+        ---------
+        project_id, user_id, xml2yaml_data, zotero_used, file_name, output_formats
+            See enqueue_maker_job.
+
+        selected_files : List[str]
+            One doc(x)/odt file, one xml file, and optionally one bib file.
+
+        Returns
+        -------
+        Union[str, List[Job]] : The queued jobs or an error message if the selected files do not fit the pipeline.
+    '''
+    doc_files = [f for f in selected_files if f.split(".")[-1].lower() in ["doc", "docx", "odt"]]
+    xml_files = [f for f in selected_files if f.split(".")[-1].lower() in ["xml"]]
+    bib_files = [f for f in selected_files if f.split(".")[-1].lower() in ["bib", "bibtex"]]
+    if len(doc_files) != 1 or len(xml_files) != 1 or len(bib_files) > 1 or len(doc_files) + len(xml_files) + len(bib_files) != len(selected_files):
+        return "Please select one DOC(X) or ODT file, one XML file, and optionally one BibTeX file for the full pipeline!"
+    pipeline_id = uuid.uuid4().hex
+    # Output files of DOC2MD and XML2YAML that are used by the following steps
+    md_file = "clean_markdown.md"
+    yaml_file = "metadata.yaml"
+    bib_file: Optional[str] = bib_files[0] if bib_files else ("bibliography.bib" if zotero_used else None)
+    if not file_name:
+        file_name = os.path.splitext(doc_files[0])[0]
+
+    def add_job(mmm_choice: str, step_files: List[str], depends_on: List[Job], **step_arguments) -> Job:
+        arguments = {"selected_files": step_files, "xml2yaml_data": {}, "zotero_used": False, "file_name": "", "output_formats": []}
+        arguments.update(step_arguments)
+        job = Job(project_id, user_id, mmm_choice, json.dumps(arguments), "queued", datetime.now(), pipeline_id=pipeline_id, depends_on=json.dumps([dependency.id for dependency in depends_on]))
+        db.session.add(job)
+        # Flush to get the job ID for the dependent jobs
+        db.session.flush()
+        return job
+
+    doc2md_job = add_job("doc2md", doc_files, [], zotero_used=zotero_used)
+    xml2yaml_job = add_job("xml2yaml", xml_files, [], xml2yaml_data=xml2yaml_data)
+    jobs = [doc2md_job, xml2yaml_job]
+    if bib_file is not None:
+        jobs.append(add_job("verifybibtex", [bib_file], [] if bib_files else [doc2md_job]))
+    jobs.append(add_job("dw", [yaml_file, md_file] + ([bib_file] if bib_file is not None else []), [doc2md_job, xml2yaml_job], file_name=file_name, output_formats=output_formats))
+    db.session.commit()
+    return jobs
+
+def get_job_files(job: Job) -> Tuple[Set[str], Set[str]]:
+    '''Function to get the files a job reads and the files it writes in the project folder (see get_step_files).'''
+    arguments = json.loads(job.arguments)
+    input_files, output_files = get_step_files(job.mmm_choice, arguments["selected_files"], arguments["file_name"])
+    return set(input_files), set(output_files)
+
+def jobs_conflict(files: Tuple[Set[str], Set[str]], other_files: Tuple[Set[str], Set[str]]) -> bool:
+    '''Function to check if one of two jobs writes a file the other job reads or writes (see get_job_files).'''
+    return bool(files[1] & (other_files[0] | other_files[1]) or other_files[1] & files[0])
+
+def claim_next_job() -> Optional[Job]:
+    '''Function to claim the oldest queued job whose dependencies are finished.
+
+        Jobs of the same project run at the same time unless one of them writes a file that the other one reads or
+        writes (see get_step_files); e.g., DOC2MD and XML2YAML of a pipeline run in parallel, while two DOC2MD runs
+        of a project run one after another. A queued job also waits for older queued jobs of its project it conflicts
+        with, so that conflicting jobs run in the order they were submitted. The claim locks the project row first, so
+        two workers (threads or processes) cannot claim two conflicting jobs of the same project at once; the UPDATE
+        guarded by the queued status makes sure that only one worker can win a job. Jobs whose dependencies failed are
+        marked as failed as well.
+
+        Returns
+        -------
+        Optional[Job] : The claimed job or None if no job is ready.
+    '''
+    # Files of the running jobs and of the older queued jobs that wait, per project
+    blocking_files: Dict[int, List[Tuple[Set[str], Set[str]]]] = {}
+    for running_job in Job.query.filter_by(status="running").all():
+        blocking_files.setdefault(running_job.project_id, []).append(get_job_files(running_job))
+    for job in Job.query.filter_by(status="queued").order_by(Job.id).limit(100).all():
+        job_files = get_job_files(job)
+        project_blocking_files = blocking_files.setdefault(job.project_id, [])
+        if any(jobs_conflict(job_files, other_files) for other_files in project_blocking_files):
+            project_blocking_files.append(job_files)
+            continue
+        dependencies = json.loads(job.depends_on) if job.depends_on else []
+        if dependencies:
+            statuses = [status for (status,) in db.session.query(Job.status).filter(Job.id.in_(dependencies)).all()]
+            if "failed" in statuses or len(statuses) < len(dependencies):
+                Job.query.filter_by(id=job.id, status="queued").update({"status": "failed", "result": "A previous step of the pipeline failed.", "finished_at": datetime.now()}, synchronize_session=False)
+                db.session.commit()
+                continue
+            if any(status != "finished" for status in statuses):
+                project_blocking_files.append(job_files)
+                continue
+        job_id, project_id = job.id, job.project_id
+        # New transaction that starts with locking the project row (an UPDATE, since SQLite has no SELECT ... FOR
+        # UPDATE); concurrent claims for the same project wait here until this claim is committed
+        db.session.commit()
+        Project.query.filter_by(id=project_id).update({"id": Project.id}, synchronize_session=False)
+        running_files = [get_job_files(running_job) for running_job in Job.query.filter_by(project_id=project_id, status="running").with_for_update().all()]
+        claimed = 0
+        if not any(jobs_conflict(job_files, other_files) for other_files in running_files):
+            claimed = Job.query.filter_by(id=job_id, status="queued").update({"status": "running", "started_at": datetime.now()}, synchronize_session=False)
+        db.session.commit()
+        if claimed == 1:
+            return Job.query.get(job_id)
+        # Another worker was faster (with this job or a conflicting job of the project)
+        project_blocking_files.extend(running_files + [job_files])
+    return None
+
+def run_job(job: Job) -> None:
+    '''Function to run a claimed job and to store its result.
+
+        The Maker step functions expect a logged in user (files are registered in the name of current_user),
+        so the step runs in a request context in which the user who started the job is logged in.
+
+        Arguments
+        ---------
+        job : Job
+            The job to be run (status running).
+
+        Returns
+        -------
+        None
+    '''
+    arguments = json.loads(job.arguments)
+    project = Project.query.get(job.project_id)
+    user = User.query.get(job.created_by)
+    try:
+        if project is None or user is None:
+            res_str = "Project or user does not exist anymore."
+        else:
+            dir_path = os.path.join(project.path, project.project_name)
+            snapshot = snapshot_project_folder(dir_path)
+            with StepTimer(job.mmm_choice, get_file_sizes(dir_path, arguments["selected_files"])) as step_timer, current_app.test_request_context():
+                login_user(user)
+                res_str = create_files(dir_path, arguments["selected_files"], job.mmm_choice, job.project_id, arguments["xml2yaml_data"], arguments["zotero_used"], arguments["file_name"], output_formats=arguments["output_formats"])
+                step_timer.status = "finished" if res_str == "true" else "failed"
+                step_timer.output_bytes = get_file_sizes(dir_path, get_changed_files(snapshot, snapshot_project_folder(dir_path)))
+    except Exception:
+        db.session.rollback()
+        current_app.logger.error(f"Job {job.id} crashed: {traceback.format_exc()}")
+        res_str = "Unexpected error while running the Maker step."
+    # Job object might be detached after the step committed; reload it (the job is gone if its project was deleted)
+    job = Job.query.get(job.id)
+    if job is None:
+        return
+    job.status = "finished" if res_str == "true" else "failed"
+    job.result = res_str
+    job.finished_at = datetime.now()
+    db.session.commit()
+
+def reset_interrupted_jobs() -> int:
+    '''Function to mark jobs as failed that were running when the worker was stopped.
+
+        Returns
+        -------
+        int : Number of jobs that were reset.
+    '''
+    reset = Job.query.filter_by(status="running").update({"status": "failed", "result": "The worker was restarted while this job was running. Please start the Maker step again.", "finished_at": datetime.now()}, synchronize_session=False)
+    db.session.commit()
+    return reset
+
+def job_worker_loop(app: Flask, stop_event: threading.Event) -> None:
+    '''Function run by every worker thread: claim and run jobs until stop_event is set.
+
+        Arguments
+        ---------
+        app : Flask
+            The Flask app (each thread runs in its own app context and thus gets its own DB session).
+
+        stop_event : threading.Event
+            Event to stop the loop.
+
+        Returns
+        -------
+        None
+    '''
+    poll_interval = app.config.get("MAKER_WORKER_POLL_INTERVAL", 1)
+    while not stop_event.is_set():
+        with app.app_context():
+            try:
+                job = claim_next_job()
+                if job is not None:
+                    app.logger.info(f"Job {job.id} ({job.mmm_choice}) started.")
+                    run_job(job)
+                    app.logger.info(f"Job {job.id} ({job.mmm_choice}) done.")
+                    continue
+            except Exception:
+                db.session.rollback()
+                app.logger.critical(f"Job worker error: {traceback.format_exc()}")
+        stop_event.wait(poll_interval)
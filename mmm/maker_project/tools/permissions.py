@@ -0,0 +1,167 @@
+# Copyright (c) 2024 Thomas Jurczyk
+# This software is provided under the MIT License.
+# For more information, please refer to the LICENSE file in the root directory of this project.
+
+import threading, time
+from functools import wraps
+from typing import Callable, Dict, NamedTuple, Optional, Tuple
+from flask import current_app, flash, g, jsonify, redirect, url_for
+from flask_login import current_user
+from mmm import db
+from mmm.maker_project.models import Project, File, UserProject
+from .file_creation_functions import critical_error_logger
+
+## PERMISSIONS
+## The access of a user to a project (permission string of UserProject plus creator flag) is resolved with one query
+## that also loads the project (and the file for file routes). The result is memoized in flask.g for the rest of the
+## request. If PERMISSION_CACHE_TTL is set (seconds), permissions are additionally cached per process; share_project
+## invalidates the entries it changes. Since the cache is per process, other gunicorn workers may use an old grant
+## for at most PERMISSION_CACHE_TTL seconds.
+
+class ProjectAccess(NamedTuple):
+    '''Access of the current user to a project.'''
+    project: Project
+    permission: str
+    creator: bool
+    file: Optional[File] = None
+
+_permission_cache: Dict[Tuple[int, int], Tuple[float, str, bool]] = {}
+_permission_cache_lock = threading.Lock()
+
+def resolve_project_access(user_id: int, project_id: int) -> Optional[ProjectAccess]:
+    '''Function to get the access of a user to a project (memoized per request).
+
+        Arguments
+        ---------
+        user_id : int
+            ID of the user.
+
+        project_id : int
+            ID of the project.
+
+        Returns
+        -------
+        Optional[ProjectAccess] : The project and the permissions of the user or None if the user has no access.
+    '''
+    memo = g.setdefault("_project_access", {})
+    if (user_id, project_id) in memo:
+        return memo[(user_id, project_id)]
+    access = None
+    cached = _get_cached_permission(user_id, project_id)
+    if cached:
+        project = Project.query.get(project_id)
+        if project:
+            access = ProjectAccess(project, cached[0], cached[1])
+    else:
+        row = db.session.query(Project, UserProject.permission, UserProject.creator).join(UserProject, UserProject.project_id == Project.id).filter(Project.id == project_id, UserProject.user_id == user_id).first()
+        if row:
+            access = ProjectAccess(row.Project, row.permission, row.creator)
+            _set_cached_permission(user_id, project_id, row.permission, row.creator)
+    memo[(user_id, project_id)] = access
+    return access
+
+def resolve_file_access(user_id: int, file_id: int) -> Optional[ProjectAccess]:
+    '''Function to get the access of a user to the project of a file; file, project, and permission are loaded with one query.
+
+        Arguments
+        ---------
+        user_id : int
+            ID of the user.
+
+        file_id : int
+            ID of the file.
+
+        Returns
+        -------
+        Optional[ProjectAccess] : The file, its project, and the permissions of the user or None if the user has no access.
+    '''
+    memo = g.setdefault("_file_access", {})
+    if (user_id, file_id) in memo:
+        return memo[(user_id, file_id)]
+    row = db.session.query(File, Project, UserProject.permission, UserProject.creator).join(Project, Project.id == File.project_id).join(UserProject, UserProject.project_id == Project.id).filter(File.id == file_id, UserProject.user_id == user_id).first()
+    access = ProjectAccess(row.Project, row.permission, row.creator, row.File) if row else None
+    memo[(user_id, file_id)] = access
+    if access:
+        g.setdefault("_project_access", {})[(user_id, access.project.id)] = access._replace(file=None)
+    return access
+
+def require_project_permission(permission: str = "r", creator_only: bool = False, allow_file_creator: bool = False, message: str = "You do not have permission to access this project.", json_response: bool = False) -> Callable:
+    '''Decorator for routes with a project_id or file_id argument that checks the permissions of the current user.
+
+        The resolved access is available in the route via get_project_access().
+
+        Arguments
+        ---------
+        permission : str
+            Required permissions (e.g., "r", "w", "d"; all characters need to be granted).
+
+        creator_only : bool
+            Only the creator of the project is allowed.
+
+        allow_file_creator : bool
+            The user who created the file is allowed even without the required permissions (file routes).
+
+        message : str
+            Flash message (or JSON error) if access is denied.
+
+        json_response : bool
+            Answer with a JSON error (403) instead of a redirect.
+
+        Returns
+        -------
+        Callable : The decorator.
+    '''
+    def decorator(route: Callable) -> Callable:
+        @wraps(route)
+        def wrapper(*args, **kwargs):
+            if "file_id" in kwargs:
+                access = resolve_file_access(current_user.id, kwargs["file_id"])
+            else:
+                access = resolve_project_access(current_user.id, kwargs["project_id"])
+            allowed = access is not None and all(p in access.permission for p in permission) and (access.creator or not creator_only)
+            if access is not None and not allowed and allow_file_creator and access.file is not None:
+                allowed = access.file.created_by == current_user.id
+            if not allowed:
+                critical_error_logger(f"{route.__name__} was not allowed for {current_user.username}.")
+                if json_response:
+                    return jsonify({"error": message}), 403
+                flash(message, 'danger')
+                # Users with access to the project are sent back to the project page
+                if access is not None and "r" in access.permission:
+                    return redirect(url_for("maker_project.show_project_files", project_id=access.project.id))
+                return redirect(url_for("maker_project.show_user_projects"))
+            g.project_access = access
+            return route(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def get_project_access() -> ProjectAccess:
+    '''Function to get the access resolved by require_project_permission for the current request.'''
+    return g.project_access
+
+def invalidate_project_permission(project_id: int, user_id: Optional[int] = None) -> None:
+    '''Function to remove cached permissions of a project (of one user or of all users) after a grant has changed.'''
+    with _permission_cache_lock:
+        for key in [key for key in _permission_cache if key[1] == project_id and (user_id is None or key[0] == user_id)]:
+            del _permission_cache[key]
+    memo = g.get("_project_access", {})
+    for key in [key for key in memo if key[1] == project_id and (user_id is None or key[0] == user_id)]:
+        del memo[key]
+
+def _get_cached_permission(user_id: int, project_id: int) -> Optional[Tuple[str, bool]]:
+    '''Get a permission from the process cache if PERMISSION_CACHE_TTL is set and the entry has not expired.'''
+    if not current_app.config.get("PERMISSION_CACHE_TTL", 0):
+        return None
+    with _permission_cache_lock:
+        entry = _permission_cache.get((user_id, project_id))
+    if entry is None or entry[0] < time.monotonic():
+        return None
+    return entry[1], entry[2]
+
+def _set_cached_permission(user_id: int, project_id: int, permission: str, creator: bool) -> None:
+    '''Store a permission in the process cache if PERMISSION_CACHE_TTL is set.'''
+    ttl = float(current_app.config.get("PERMISSION_CACHE_TTL", 0))
+    if not ttl:
+        return
+    with _permission_cache_lock:
+        _permission_cache[(user_id, project_id)] = (time.monotonic() + ttl, permission, creator)
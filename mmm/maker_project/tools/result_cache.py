@@ -0,0 +1,247 @@
+# Copyright (c) 2024 Thomas Jurczyk
+# This software is provided under the MIT License.
+# For more information, please refer to the LICENSE file in the root directory of this project.
+
+import hashlib, json, os, shutil, subprocess, time, uuid
+from typing import Callable, Dict, List, Optional, Tuple
+from flask import current_app
+from mmm.tools import observe_result_cache
+
+## RESULT CACHE
+## Editors often re-run a Maker step with identical inputs. The outputs of every successful step are stored in
+## RESULT_CACHE_PATH under a key computed from the step, its arguments, the contents of the input files, and the
+## digest of the module image. If the same key comes up again, the outputs are copied back into the project folder
+## instead of starting a container. The cache is limited to RESULT_CACHE_MAX_SIZE bytes (least recently used entries
+## are evicted first). Hits, misses, stores, and evictions are counted in the metrics (mmm_result_cache_events).
+
+MANIFEST_NAME = "manifest.json"
+
+def hash_file(file_path: str) -> str:
+    '''Function to compute the SHA-256 digest of a file (read in chunks).
+
+        Arguments
+        ---------
+        file_path : str
+            Path to the file.
+
+        Returns
+        -------
+        str : The hex digest.
+    '''
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def get_image_digest(image: str) -> Optional[str]:
+    '''Function to get the ID (digest) of a local module image.
+
+        Arguments
+        ---------
+        image : str
+            The module image.
+
+        Returns
+        -------
+        Optional[str] : The image ID or None if it cannot be determined (in this case, the step is not cached).
+    '''
+    try:
+        result = subprocess.run(["docker", "image", "inspect", "--format", "{{.Id}}", image], capture_output=True, text=True)
+    except OSError:
+        return None
+    if result.returncode != 0 or not result.stdout.strip():
+        return None
+    return result.stdout.strip()
+
+def compute_cache_key(mmm_choice: str, dir_path: str, input_files: List[str], step_arguments: dict, image: str) -> Optional[str]:
+    '''Function to compute the cache key of a Maker step.
+
+        Arguments
+        ---------
+        mmm_choice : str
+            The Maker step (doc2md, verifybibtex, xml2yaml, dw, tex2pdf).
+
+        dir_path : str
+            Path to the project folder.
+
+        input_files : List[str]
+            The input files of the step (need to be in dir_path).
+
+        step_arguments : dict
+            All other arguments that influence the outputs (zotero flag, output formats, XML2YAML data, ...).
+
+        image : str
+            The module image.
+
+        Returns
+        -------
+        Optional[str] : The cache key or None if the step cannot be cached.
+    '''
+    image_digest = get_image_digest(image)
+    if image_digest is None:
+        return None
+    key = hashlib.sha256()
+    key.update(json.dumps({"step": mmm_choice, "image": image_digest, "arguments": step_arguments}, sort_keys=True).encode())
+    for file_name in sorted(input_files):
+        key.update(file_name.encode())
+        key.update(hash_file(os.path.join(dir_path, file_name)).encode())
+    return key.hexdigest()
+
+def run_cached_step(mmm_choice: str, dir_path: str, input_files: List[str], step_arguments: dict, image: str, output_files: List[str], step_function: Callable[[], bool]) -> bool:
+    '''Function to run a Maker step through the result cache.
+
+        On a cache hit, the cached outputs are copied into dir_path and the step function is not called. On a miss,
+        the step function is called and all files of output_files that it created or changed are stored in the cache
+        (found by comparing size, modification time, and inode of the files before and after the step, so that
+        leftovers of older runs are not cached).
+
+        Arguments
+        ---------
+        mmm_choice, dir_path, input_files, step_arguments, image
+            See compute_cache_key.
+
+        output_files : List[str]
+            Names of the files the step can produce.
+
+        step_function : Callable[[], bool]
+            The function running the step (e.g., create_files_doc2md with its arguments).
+
+        Returns
+        -------
+        bool : True if the outputs are available, else False.
+    '''
+    if not current_app.config.get("RESULT_CACHE_ENABLED", True):
+        return step_function()
+    try:
+        cache_key = compute_cache_key(mmm_choice, dir_path, input_files, step_arguments, image)
+    except OSError:
+        cache_key = None
+    if cache_key is None:
+        return step_function()
+    if restore_cached_outputs(cache_key, dir_path):
+        observe_result_cache("hit")
+        current_app.logger.info(f"Result cache hit for {mmm_choice} in {dir_path}.")
+        return True
+    observe_result_cache("miss")
+    before = stat_files(dir_path, output_files)
+    res = step_function()
+    if res:
+        # Only store files that were written by this run (older files with the same name are leftovers)
+        after = stat_files(dir_path, output_files)
+        created_files = [file_name for file_name in output_files if file_name in after and before.get(file_name) != after[file_name]]
+        if created_files:
+            store_outputs(cache_key, dir_path, created_files)
+    return res
+
+def stat_files(dir_path: str, file_names: List[str]) -> Dict[str, Tuple[int, int, int]]:
+    '''Function to get size, modification time (ns), and inode of the existing files of file_names in dir_path.'''
+    stats = {}
+    for file_name in file_names:
+        try:
+            stat = os.stat(os.path.join(dir_path, file_name))
+        except OSError:
+            continue
+        stats[file_name] = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+    return stats
+
+def restore_cached_outputs(cache_key: str, dir_path: str) -> bool:
+    '''Function to copy the cached outputs of a step into the project folder.
+
+        Arguments
+        ---------
+        cache_key : str
+            The cache key.
+
+        dir_path : str
+            Path to the project folder.
+
+        Returns
+        -------
+        bool : True if the outputs were restored, False if there is no (complete) cache entry.
+    '''
+    entry_path = os.path.join(get_cache_path(), cache_key)
+    manifest_path = os.path.join(entry_path, MANIFEST_NAME)
+    try:
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+        for file_name in manifest["files"]:
+            shutil.copyfile(os.path.join(entry_path, file_name), os.path.join(dir_path, file_name))
+        # Mark entry as recently used (used for LRU eviction)
+        os.utime(manifest_path)
+    except (OSError, ValueError, KeyError):
+        # Missing or evicted while copying; treat as miss
+        return False
+    return True
+
+def store_outputs(cache_key: str, dir_path: str, file_names: List[str]) -> None:
+    '''Function to store the outputs of a step in the cache and to evict old entries if the cache is too big.
+
+        Arguments
+        ---------
+        cache_key : str
+            The cache key.
+
+        dir_path : str
+            Path to the project folder.
+
+        file_names : List[str]
+            The outputs to be stored.
+
+        Returns
+        -------
+        None
+    '''
+    cache_path = get_cache_path()
+    entry_path = os.path.join(cache_path, cache_key)
+    if os.path.exists(entry_path):
+        return
+    tmp_path = os.path.join(cache_path, f".tmp-{uuid.uuid4().hex}")
+    try:
+        os.makedirs(tmp_path)
+        size = 0
+        for file_name in file_names:
+            shutil.copyfile(os.path.join(dir_path, file_name), os.path.join(tmp_path, file_name))
+            size += os.path.getsize(os.path.join(tmp_path, file_name))
+        with open(os.path.join(tmp_path, MANIFEST_NAME), "w") as f:
+            json.dump({"files": file_names, "size": size, "created_at": time.time()}, f)
+        # Publish the entry atomically; if another worker was faster, keep its entry
+        os.rename(tmp_path, entry_path)
+        observe_result_cache("store")
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        return
+    evict_cache_entries()
+
+def evict_cache_entries() -> None:
+    '''Function to remove least recently used cache entries until the cache is smaller than RESULT_CACHE_MAX_SIZE.'''
+    max_size = int(current_app.config.get("RESULT_CACHE_MAX_SIZE", 2 * 1024 * 1024 * 1024))
+    entries = []
+    total_size = 0
+    with os.scandir(get_cache_path()) as it:
+        for entry in it:
+            if not entry.is_dir() or entry.name.startswith("."):
+                continue
+            manifest_path = os.path.join(entry.path, MANIFEST_NAME)
+            try:
+                with open(manifest_path, "r") as f:
+                    size = json.load(f)["size"]
+                last_used = os.path.getmtime(manifest_path)
+            except (OSError, ValueError, KeyError):
+                continue
+            entries.append((last_used, size, entry.path))
+            total_size += size
+    if total_size <= max_size:
+        return
+    for last_used, size, entry_path in sorted(entries):
+        shutil.rmtree(entry_path, ignore_errors=True)
+        observe_result_cache("eviction")
+        total_size -= size
+        if total_size <= max_size:
+            break
+
+def get_cache_path() -> str:
+    '''Function to get (and create) the folder of the result cache.'''
+    cache_path = current_app.config.get("RESULT_CACHE_PATH", "cache/results")
+    os.makedirs(cache_path, exist_ok=True)
+    return cache_path
@@ -0,0 +1,53 @@
+# Copyright (c) 2024 Thomas Jurczyk
+# This software is provided under the MIT License.
+# For more information, please refer to the LICENSE file in the root directory of this project.
+
+import os, shutil, uuid
+from flask import current_app
+
+## TRASH
+## Deleted project folders and files are not removed in the request. They are moved (renamed, which is atomic and
+## independent of their size) to TRASH_PATH (default: uploads/.trash) and removed by the job worker in the
+## background (see empty_trash). TRASH_PATH needs to be on the same file system as the project folders.
+
+def get_trash_path() -> str:
+    '''Function to get (and create) the trash folder.'''
+    trash_path = current_app.config.get("TRASH_PATH", "uploads/.trash")
+    os.makedirs(trash_path, exist_ok=True)
+    return trash_path
+
+def move_to_trash(path: str) -> str:
+    '''Function to move a file or folder to the trash.
+
+        Arguments
+        ---------
+        path : str
+            Path to the file or folder.
+
+        Returns
+        -------
+        str : The path in the trash.
+    '''
+    trash_path = os.path.join(get_trash_path(), f"{uuid.uuid4().hex}-{os.path.basename(path.rstrip('/'))}")
+    os.rename(path, trash_path)
+    return trash_path
+
+def empty_trash() -> int:
+    '''Function to remove everything in the trash (run by the job worker).
+
+        Returns
+        -------
+        int : Number of removed files and folders.
+    '''
+    removed = 0
+    with os.scandir(get_trash_path()) as it:
+        for entry in it:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path)
+                else:
+                    os.remove(entry.path)
+                removed += 1
+            except OSError as e:
+                current_app.logger.error(f"{entry.path} could not be removed from the trash: {e}")
+    return removed
@@ -0,0 +1,113 @@
+# Copyright (c) 2024 Thomas Jurczyk
+# This software is provided under the MIT License.
+# For more information, please refer to the LICENSE file in the root directory of this project.
+
+import os, threading
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Tuple
+import markdown2
+from flask import current_app
+
+## VERIFYBIBTEX REPORT
+## verifybibtex-report.md can be huge for large bibliographies. The report is read once, line by line: while reading,
+## it is classified (no errors or errors) and split into pages of about VERIFYBIBTEX_PAGE_SIZE lines; only the byte
+## offsets of the pages are kept. A page is rendered to HTML when it is requested. Both the page offsets and the
+## rendered pages are cached per report file and modification time, so reloading the output page does not read the
+## report again.
+
+REPORT_NAME = "verifybibtex-report.md"
+NO_ERRORS_LINE = "found 0 errors."
+
+class VerifyBibTeXReport(NamedTuple):
+    '''Classification and page offsets of a VerifyBibTeX report.'''
+    no_errors: bool
+    # Byte offsets of the pages; the last entry is the size of the report
+    page_offsets: List[int]
+
+# Report path -> ((modification time, size), report, rendered pages)
+_report_cache: "OrderedDict[str, Tuple[Tuple[int, int], VerifyBibTeXReport, Dict[int, str]]]" = OrderedDict()
+_report_cache_lock = threading.Lock()
+
+def parse_verifybibtex_report(file_path: str, page_size: int) -> VerifyBibTeXReport:
+    '''Function to classify a VerifyBibTeX report and to split it into pages in a single pass.
+
+        A new page starts at the first block (blank line, heading, or list item) after page_size non-empty lines, so
+        Markdown blocks are not cut in half.
+
+        Arguments
+        ---------
+        file_path : str
+            Path to the report.
+
+        page_size : int
+            Number of non-empty lines per page.
+
+        Returns
+        -------
+        VerifyBibTeXReport : The classification and the page offsets.
+    '''
+    no_errors = False
+    page_offsets = [0]
+    lines_on_page = 0
+    offset = 0
+    with open(file_path, "rb") as f:
+        for raw_line in f:
+            line = raw_line.decode("utf-8", errors="replace").strip()
+            if lines_on_page >= page_size and (line == "" or line.startswith(("#", "- ", "* "))):
+                page_offsets.append(offset)
+                lines_on_page = 0
+            offset += len(raw_line)
+            if line == "":
+                continue
+            lines_on_page += 1
+            if line.lower() == NO_ERRORS_LINE:
+                no_errors = True
+    page_offsets.append(offset)
+    return VerifyBibTeXReport(no_errors, page_offsets)
+
+def create_html_verifybibtex(dir_path: str, page: int = 1) -> Tuple[str, int]:
+    '''Function to create HTML for one page of the VerifyBibTeX output.
+
+        Parameters
+        ---------
+        dir_path : str
+            Path to the project folder.
+
+        page : int
+            The page to be rendered (starting at 1).
+
+        Returns
+        -------
+        Tuple[str, int] : The HTML output for the page of the verifybibtex-report.md file in dir_path and the number of
+            pages (0 if there is no report).
+    '''
+    file_path = os.path.join(os.getcwd(), dir_path, REPORT_NAME)
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return "", 0
+    key = (stat.st_mtime_ns, stat.st_size)
+    with _report_cache_lock:
+        entry = _report_cache.get(file_path)
+        if entry is not None and entry[0] == key:
+            _report_cache.move_to_end(file_path)
+    if entry is None or entry[0] != key:
+        entry = (key, parse_verifybibtex_report(file_path, int(current_app.config.get("VERIFYBIBTEX_PAGE_SIZE", 100))), {})
+        with _report_cache_lock:
+            _report_cache[file_path] = entry
+            # Keep the reports of the last VERIFYBIBTEX_CACHE_SIZE output pages
+            while len(_report_cache) > int(current_app.config.get("VERIFYBIBTEX_CACHE_SIZE", 64)):
+                _report_cache.popitem(last=False)
+    report, rendered_pages = entry[1], entry[2]
+    # First case: No errors
+    if report.no_errors:
+        return "<p style='color: green;'>No errors found in the BibTeX file.</p>", 1
+    # Second case: Errors found (one page of the report)
+    page_count = len(report.page_offsets) - 1
+    page = min(max(page, 1), page_count)
+    if page not in rendered_pages:
+        with open(file_path, "rb") as f:
+            f.seek(report.page_offsets[page - 1])
+            content = f.read(report.page_offsets[page] - report.page_offsets[page - 1]).decode("utf-8", errors="replace")
+        rendered_pages[page] = markdown2.markdown(content)
+    return rendered_pages[page], page_count
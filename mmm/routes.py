@@ -4,8 +4,7 @@
 
 from flask import request, render_template, Blueprint
 from flask_login import login_required
-import os
-from markdown import markdown
+from mmm.tools import render_custom_page
 
 main = Blueprint("main", __name__)
 
@@ -13,15 +12,9 @@ main = Blueprint("main", __name__)
 @main.route("/", methods=['GET'])
 def index():
     if request.method == "GET":
-        # Get custom imprint data from file in custom folder
-        # If file does not exist, return default imprint page
-        if os.path.exists("mmm/custom/main.md"):
-            with open("mmm/custom/main.md", "r") as file:
-                content = markdown(file.read())
-                # Render imprint page with custom content
-                return render_template("index.html", content=content)
-        # Default imprint page
-        return render_template("index.html", content="No file custom/main.md found.")
+        # Get custom landing page from file in custom folder (rendered HTML is cached until the file changes)
+        # If file does not exist, return default page
+        return render_custom_page("index.html", "main.md")
     
 ## ABOUT ROUTE
 @main.route("/about", methods=['GET'])
@@ -33,15 +26,9 @@ def about():
 @main.route("/imprint", methods=['GET'])
 def imprint():
     if request.method == "GET":
-        # Get custom imprint data from file in custom folder
+        # Get custom imprint data from file in custom folder (rendered HTML is cached until the file changes)
         # If file does not exist, return default imprint page
-        if os.path.exists("mmm/custom/imprint.md"):
-            with open("mmm/custom/imprint.md", "r") as file:
-                content = markdown(file.read())
-                # Render imprint page with custom content
-                return render_template("imprint.html", content=content)
-        # Default imprint page
-        return render_template("imprint.html", content="No file custom/imprint.md found.")
+        return render_custom_page("imprint.html", "imprint.md")
         
 ## VERSION ROUTE
 @main.route("/version", methods=['GET'])
@@ -50,4 +50,119 @@ function startLoadingAnimation() {
         var loadingBlock = document.getElementById("loading-animation-phimisci");
         loadingBlock.style.display = "block";
     }
-}
\ No newline at end of file
+}
+
+/**
+ * Uploads the selected files in chunks if at least one of them is larger than the threshold of the upload form.
+ * Smaller files are uploaded with the form as usual.
+ * @param {HTMLFormElement} form - The upload form (with data-init-url and data-threshold).
+ * @returns {boolean} - True if the form should be submitted as usual.
+ */
+function uploadFilesChunked(form) {
+    var files = Array.from(form.querySelector('input[type="file"]').files);
+    var threshold = parseInt(form.dataset.threshold);
+    if (!files.some(function (file) { return file.size > threshold; })) {
+        return true;
+    }
+    var csrfToken = form.querySelector('input[name="csrf_token"]').value;
+    var submitButton = document.getElementById("submit-phimisci");
+    var progress = document.getElementById("phimisci-upload-progress");
+    submitButton.style.display = "none";
+    (async function () {
+        for (var file of files) {
+            await uploadFileChunked(file, form.dataset.initUrl, csrfToken, function (offset) {
+                progress.textContent = "Uploading " + file.name + ": " + Math.floor(100 * offset / Math.max(file.size, 1)) + "%";
+            });
+        }
+        window.location.reload();
+    })().catch(function (error) {
+        progress.textContent = error.message;
+        submitButton.style.display = "";
+    });
+    return false;
+}
+
+/**
+ * Uploads a single file in chunks. If the connection breaks, the upload is continued at the offset reported by the
+ * server; uploads that were interrupted completely (e.g., closed tab) are resumed when the same file is uploaded again.
+ * @param {File} file - The file to upload.
+ * @param {string} initUrl - URL to start a new upload.
+ * @param {string} csrfToken - The CSRF token of the page.
+ * @param {Function} onProgress - Called with the number of bytes uploaded so far.
+ */
+async function uploadFileChunked(file, initUrl, csrfToken, onProgress) {
+    var storageKey = "phimisci-upload:" + initUrl + ":" + file.name + ":" + file.size + ":" + file.lastModified;
+    var upload = JSON.parse(localStorage.getItem(storageKey) || "null");
+    var offset = 0;
+    if (upload) {
+        var status = await fetch(upload.upload_url, {credentials: "same-origin"});
+        if (status.ok) {
+            offset = (await status.json()).offset;
+        } else {
+            upload = null;
+        }
+    }
+    if (!upload) {
+        upload = await checkUploadResponse(await fetch(initUrl, {
+            method: "POST",
+            credentials: "same-origin",
+            headers: {"Content-Type": "application/json", "X-CSRFToken": csrfToken},
+            body: JSON.stringify({filename: file.name, size: file.size})
+        }));
+        localStorage.setItem(storageKey, JSON.stringify(upload));
+    }
+    var retries = 0;
+    while (offset < file.size) {
+        onProgress(offset);
+        var response = null;
+        try {
+            response = await fetch(upload.upload_url + "?offset=" + offset, {
+                method: "PUT",
+                credentials: "same-origin",
+                headers: {"Content-Type": "application/octet-stream", "X-CSRFToken": csrfToken},
+                body: file.slice(offset, offset + upload.chunk_size)
+            });
+        } catch (error) {
+            // network error, handled below
+        }
+        if (response && response.ok) {
+            offset = (await response.json()).offset;
+            retries = 0;
+            continue;
+        }
+        if (response && response.status != 409) {
+            await checkUploadResponse(response);
+        }
+        // Wait and ask the server how many bytes have arrived
+        retries += 1;
+        if (retries > 5) {
+            throw new Error("The upload of " + file.name + " was interrupted. Please upload the file again to resume the upload.");
+        }
+        await new Promise(function (resolve) { setTimeout(resolve, 1000 * retries); });
+        try {
+            offset = (await checkUploadResponse(await fetch(upload.upload_url, {credentials: "same-origin"}))).offset;
+        } catch (error) {
+            // try again with the old offset; the server answers with the correct offset
+        }
+    }
+    onProgress(file.size);
+    await checkUploadResponse(await fetch(upload.finalize_url, {
+        method: "POST",
+        credentials: "same-origin",
+        headers: {"Content-Type": "application/json", "X-CSRFToken": csrfToken},
+        body: JSON.stringify({})
+    }));
+    localStorage.removeItem(storageKey);
+}
+
+/**
+ * Returns the JSON body of a response of the upload API or throws its error message.
+ * @param {Response} response - The response.
+ */
+async function checkUploadResponse(response) {
+    var result = await response.json().catch(function () { return {error: "Upload failed (" + response.status + ")."}; });
+    if (!response.ok) {
+        throw new Error(result.error || "Upload failed (" + response.status + ").");
+    }
+    return result;
+}
@@ -0,0 +1,7 @@
+# Copyright (c) 2024 Thomas Jurczyk
+# This software is provided under the MIT License.
+# For more information, please refer to the LICENSE file in the root directory of this project.
+
+from .functions import *
+from .profiler import RequestProfile, RequestProfileAdminView, init_profiler
+from .metrics import init_metrics, clear_metrics_dir, StepTimer, get_file_sizes, observe_container_phase, observe_container_exit, observe_result_cache
\ No newline at end of file
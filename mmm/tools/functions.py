@@ -0,0 +1,75 @@
+# Copyright (c) 2024 Thomas Jurczyk
+# This software is provided under the MIT License.
+# For more information, please refer to the LICENSE file in the root directory of this project.
+
+import os, threading
+from typing import Dict, Optional, Tuple
+from flask import render_template, make_response, request, Response
+from markdown import markdown
+
+## CUSTOM PAGES
+## The Markdown files in mmm/custom/ (landing page, imprint, ...) are rendered once per process and file version:
+## the cache key is the path of the file plus its modification time and size, so the HTML is only recomputed after
+## the file was changed. The pages are sent with an ETag, so browsers get a 304 if nothing has changed.
+
+CUSTOM_CONTENT_FOLDER = "mmm/custom"
+
+# Path -> ((modification time, size), rendered HTML)
+_markdown_cache: Dict[str, Tuple[Tuple[int, int], str]] = {}
+_markdown_cache_lock = threading.Lock()
+
+def render_markdown_file(file_path: str) -> Optional[str]:
+    '''Function to render a Markdown file to HTML (cached until the file changes).
+
+        Arguments
+        ---------
+        file_path : str
+            Path to the Markdown file.
+
+        Returns
+        -------
+        Optional[str] : The HTML or None if the file does not exist.
+    '''
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    key = (stat.st_mtime_ns, stat.st_size)
+    with _markdown_cache_lock:
+        entry = _markdown_cache.get(file_path)
+    if entry is not None and entry[0] == key:
+        return entry[1]
+    with open(file_path, "r") as file:
+        html = markdown(file.read())
+    with _markdown_cache_lock:
+        _markdown_cache[file_path] = (key, html)
+    return html
+
+def render_custom_page(template: str, filename: str) -> Response:
+    '''Function to render a template with the content of a Markdown file in mmm/custom/.
+
+        The ETag is computed from the whole page (the layout depends on the user and on flash messages), so only
+        unchanged pages are answered with 304.
+
+        Arguments
+        ---------
+        template : str
+            The template (gets the HTML as content).
+
+        filename : str
+            Name of the Markdown file in mmm/custom/.
+
+        Returns
+        -------
+        Response : The page (or 304 Not Modified).
+    '''
+    content = render_markdown_file(os.path.join(CUSTOM_CONTENT_FOLDER, filename))
+    if content is None:
+        content = f"No file custom/{filename} found."
+    response = make_response(render_template(template, content=content))
+    response.add_etag()
+    # Browsers have to revalidate the page every time, proxies must not share it between users
+    response.cache_control.no_cache = True
+    response.cache_control.private = True
+    response.vary.add("Cookie")
+    return response.make_conditional(request)
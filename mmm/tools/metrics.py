@@ -0,0 +1,144 @@
+# Copyright (c) 2024 Thomas Jurczyk
+# This software is provided under the MIT License.
+# For more information, please refer to the LICENSE file in the root directory of this project.
+
+import os, shutil, time
+from typing import List, Tuple
+from flask import Flask, Response, abort, current_app, g, has_request_context, request
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+import prometheus_client
+
+## METRICS
+## Prometheus metrics of the web application and the job worker, served at /metrics (admins or requests with
+## "Authorization: Bearer <METRICS_TOKEN>"). gunicorn runs several worker processes and the Maker steps run in the job
+## worker (worker.py), so the metrics are collected in multiprocess mode: every process writes its values to files in
+## PROMETHEUS_MULTIPROC_DIR (environment variable, needs to be set before the processes start and shared by the web
+## application and the job worker) and /metrics aggregates them. Without PROMETHEUS_MULTIPROC_DIR, /metrics only shows
+## the values of the process that answers the request.
+
+STEP_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200)
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+STEP_DURATION = Histogram("mmm_step_duration_seconds", "Duration of Maker steps.", ["step", "status"], buckets=STEP_BUCKETS)
+STEPS_IN_PROGRESS = Gauge("mmm_steps_in_progress", "Maker steps that are running.", ["step"], multiprocess_mode="livesum")
+STEP_INPUT_BYTES = Counter("mmm_step_input_bytes", "Size of the input files of Maker steps.", ["step"])
+STEP_OUTPUT_BYTES = Counter("mmm_step_output_bytes", "Size of the files created or changed by Maker steps.", ["step"])
+CONTAINER_DURATION = Histogram("mmm_container_duration_seconds", "Time to start a module container (start) and to run the module in it (run).", ["image", "phase"], buckets=STEP_BUCKETS)
+CONTAINER_EXIT_CODES = Counter("mmm_container_exits", "Exit codes of module containers.", ["image", "exit_code"])
+REQUEST_DURATION = Histogram("mmm_request_duration_seconds", "Duration of requests per endpoint.", ["blueprint", "endpoint", "method", "status"], buckets=REQUEST_BUCKETS)
+REQUEST_DB_QUERIES = Histogram("mmm_request_db_queries", "Number of database queries per request.", ["blueprint", "endpoint"], buckets=QUERY_BUCKETS)
+DB_QUERIES = Counter("mmm_db_queries", "Database queries of requests.", ["blueprint", "endpoint"])
+RESULT_CACHE_EVENTS = Counter("mmm_result_cache_events", "Hits, misses, stores, and evictions of the result cache.", ["event"])
+
+def observe_container_phase(image: str, phase: str, seconds: float) -> None:
+    '''Function to record the duration of a phase (start or run) of a module container.'''
+    CONTAINER_DURATION.labels(image, phase).observe(seconds)
+
+def observe_container_exit(image: str, returncode: int) -> None:
+    '''Function to count the exit code of a module container.'''
+    CONTAINER_EXIT_CODES.labels(image, str(returncode)).inc()
+
+def observe_result_cache(event: str) -> None:
+    '''Function to count an event (hit, miss, store, eviction) of the result cache.'''
+    RESULT_CACHE_EVENTS.labels(event).inc()
+
+def get_file_sizes(dir_path: str, filenames: List[str]) -> int:
+    '''Function to get the total size of files in a folder (missing files are skipped).'''
+    total = 0
+    for filename in filenames:
+        try:
+            total += os.path.getsize(os.path.join(dir_path, filename))
+        except OSError:
+            pass
+    return total
+
+class StepTimer:
+    '''Context manager to record duration, status, and input/output sizes of a Maker step.
+
+        Usage:
+            with StepTimer("doc2md", input_bytes) as timer:
+                ...
+                timer.status = "finished"
+                timer.output_bytes = ...
+    '''
+
+    def __init__(self, step: str, input_bytes: int):
+        self.step = step
+        self.status = "failed"
+        self.output_bytes = 0
+        STEP_INPUT_BYTES.labels(step).inc(input_bytes)
+
+    def __enter__(self) -> "StepTimer":
+        STEPS_IN_PROGRESS.labels(self.step).inc()
+        self._started_at = time.monotonic()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        STEP_DURATION.labels(self.step, self.status).observe(time.monotonic() - self._started_at)
+        STEPS_IN_PROGRESS.labels(self.step).dec()
+        STEP_OUTPUT_BYTES.labels(self.step).inc(self.output_bytes)
+
+def count_db_query(conn, cursor, statement, parameters, context, executemany) -> None:
+    '''SQLAlchemy event handler counting the queries of the current request.'''
+    if has_request_context() and "mmm_request_started_at" in g:
+        g.mmm_db_queries = g.get("mmm_db_queries", 0) + 1
+
+def get_request_labels() -> Tuple[str, str]:
+    '''Function to get the blueprint and endpoint labels of the current request (unknown URLs share one label).'''
+    return request.blueprint or "", request.endpoint or "unknown"
+
+def start_request_timer() -> None:
+    '''Function to start the timer and the query counter of a request (before_request).'''
+    g.mmm_request_started_at = time.monotonic()
+    g.mmm_db_queries = 0
+
+def observe_request(response: Response) -> Response:
+    '''Function to record duration and number of queries of a request (after_request).'''
+    if "mmm_request_started_at" not in g:
+        return response
+    blueprint, endpoint = get_request_labels()
+    REQUEST_DURATION.labels(blueprint, endpoint, request.method, str(response.status_code)).observe(time.monotonic() - g.mmm_request_started_at)
+    REQUEST_DB_QUERIES.labels(blueprint, endpoint).observe(g.mmm_db_queries)
+    DB_QUERIES.labels(blueprint, endpoint).inc(g.mmm_db_queries)
+    return response
+
+def metrics_view() -> Response:
+    '''View of /metrics (admins or METRICS_TOKEN).'''
+    token = current_app.config.get("METRICS_TOKEN")
+    authorized = token and request.headers.get("Authorization") == f"Bearer {token}"
+    if not authorized and not (current_user.is_authenticated and current_user.is_admin()):
+        abort(403)
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+def init_metrics(app: Flask) -> None:
+    '''Function to register the request metrics and the /metrics endpoint (if METRICS_ENABLED, default: True).
+
+        Arguments
+        ---------
+        app : Flask
+            The Flask app.
+    '''
+    if not app.config.get("METRICS_ENABLED", True):
+        return
+    app.before_request(start_request_timer)
+    app.after_request(observe_request)
+    if not event.contains(Engine, "before_cursor_execute", count_db_query):
+        event.listen(Engine, "before_cursor_execute", count_db_query)
+    app.add_url_rule("/metrics", "metrics", metrics_view)
+
+def clear_metrics_dir() -> None:
+    '''Function to remove the values of earlier runs from PROMETHEUS_MULTIPROC_DIR (before the processes start).'''
+    metrics_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if not metrics_dir:
+        return
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
@@ -0,0 +1,135 @@
+# Copyright (c) 2024 Thomas Jurczyk
+# This software is provided under the MIT License.
+# For more information, please refer to the LICENSE file in the root directory of this project.
+
+import cProfile, io, json, pstats, random, time
+from datetime import datetime
+from flask import Flask, Response, current_app, g, has_request_context, request
+from flask_login import current_user
+from flask_admin.contrib.sqla import ModelView
+from markupsafe import Markup, escape
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from mmm import db
+
+## REQUEST PROFILER
+## Opt-in profiler for slow pages (PROFILER_ENABLED, default: False; without it, no hooks are registered at all).
+## Requests to the endpoints in PROFILER_ENDPOINTS and a random sample of all other requests (PROFILER_SAMPLE_RATE,
+## between 0 and 1) are run under cProfile; the SQL statements of these requests are recorded with their durations.
+## The results are stored in the request_profiles table, which is used as a ring buffer (only the last
+## PROFILER_MAX_ENTRIES profiles are kept), and can be browsed by admins in the admin interface (Request profiles).
+
+# Number of functions (sorted by cumulative time) and SQL statements stored per profile
+PROFILE_MAX_FUNCTIONS = 40
+PROFILE_MAX_STATEMENTS = 200
+
+## REQUEST PROFILE MODEL
+class RequestProfile(db.Model):
+    __tablename__ = 'request_profiles'
+    id = db.Column(db.Integer, primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+    endpoint = db.Column(db.String(255))
+    method = db.Column(db.String(10), nullable=False)
+    path = db.Column(db.String(2048), nullable=False)
+    status = db.Column(db.Integer)
+    # Milliseconds
+    duration = db.Column(db.Float, nullable=False)
+    query_count = db.Column(db.Integer, nullable=False)
+    query_duration = db.Column(db.Float, nullable=False)
+    # Output of pstats (sorted by cumulative time)
+    profile = db.Column(db.Text)
+    # JSON list of [statement, milliseconds]
+    queries = db.Column(db.Text)
+
+## REQUEST PROFILE ADMIN VIEW
+class RequestProfileAdminView(ModelView):
+    can_create = False
+    can_edit = False
+    can_view_details = True
+    column_default_sort = ('id', True)
+    column_list = ('created_at', 'method', 'endpoint', 'path', 'status', 'duration', 'query_count', 'query_duration')
+    column_searchable_list = ('endpoint', 'path')
+    column_filters = ('endpoint', 'status')
+    column_labels = {'duration': 'Duration (ms)', 'query_count': 'Queries', 'query_duration': 'Query time (ms)'}
+    column_formatters = {
+        'duration': lambda view, context, model, name: f"{model.duration:.1f}",
+        'query_duration': lambda view, context, model, name: f"{model.query_duration:.1f}",
+        'profile': lambda view, context, model, name: Markup(f"<pre>{escape(model.profile or '')}</pre>"),
+        'queries': lambda view, context, model, name: Markup("<pre>" + "\n\n".join(f"{escape(f'{duration:.2f} ms')}: {escape(statement)}" for statement, duration in json.loads(model.queries or "[]")) + "</pre>"),
+    }
+
+    def is_accessible(self):
+        return current_user.is_authenticated and current_user.is_admin()
+
+def start_profile() -> None:
+    '''Function to start profiling the current request if it is sampled (before_request).'''
+    endpoints = current_app.config.get("PROFILER_ENDPOINTS", [])
+    if request.endpoint not in endpoints and random.random() >= float(current_app.config.get("PROFILER_SAMPLE_RATE", 0)):
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler is active (e.g., a concurrent request in another thread)
+        return
+    g.mmm_profiler = profiler
+    g.mmm_profile_queries = []
+    g.mmm_profile_started_at = time.perf_counter()
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    '''SQLAlchemy event handler starting the timer of a statement of a profiled request.'''
+    if has_request_context() and "mmm_profiler" in g:
+        conn.info.setdefault("mmm_profile_started_at", []).append(time.perf_counter())
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    '''SQLAlchemy event handler recording a statement of a profiled request with its duration.'''
+    if has_request_context() and "mmm_profiler" in g and conn.info.get("mmm_profile_started_at"):
+        duration = (time.perf_counter() - conn.info["mmm_profile_started_at"].pop()) * 1000
+        g.mmm_profile_queries.append((statement, duration))
+
+def finish_profile(response: Response) -> Response:
+    '''Function to stop the profiler and to store the profile in the ring buffer (after_request).'''
+    profiler = g.pop("mmm_profiler", None)
+    if profiler is None:
+        return response
+    profiler.disable()
+    duration = (time.perf_counter() - g.mmm_profile_started_at) * 1000
+    queries = g.mmm_profile_queries
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(PROFILE_MAX_FUNCTIONS)
+    values = {
+        "created_at": datetime.now(),
+        "endpoint": request.endpoint,
+        "method": request.method,
+        "path": request.full_path[:2048],
+        "status": response.status_code,
+        "duration": duration,
+        "query_count": len(queries),
+        "query_duration": sum(query_duration for _, query_duration in queries),
+        "profile": output.getvalue(),
+        "queries": json.dumps(queries[:PROFILE_MAX_STATEMENTS]),
+    }
+    try:
+        # Own connection and transaction, independent of the session of the request
+        with db.engine.begin() as connection:
+            profile_id = connection.execute(RequestProfile.__table__.insert().values(**values)).inserted_primary_key[0]
+            connection.execute(RequestProfile.__table__.delete().where(RequestProfile.id <= profile_id - int(current_app.config.get("PROFILER_MAX_ENTRIES", 100))))
+    except Exception as e:
+        current_app.logger.error(f"Request profile of {request.path} could not be stored: {e}")
+    return response
+
+def init_profiler(app: Flask) -> None:
+    '''Function to register the request profiler (only if PROFILER_ENABLED, default: False).
+
+        Arguments
+        ---------
+        app : Flask
+            The Flask app.
+    '''
+    if not app.config.get("PROFILER_ENABLED", False):
+        return
+    app.before_request(start_profile)
+    app.after_request(finish_profile)
+    if not event.contains(Engine, "before_cursor_execute", before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", after_cursor_execute)
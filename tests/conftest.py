@@ -0,0 +1,60 @@
+# Copyright (c) 2024 Thomas Jurczyk
+# This software is provided under the MIT License.
+# For more information, please refer to the LICENSE file in the root directory of this project.
+
+import os
+from contextlib import contextmanager
+import pytest
+from sqlalchemy import event
+from mmm import create_app, db
+
+CONFIG = """
+SECRET_KEY = 'test'
+SQLALCHEMY_DATABASE_URI = 'sqlite:///{db_path}'
+LOG_FILE = '{log_path}'
+UPLOAD_PATH = '{upload_path}'
+MMM_MAIL_SUBJECT_PREFIX = '[MMM] '
+MMM_MAIL_SENDER = 'MMM Test <test@mmm.org>'
+MAIL_SUPPRESS_SEND = True
+WTF_CSRF_ENABLED = False
+"""
+
+@pytest.fixture(scope="session")
+def app(tmp_path_factory):
+    '''Flask app with a temporary config (MMM_CONFIG), SQLite database and working folder.'''
+    tmp_path = tmp_path_factory.mktemp("mmm")
+    config_path = tmp_path / "mmm.cfg"
+    config_path.write_text(CONFIG.format(db_path=tmp_path / "mmm.db", log_path=tmp_path / "mmm.log", upload_path=tmp_path))
+    os.environ["MMM_CONFIG"] = str(config_path)
+    # Project folders are relative to the working folder (uploads/<user>/<project>)
+    cwd = os.getcwd()
+    os.chdir(tmp_path)
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+    yield app
+    os.chdir(cwd)
+    del os.environ["MMM_CONFIG"]
+
+@pytest.fixture
+def app_context(app):
+    with app.app_context():
+        yield
+        db.session.rollback()
+
+@pytest.fixture
+def count_queries(app):
+    '''Context manager that counts the SQL statements executed inside it (count_queries() as queries: len(queries)).'''
+    @contextmanager
+    def counter():
+        queries = []
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            queries.append(statement)
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            yield queries
+        finally:
+            event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return counter
@@ -0,0 +1,68 @@
+# Copyright (c) 2024 Thomas Jurczyk
+# This software is provided under the MIT License.
+# For more information, please refer to the LICENSE file in the root directory of this project.
+
+import os, shutil
+from datetime import datetime
+import pytest
+from flask_login import login_user
+from mmm import db
+from mmm.auth.models import User
+from mmm.maker_project.models import Project, File
+from mmm.maker_project.tools import run_maker_step, register_files_in_db, store_blob
+from mmm.maker_project.tools.blob_store import get_blob_path
+
+@pytest.fixture
+def projects(app, app_context):
+    '''Two projects of one user whose folders contain shared.md with the same content (linked to one blob).'''
+    user = User("blobs", "password", "blobs@mmm.org")
+    db.session.add(user)
+    db.session.flush()
+    # Files are registered in the name of current_user (as in run_job)
+    request_context = app.test_request_context()
+    request_context.push()
+    login_user(user)
+    projects = [Project(f"uploads/{user.username}", name, datetime.now(), datetime.now()) for name in ["first", "second"]]
+    db.session.add_all(projects)
+    db.session.commit()
+    for project in projects:
+        dir_path = os.path.join(project.path, project.project_name)
+        os.makedirs(dir_path)
+        with open(os.path.join(dir_path, "shared.md"), "wb") as f:
+            f.write(b"# Shared\n")
+        register_files_in_db(["shared.md"], project.id, False, {"shared.md": store_blob(os.path.join(dir_path, "shared.md"))})
+    yield projects
+    request_context.pop()
+    # SQLite does not enforce the ON DELETE CASCADE of files.project_id
+    for project in projects:
+        shutil.rmtree(os.path.join(project.path, project.project_name))
+        File.query.filter_by(project_id=project.id).delete()
+        db.session.delete(project)
+    db.session.delete(user)
+    db.session.commit()
+
+def test_in_place_write_keeps_other_project_unchanged(projects):
+    first, second = [os.path.join(project.path, project.project_name) for project in projects]
+    digest = File.query.filter_by(project_id=projects[0].id, filename="shared.md").one().digest
+    assert os.path.samefile(os.path.join(first, "shared.md"), os.path.join(second, "shared.md"))
+
+    def step() -> bool:
+        # The module writes in place into a file that is not one of the step files
+        with open(os.path.join(first, "shared.md"), "r+b") as f:
+            f.write(b"# Change")
+        return True
+
+    assert run_maker_step(first, projects[0].id, ["article.docx"], step)
+    with open(os.path.join(second, "shared.md"), "rb") as f:
+        assert f.read() == b"# Shared\n"
+    with open(get_blob_path(digest), "rb") as f:
+        assert f.read() == b"# Shared\n"
+    # The changed file is registered with its new content; the other project still links to the blob
+    assert File.query.filter_by(project_id=projects[0].id, filename="shared.md").one().digest != digest
+    assert os.path.samefile(os.path.join(second, "shared.md"), get_blob_path(digest))
+
+def test_unchanged_files_are_linked_again(projects):
+    first = os.path.join(projects[0].path, projects[0].project_name)
+    digest = File.query.filter_by(project_id=projects[0].id, filename="shared.md").one().digest
+    assert run_maker_step(first, projects[0].id, [], lambda: True)
+    assert os.path.samefile(os.path.join(first, "shared.md"), get_blob_path(digest))
@@ -0,0 +1,52 @@
+# Copyright (c) 2024 Thomas Jurczyk
+# This software is provided under the MIT License.
+# For more information, please refer to the LICENSE file in the root directory of this project.
+
+import hashlib, io, os
+from datetime import datetime
+import pytest
+from werkzeug.exceptions import ClientDisconnected
+from mmm import db
+from mmm.auth.models import User
+from mmm.maker_project.models import Project, File
+from mmm.maker_project.tools import ChunkedUploadError, init_chunked_upload, get_upload_offset, write_upload_chunk, finalize_chunked_upload
+
+class DisconnectingStream(io.BytesIO):
+    '''Request body whose client disconnects after the given bytes have been read.'''
+
+    def read(self, size=-1):
+        block = super().read(size)
+        if not block:
+            raise ClientDisconnected()
+        return block
+
+@pytest.fixture
+def project(app_context):
+    user = User("uploader", "password", "uploader@mmm.org")
+    db.session.add(user)
+    db.session.flush()
+    project = Project(f"uploads/{user.username}", "chunks", datetime.now(), datetime.now())
+    db.session.add(project)
+    db.session.commit()
+    os.makedirs(os.path.join(project.path, project.project_name))
+    yield project
+    # SQLite does not enforce the ON DELETE CASCADE of files.project_id
+    File.query.filter_by(project_id=project.id).delete()
+    db.session.delete(project)
+    db.session.delete(user)
+    db.session.commit()
+
+def test_client_disconnect_returns_offset(project):
+    content = os.urandom(200 * 1024)
+    user_id = User.query.filter_by(username="uploader").one().id
+    upload = init_chunked_upload(project, "big.docx", len(content), user_id)
+    with pytest.raises(ChunkedUploadError) as error:
+        write_upload_chunk(project, upload, 0, DisconnectingStream(content[:100 * 1024]))
+    assert error.value.offset == 100 * 1024
+    assert get_upload_offset(project, upload) == 100 * 1024
+    # The client continues at the offset; the digest is computed from the part file
+    assert write_upload_chunk(project, upload, 100 * 1024, io.BytesIO(content[100 * 1024:])) == len(content)
+    file, digest = finalize_chunked_upload(project, upload, user_id, hashlib.sha256(content).hexdigest())
+    assert digest == hashlib.sha256(content).hexdigest()
+    with open(os.path.join(project.path, project.project_name, file.filename), "rb") as f:
+        assert f.read() == content
@@ -0,0 +1,77 @@
+# Copyright (c) 2024 Thomas Jurczyk
+# This software is provided under the MIT License.
+# For more information, please refer to the LICENSE file in the root directory of this project.
+
+import io, os, shutil
+from datetime import datetime
+import pytest
+from werkzeug.datastructures import FileStorage
+from mmm import db
+from mmm.auth.models import User
+from mmm.maker_project.models import Project, File, FileVersion
+from mmm.maker_project.tools import ingest_uploaded_files, delete_files, get_version_path, remove_file_versions
+from mmm.maker_project.tools.trash import get_trash_path
+
+@pytest.fixture
+def project(app_context):
+    user = User("versions", "password", "versions@mmm.org")
+    db.session.add(user)
+    db.session.flush()
+    project = Project(f"uploads/{user.username}", "drafts", datetime.now(), datetime.now())
+    db.session.add(project)
+    db.session.commit()
+    os.makedirs(os.path.join(project.path, project.project_name))
+    yield project
+    shutil.rmtree(os.path.join(project.path, project.project_name))
+    # SQLite does not enforce the ON DELETE CASCADE of files.project_id and file_versions.file_id
+    file_ids = [file.id for file in File.query.filter_by(project_id=project.id).all()]
+    FileVersion.query.filter(FileVersion.file_id.in_(file_ids)).delete()
+    File.query.filter_by(project_id=project.id).delete()
+    db.session.delete(project)
+    db.session.delete(user)
+    db.session.commit()
+
+def upload(project: Project, *files) -> list:
+    user_id = User.query.filter_by(username="versions").one().id
+    return ingest_uploaded_files(project, [FileStorage(io.BytesIO(content), filename) for filename, content in files], user_id)
+
+def read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+def test_upload_with_existing_name_becomes_new_version(project):
+    upload(project, ("article.md", b"first draft"))
+    file_id = File.query.filter_by(project_id=project.id, filename="article.md").one().id
+    upload(project, ("article.md", b"second draft, longer"))
+    # The row of the file is kept; the old content is archived as version 1
+    file = File.query.filter_by(project_id=project.id, filename="article.md").one()
+    assert (file.id, file.version) == (file_id, 2)
+    assert [(version.version, version.size) for version in FileVersion.query.filter_by(file_id=file_id).all()] == [(1, len(b"first draft"))]
+    assert read(get_version_path(project, file_id, 1)) == b"first draft"
+    assert read(os.path.join(project.path, project.project_name, "article.md")) == b"second draft, longer"
+    # Old versions are hidden from the project folder listing
+    assert sorted(name for name in os.listdir(os.path.join(project.path, project.project_name)) if not name.startswith(".")) == ["article.md"]
+
+def test_same_name_twice_in_one_upload(project):
+    upload(project, ("article.md", b"first"), ("article.md", b"second"))
+    file = File.query.filter_by(project_id=project.id, filename="article.md").one()
+    assert file.version == 2
+    assert read(get_version_path(project, file.id, 1)) == b"first"
+    assert read(os.path.join(project.path, project.project_name, "article.md")) == b"second"
+
+def test_deleted_file_versions_are_removed(project):
+    upload(project, ("article.md", b"first"))
+    upload(project, ("article.md", b"second"))
+    upload(project, ("article.md", b"third"))
+    file = File.query.filter_by(project_id=project.id, filename="article.md").one()
+    file_id = file.id
+    versions_path = os.path.dirname(get_version_path(project, file_id, 1))
+    assert sorted(os.listdir(versions_path)) == ["1", "2"]
+    assert delete_files(project, [file]) == (["article.md"], [])
+    assert FileVersion.query.filter_by(file_id=file_id).count() == 0
+    assert not os.path.exists(versions_path)
+    # The versions are moved to the trash (emptied by the job worker)
+    trashed = [entry.path for entry in os.scandir(get_trash_path()) if entry.name.endswith(f"-{file_id}")]
+    assert len(trashed) == 1 and sorted(os.listdir(trashed[0])) == ["1", "2"]
+    # Nothing to do if a file has no old versions
+    remove_file_versions(project, file_id)
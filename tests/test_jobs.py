@@ -0,0 +1,95 @@
+# Copyright (c) 2024 Thomas Jurczyk
+# This software is provided under the MIT License.
+# For more information, please refer to the LICENSE file in the root directory of this project.
+
+import threading
+from datetime import datetime
+import pytest
+from mmm import db
+from mmm.auth.models import User
+from mmm.maker_project.models import Project, Job
+from mmm.maker_project.tools import enqueue_maker_job, enqueue_maker_pipeline, claim_next_job, reset_interrupted_jobs
+
+XML2YAML_DATA = {"volume_number": "", "orcids": None, "year": "", "doi": None}
+
+@pytest.fixture
+def projects(app_context):
+    user = User("worker", "password", "worker@mmm.org")
+    db.session.add(user)
+    db.session.flush()
+    projects = [Project(f"uploads/{user.username}", name, datetime.now(), datetime.now()) for name in ["first", "second"]]
+    db.session.add_all(projects)
+    db.session.commit()
+    yield projects
+    for project in projects:
+        Job.query.filter_by(project_id=project.id).delete()
+        db.session.delete(project)
+    db.session.delete(user)
+    db.session.commit()
+
+def get_user_id() -> int:
+    return User.query.filter_by(username="worker").one().id
+
+def enqueue(project: Project, mmm_choice: str, selected_files: list, file_name: str = "") -> int:
+    return enqueue_maker_job(project.id, get_user_id(), mmm_choice, selected_files, XML2YAML_DATA, False, file_name).id
+
+def finish(job_id: int, status: str = "finished") -> None:
+    Job.query.filter_by(id=job_id).update({"status": status, "finished_at": datetime.now()})
+    db.session.commit()
+
+def test_claim_runs_steps_with_separate_files_together(projects):
+    project = projects[0]
+    first_doc2md = enqueue(project, "doc2md", ["article.docx"])
+    second_doc2md = enqueue(project, "doc2md", ["article.docx"])
+    xml2yaml = enqueue(project, "xml2yaml", ["article.xml"])
+    # Reads clean_markdown.md, which the second DOC2MD writes
+    dw = enqueue(project, "dw", ["metadata.yaml", "clean_markdown.md"], "article")
+    assert claim_next_job().id == first_doc2md
+    assert claim_next_job().id == xml2yaml
+    assert claim_next_job() is None
+    finish(first_doc2md)
+    assert claim_next_job().id == second_doc2md
+    finish(xml2yaml)
+    # The Maker step waits for the older DOC2MD, although it does not conflict with a running job of its own
+    assert claim_next_job() is None
+    finish(second_doc2md)
+    assert claim_next_job().id == dw
+
+def test_claim_follows_pipeline_dependencies(projects):
+    doc2md, xml2yaml, verifybibtex, dw = [job.id for job in enqueue_maker_pipeline(projects[0].id, get_user_id(), ["article.docx", "article.xml"], XML2YAML_DATA, True, "article")]
+    assert {claim_next_job().id, claim_next_job().id} == {doc2md, xml2yaml}
+    assert claim_next_job() is None
+    finish(xml2yaml)
+    finish(doc2md, "failed")
+    assert claim_next_job() is None
+    assert {job.status for job in Job.query.filter(Job.id.in_([verifybibtex, dw])).all()} == {"failed"}
+
+def test_concurrent_claims_do_not_run_conflicting_jobs(app, projects):
+    job_ids = [enqueue(project, "doc2md", ["article.docx"]) for _ in range(5) for project in projects]
+    claimed = []
+
+    def claim_jobs():
+        with app.app_context():
+            for _ in range(5):
+                job = claim_next_job()
+                if job is not None:
+                    claimed.append((job.id, job.project_id))
+
+    threads = [threading.Thread(target=claim_jobs) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # One DOC2MD per project (the oldest one); every job is claimed at most once
+    assert sorted(claimed) == sorted(zip(job_ids[:2], [project.id for project in projects]))
+    db.session.expire_all()
+    assert Job.query.filter(Job.id.in_(job_ids), Job.status == "running").count() == 2
+
+def test_reset_interrupted_jobs(projects):
+    running = enqueue(projects[0], "doc2md", ["article.docx"])
+    queued = enqueue(projects[1], "doc2md", ["article.docx"])
+    assert claim_next_job().id == running
+    assert reset_interrupted_jobs() == 1
+    assert Job.query.get(running).status == "failed"
+    # Queued jobs are picked up after the restart
+    assert claim_next_job().id == queued
@@ -0,0 +1,52 @@
+# Copyright (c) 2024 Thomas Jurczyk
+# This software is provided under the MIT License.
+# For more information, please refer to the LICENSE file in the root directory of this project.
+
+import os
+import pytest
+import sqlalchemy as sa
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+from flask_migrate import Migrate, upgrade
+
+MIGRATIONS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migrations")
+
+@pytest.fixture
+def migration_app(tmp_path):
+    '''Minimal app with an empty SQLite database for running the migrations (without the models of mmm).'''
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path / 'migrations.db'}"
+    migration_db = SQLAlchemy(app)
+    Migrate(app, migration_db, directory=MIGRATIONS_PATH, render_as_batch=True)
+    with app.app_context():
+        yield migration_db
+
+def execute(db, statement: str, **parameters):
+    with db.engine.begin() as connection:
+        return connection.execute(sa.text(statement), parameters).all() if statement.startswith("SELECT") else connection.execute(sa.text(statement), parameters)
+
+def test_0003_merges_duplicates(migration_app):
+    db = migration_app
+    upgrade(directory=MIGRATIONS_PATH, revision="0002")
+    execute(db, "INSERT INTO users (id, username) VALUES (1, 'alice'), (2, 'bob')")
+    # Project 'p' exists twice (2 is newer), both with alice's grant and a file a.md; bob only has a grant for 1
+    execute(db, "INSERT INTO projects (id, path, project_name, created_at, changed_at) VALUES (1, 'uploads/alice', 'p', '2024-01-01', '2024-01-01'), (2, 'uploads/alice', 'p', '2024-02-01', '2024-02-01'), (3, 'uploads/alice', 'q', '2024-01-01', '2024-01-01')")
+    execute(db, "INSERT INTO user_projects (id, user_id, project_id, permission, creator) VALUES (1, 1, 1, 'rwd', 1), (2, 1, 2, 'r', 0), (3, 2, 1, 'rw', 0), (4, 2, 3, 'r', 0), (5, 2, 3, 'rw', 0)")
+    execute(db, "INSERT INTO files (id, filename, project_id, created_by, created_at, changed_at, production_file, download_number) VALUES (1, 'a.md', 1, 1, '2024-01-01', '2024-03-01', 0, 0), (2, 'a.md', 2, 1, '2024-02-01', '2024-02-01', 0, 0), (3, 'b.md', 1, 1, '2024-01-01', '2024-01-01', 0, 0), (4, 'c.md', 3, 1, '2024-01-01', '2024-01-01', 0, 0), (5, 'c.md', 3, 1, '2024-01-01', '2024-01-01', 0, 0)")
+    execute(db, "INSERT INTO jobs (id, project_id, created_by, mmm_choice, arguments, status, created_at) VALUES (1, 1, 1, 'doc2md', '{}', 'finished', '2024-01-01')")
+    execute(db, "INSERT INTO uploads (id, project_id, created_by, filename, size, created_at, changed_at) VALUES ('u1', 1, 1, 'big.docx', 10, '2024-01-01', '2024-01-01')")
+
+    upgrade(directory=MIGRATIONS_PATH, revision="0003")
+
+    assert execute(db, "SELECT id, project_name FROM projects ORDER BY id") == [(2, "p"), (3, "q")]
+    # The newest a.md (changed_at) is kept; b.md is moved to the kept project
+    assert execute(db, "SELECT id, filename, project_id FROM files ORDER BY id") == [(1, "a.md", 2), (3, "b.md", 2), (5, "c.md", 3)]
+    # Grants of the same user are merged into the newest one with all permissions
+    assert execute(db, "SELECT id, user_id, project_id, permission, creator FROM user_projects ORDER BY id") == [(2, 1, 2, "rwd", 1), (3, 2, 2, "rw", 0), (5, 2, 3, "rw", 0)]
+    assert execute(db, "SELECT project_id FROM jobs") == [(2,)]
+    assert execute(db, "SELECT project_id FROM uploads") == [(2,)]
+
+def test_migrations_upgrade_empty_database(migration_app):
+    upgrade(directory=MIGRATIONS_PATH)
+    tables = sa.inspect(migration_app.engine).get_table_names()
+    assert {"users", "projects", "files", "user_projects", "jobs", "uploads", "file_versions"} <= set(tables)
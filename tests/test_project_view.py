@@ -0,0 +1,73 @@
+# Copyright (c) 2024 Thomas Jurczyk
+# This software is provided under the MIT License.
+# For more information, please refer to the LICENSE file in the root directory of this project.
+
+from datetime import datetime
+import pytest
+from mmm import db
+from mmm.auth.models import User
+from mmm.maker_project.models import Project, File, UserProject
+from mmm.maker_project.tools import load_project_view
+
+PASSWORD = "password"
+
+def create_project(name: str, collaborators: int, files: int) -> Project:
+    '''Create a project of a new owner with the given number of collaborators (besides the owner) and files.'''
+    now = datetime.now()
+    users = [User(f"{name}-user-{index}", PASSWORD, f"{name}-user-{index}@mmm.org") for index in range(collaborators + 1)]
+    db.session.add_all(users)
+    project = Project(f"uploads/{users[0].username}", name, now, now)
+    db.session.add(project)
+    db.session.flush()
+    db.session.add_all(UserProject(user.id, project.id, "rwd" if index == 0 else "r", index == 0) for index, user in enumerate(users))
+    db.session.add_all(File(f"file-{index:03}.md", project.id, users[0].id, now, now, index % 5 == 0, 0) for index in range(files))
+    db.session.commit()
+    return project
+
+@pytest.fixture(scope="module")
+def projects(app):
+    '''A large project (50 collaborators, 500 files) and a small one (no collaborators, one file).'''
+    with app.app_context():
+        large = create_project("large", 50, 500)
+        small = create_project("small", 0, 1)
+        return {"large": large.id, "small": small.id}
+
+def get_owner_id(project_id: int) -> int:
+    return UserProject.query.filter_by(project_id=project_id, creator=True).one().user_id
+
+def test_load_project_view_query_count(app_context, projects, count_queries):
+    project_id = projects["large"]
+    owner_id = get_owner_id(project_id)
+    db.session.expire_all()
+    with count_queries() as queries:
+        view = load_project_view(project_id, owner_id)
+        # The attributes used by the template must not trigger lazy loads
+        [(file.filename, file.changed_at, file.created_by) for file in view.user_files + view.production_files]
+        view.project.project_name
+    assert len(queries) == 2
+    assert len(view.user_names) == 51
+    assert view.user_names[0] == "large-user-0"
+    assert len(view.user_files) == 400
+    assert len(view.production_files) == 100
+    assert view.user_files == sorted(view.user_files, key=lambda file: file.filename)
+    assert view.permission == "rwd"
+
+def test_load_project_view_permission_of_collaborator(app_context, projects):
+    project_id = projects["large"]
+    collaborator = User.query.filter_by(username="large-user-7").one()
+    assert load_project_view(project_id, collaborator.id).permission == "r"
+
+def test_load_project_view_without_access(app_context, projects):
+    outsider = User.query.filter_by(username="small-user-0").one()
+    assert load_project_view(projects["large"], outsider.id) is None
+
+def test_show_project_files_query_count_does_not_grow(app, projects, count_queries):
+    query_counts = {}
+    for name, project_id in projects.items():
+        client = app.test_client()
+        client.post("/auth/login", data={"username": f"{name}-user-0", "password": PASSWORD})
+        with count_queries() as queries:
+            response = client.get(f"/maker-project/show-project-files/{project_id}")
+        assert response.status_code == 200
+        query_counts[name] = len(queries)
+    assert query_counts["large"] == query_counts["small"]
@@ -0,0 +1,80 @@
+# Copyright (c) 2024 Thomas Jurczyk
+# This software is provided under the MIT License.
+# For more information, please refer to the LICENSE file in the root directory of this project.
+
+import os, shutil
+from datetime import datetime
+import pytest
+from flask_login import login_user
+from mmm import db
+from mmm.auth.models import User
+from mmm.maker_project.models import Project, File
+from mmm.maker_project.tools import register_files_in_db, run_maker_step
+
+@pytest.fixture
+def project(app, app_context):
+    user = User("registrar", "password", "registrar@mmm.org")
+    db.session.add(user)
+    db.session.flush()
+    project = Project(f"uploads/{user.username}", "outputs", datetime.now(), datetime.now())
+    db.session.add(project)
+    db.session.commit()
+    os.makedirs(os.path.join(project.path, project.project_name))
+    # Files are registered in the name of current_user (as in run_job)
+    with app.test_request_context():
+        login_user(user)
+        yield project
+    shutil.rmtree(os.path.join(project.path, project.project_name))
+    # SQLite does not enforce the ON DELETE CASCADE of files.project_id
+    File.query.filter_by(project_id=project.id).delete()
+    db.session.delete(project)
+    db.session.delete(user)
+    db.session.commit()
+
+def get_files(project: Project) -> dict:
+    db.session.expire_all()
+    return {file.filename: file for file in File.query.filter_by(project_id=project.id).all()}
+
+def test_register_files_upserts(project):
+    register_files_in_db(["a.md", "b.md", "b.md"], project.id, False, {"a.md": "1" * 64})
+    files = get_files(project)
+    assert sorted(files) == ["a.md", "b.md"]
+    file_id, created_at, changed_at = files["a.md"].id, files["a.md"].created_at, files["a.md"].changed_at
+    # Registering an existing file updates it (unique constraint on project_id and filename)
+    register_files_in_db(["a.md"], project.id, True, {"a.md": "2" * 64})
+    file = get_files(project)["a.md"]
+    assert (file.id, file.created_at, file.production_file, file.digest) == (file_id, created_at, True, "2" * 64)
+    assert file.changed_at > changed_at
+    # A production file stays a production file
+    register_files_in_db(["a.md"], project.id, False)
+    assert get_files(project)["a.md"].production_file
+    assert File.query.filter_by(project_id=project.id).count() == 2
+
+def test_register_files_rejects_unknown_database(project, monkeypatch):
+    monkeypatch.setattr(db.session.get_bind().dialect, "name", "oracle")
+    with pytest.raises(NotImplementedError):
+        register_files_in_db(["a.md"], project.id, False)
+
+def test_step_outputs_are_registered_from_directory_diff(project):
+    dir_path = os.path.join(project.path, project.project_name)
+    for name in ["article.docx", "unchanged.md", "changed.md"]:
+        with open(os.path.join(dir_path, name), "w") as f:
+            f.write(name)
+    register_files_in_db(["article.docx", "unchanged.md", "changed.md"], project.id, False)
+    changed_at = get_files(project)["unchanged.md"].changed_at
+
+    def step() -> bool:
+        # Creates a file that is not declared as step file and changes an existing one
+        with open(os.path.join(dir_path, "figure.svg"), "w") as f:
+            f.write("svg")
+        with open(os.path.join(dir_path, "changed.md"), "a") as f:
+            f.write(" changed")
+        return True
+
+    assert run_maker_step(dir_path, project.id, ["article.docx"], step)
+    files = get_files(project)
+    assert sorted(files) == ["article.docx", "changed.md", "figure.svg", "unchanged.md"]
+    assert files["figure.svg"].production_file and files["changed.md"].production_file
+    assert files["figure.svg"].digest is not None
+    assert not files["unchanged.md"].production_file
+    assert files["unchanged.md"].changed_at == changed_at
@@ -0,0 +1,43 @@
+# Copyright (c) 2024 Thomas Jurczyk
+# This software is provided under the MIT License.
+# For more information, please refer to the LICENSE file in the root directory of this project.
+
+import json, os
+import pytest
+from mmm.maker_project.tools import result_cache
+from mmm.maker_project.tools.result_cache import run_cached_step, MANIFEST_NAME
+
+@pytest.fixture
+def cache(app, app_context, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, "RESULT_CACHE_ENABLED", True)
+    monkeypatch.setitem(app.config, "RESULT_CACHE_PATH", str(tmp_path / "cache"))
+    monkeypatch.setattr(result_cache, "get_image_digest", lambda image: "sha256:test")
+    dir_path = tmp_path / "project"
+    dir_path.mkdir()
+    (dir_path / "article.docx").write_bytes(b"DOCX")
+    return dir_path
+
+def write(path, content: bytes) -> bool:
+    with open(path, "wb") as f:
+        f.write(content)
+    return True
+
+def test_only_outputs_of_the_run_are_cached(cache):
+    dir_path = str(cache)
+    # Leftover of an older run with a modification time in the future (e.g., clock skew of the container)
+    write(os.path.join(dir_path, "bibliography.bib"), b"old")
+    os.utime(os.path.join(dir_path, "bibliography.bib"), (2e9, 2e9))
+    assert run_cached_step("doc2md", dir_path, ["article.docx"], {}, "doc2md", ["clean_markdown.md", "bibliography.bib"], lambda: write(os.path.join(dir_path, "clean_markdown.md"), b"# Article"))
+    entries = [entry for entry in os.listdir(result_cache.get_cache_path()) if not entry.startswith(".")]
+    assert len(entries) == 1
+    with open(os.path.join(result_cache.get_cache_path(), entries[0], MANIFEST_NAME)) as f:
+        assert json.load(f)["files"] == ["clean_markdown.md"]
+
+def test_cache_hit_restores_outputs(cache):
+    dir_path = str(cache)
+    step = lambda: write(os.path.join(dir_path, "clean_markdown.md"), b"# Article")
+    assert run_cached_step("doc2md", dir_path, ["article.docx"], {}, "doc2md", ["clean_markdown.md"], step)
+    os.remove(os.path.join(dir_path, "clean_markdown.md"))
+    assert run_cached_step("doc2md", dir_path, ["article.docx"], {}, "doc2md", ["clean_markdown.md"], lambda: pytest.fail("the step must not run on a cache hit"))
+    with open(os.path.join(dir_path, "clean_markdown.md"), "rb") as f:
+        assert f.read() == b"# Article"
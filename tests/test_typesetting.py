@@ -0,0 +1,71 @@
+# Copyright (c) 2024 Thomas Jurczyk
+# This software is provided under the MIT License.
+# For more information, please refer to the LICENSE file in the root directory of this project.
+
+import os
+import pytest
+from mmm.maker_project.tools import file_creation_functions
+from mmm.maker_project.tools.file_creation_functions import create_files_dw, create_files_dw_parallel
+
+@pytest.fixture
+def project_folder(app, tmp_path, monkeypatch):
+    '''Project folder with the inputs of the typesetting step; the containers are simulated (see fake_container).'''
+    monkeypatch.setitem(app.config, "UPLOAD_PATH", str(tmp_path))
+    for name, content in [("article.md", "# Article"), ("metadata.yaml", "title: Article"), ("figure.png", "png")]:
+        (tmp_path / name).write_text(content)
+    containers = []
+    failing_formats = set()
+
+    def fake_container(image, mounts, container_arguments, environment={}):
+        '''Writes the output files, a generated figure, and PROCESS.log like the typesetting container.'''
+        staging_path = mounts[0][0]
+        formats = [argument[2:] for argument in container_arguments if argument in ["--pdf", "--html", "--jats", "--tex"]]
+        containers.append((staging_path, sorted(os.listdir(staging_path)), formats))
+        filename = container_arguments[container_arguments.index("--filename") + 1]
+        with open(os.path.join(staging_path, "PROCESS.log"), "w") as f:
+            f.write(f"log {' '.join(formats)}")
+        if failing_formats & set(formats):
+            return 1
+        for format in formats:
+            with open(os.path.join(staging_path, f"{filename}.{format}"), "w") as f:
+                f.write(format)
+            with open(os.path.join(staging_path, f"figure-{format}.svg"), "w") as f:
+                f.write("svg")
+        return 0
+
+    monkeypatch.setattr(file_creation_functions, "run_module_container", fake_container)
+    with app.test_request_context():
+        yield str(tmp_path), containers, failing_formats
+
+def test_parallel_formats_are_staged_and_merged(project_folder):
+    dir_path, containers, _ = project_folder
+    done = []
+    assert create_files_dw_parallel(dir_path, "article.md", "metadata.yaml", None, "article", ["pdf", "html"], on_format_done=done.append)
+    # One staging folder per format with the inputs and images
+    assert len({staging_path for staging_path, _, _ in containers}) == 2
+    assert all(files == ["article.md", "figure.png", "metadata.yaml"] for _, files, _ in containers)
+    assert sorted(done) == ["article.html", "article.pdf"]
+    assert sorted(os.listdir(dir_path)) == ["article.PROCESS.log", "article.html", "article.md", "article.pdf", "figure-html.svg", "figure-pdf.svg", "figure.png", "metadata.yaml"]
+    with open(os.path.join(dir_path, "article.PROCESS.log")) as f:
+        assert f.read() == "===== PDF =====\nlog pdf\n===== HTML =====\nlog html\n"
+
+def test_failed_format_keeps_other_formats(project_folder):
+    dir_path, _, failing_formats = project_folder
+    failing_formats.add("pdf")
+    done = []
+    assert not create_files_dw_parallel(dir_path, "article.md", "metadata.yaml", None, "article", ["pdf", "html"], on_format_done=done.append)
+    assert done == ["article.html"]
+    assert not os.path.exists(os.path.join(dir_path, "article.pdf"))
+    # The staging folders are removed; the log of the failed format is kept
+    assert not [name for name in os.listdir(dir_path) if name.startswith(".maker-")]
+    with open(os.path.join(dir_path, "article.PROCESS.log")) as f:
+        assert "log pdf" in f.read()
+
+def test_single_container_runs_in_staging_folder(project_folder):
+    dir_path, containers, _ = project_folder
+    assert create_files_dw(dir_path, "article.md", "metadata.yaml", filename="article", output_formats=["pdf", "html"])
+    assert [formats for _, _, formats in containers] == [["pdf", "html"]]
+    assert containers[0][0] != dir_path
+    with open(os.path.join(dir_path, "article.PROCESS.log")) as f:
+        assert f.read() == "log pdf html"
+    assert not os.path.exists(os.path.join(dir_path, "PROCESS.log"))
@@ -0,0 +1,68 @@
+# Copyright (c) 2024 Thomas Jurczyk
+# This software is provided under the MIT License.
+# For more information, please refer to the LICENSE file in the root directory of this project.
+
+import signal, threading, time, traceback
+from mmm import create_app
+from mmm.maker_project.tools import job_worker_loop, reset_interrupted_jobs, remove_stale_uploads, remove_unused_blobs, empty_trash, warm_up_container_pools, shutdown_container_pools
+
+def run_worker() -> None:
+    """
+    Starts the job worker that runs the Maker steps queued by the web application.
+
+    The worker starts MAKER_WORKER_THREADS threads (default: 2); each of them claims queued jobs from the
+    jobs table and runs the corresponding Maker step. The gunicorn workers only enqueue jobs, so long-running
+    Docker containers never block the web application. The main thread empties the trash (deleted projects
+    and files) and removes unused blobs of the blob store. SIGTERM/SIGINT stop the worker after the running
+    jobs are done.
+
+    Returns
+    -------
+        None
+    """
+    app = create_app()
+    with app.app_context():
+        reset = reset_interrupted_jobs()
+        if reset:
+            print(f"{reset} interrupted job(s) marked as failed.")
+        removed = remove_stale_uploads()
+        if removed:
+            print(f"{removed} stale chunked upload(s) removed.")
+        removed = empty_trash()
+        if removed:
+            print(f"{removed} deleted project folder(s) and file(s) removed from the trash.")
+        removed = remove_unused_blobs()
+        if removed:
+            print(f"{removed} unused blob(s) removed.")
+        # Start the long-lived module containers (only if CONTAINER_EXECUTION_MODE is pool)
+        warm_up_container_pools()
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+    number_of_threads = int(app.config.get('MAKER_WORKER_THREADS', 2))
+    threads = [threading.Thread(target=job_worker_loop, args=(app, stop_event), name=f"mmm-worker-{i}") for i in range(number_of_threads)]
+    for thread in threads:
+        thread.start()
+    print(f"Job worker started with {number_of_threads} thread(s).")
+    # The trash is emptied every TRASH_INTERVAL seconds (default: 10), blobs of deleted files are removed every
+    # BLOB_GC_INTERVAL seconds (default: 1 hour)
+    trash_interval = float(app.config.get('TRASH_INTERVAL', 10))
+    blob_gc_interval = float(app.config.get('BLOB_GC_INTERVAL', 3600))
+    last_blob_gc = time.monotonic()
+    while not stop_event.wait(trash_interval):
+        with app.app_context():
+            try:
+                empty_trash()
+                if time.monotonic() - last_blob_gc >= blob_gc_interval:
+                    remove_unused_blobs()
+                    last_blob_gc = time.monotonic()
+            except Exception:
+                app.logger.critical(f"Worker maintenance error: {traceback.format_exc()}")
+    for thread in threads:
+        thread.join()
+    with app.app_context():
+        shutdown_container_pools()
+    print("Job worker stopped.")
+
+if __name__ == "__main__":
+    run_worker()